@@ -0,0 +1,574 @@
+import asyncio
+import inspect
+from functools import wraps
+from . import config
+from . import models
+from .graph_auth import resolve_access_token
+from .graph_utils import MAX_PAGE_SIZE, GROUP_PROPERTIES, USER_PROPERTIES
+from .utils import decorators
+from .utils import coalescing
+from .utils import metrics
+from .utils import throttling
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+class AsyncGraphClient:
+    """
+    asyncio Graph API client built on a shared httpx.AsyncClient.
+
+    At most max_concurrency requests are in flight at the same time; further requests wait for a free slot.
+    Every graph_utils operation is available as a coroutine method, and the client can be passed to the
+    coroutine functions of this module. They also take an access token or a token provider, and then
+    use a client of their own for the call.
+
+    Args:
+        access_token (str | TokenProvider): Graph API access token, or a token provider asked for a token on every request.
+        max_concurrency (int, optional): Maximum number of concurrent requests. Defaults to 32.
+        timeout (float, optional): Timeout in seconds for each request. Defaults to None (no timeout).
+        http_client (httpx.AsyncClient, optional): Client to send requests with. Defaults to a new client owned by this object.
+        retry_policy (RetryPolicy, optional): Retries for throttled and transient failures. Defaults to RetryPolicy().
+        rate_limiter (AdaptiveRateLimiter, optional): Limiter shared with other clients. Defaults to the limiter of the
+            token provider's tenant.
+        coalescer (AsyncRequestCoalescer, optional): Lets identical concurrent GET requests share one HTTP call.
+            Defaults to a coalescer owned by the client. Pass AsyncRequestCoalescer(enabled=False) to disable coalescing.
+
+    Raises:
+        ImportError: If httpx is not installed.
+    """
+
+    def __init__(self, access_token, max_concurrency:int = DEFAULT_MAX_CONCURRENCY, timeout:float = None,
+                 http_client=None, retry_policy:throttling.RetryPolicy = None, rate_limiter:throttling.AdaptiveRateLimiter = None,
+                 coalescer:coalescing.AsyncRequestCoalescer = None):
+
+        if httpx is None:
+            raise ImportError('azure_graph_toolkit.aio requires httpx. Install it with: pip install azure-graph-toolkit[async]')
+
+        self.access_token = access_token
+        self.max_concurrency = max_concurrency
+        self.retry_policy = retry_policy or throttling.RetryPolicy()
+        self.rate_limiter = rate_limiter or throttling.get_rate_limiter(getattr(access_token, 'tenant_id', None))
+        self.coalescer = coalescer or coalescing.AsyncRequestCoalescer()
+        self._owns_http_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+        self.headers = {
+            'Content-type': 'application/json',
+            'ConsistencyLevel': 'eventual'
+        }
+        # Created on first use so that it binds to the running event loop.
+        self._semaphore = None
+
+    async def request(self, method:str, url:str, headers:dict = None, **kwargs):
+        """
+        Sends a request to the Graph API once a concurrency slot is free, retrying throttled and transient failures.
+
+        Identical GET requests in flight at the same time share one HTTP call and its response.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The request URL.
+            headers (dict, optional): Extra headers, merged over the default ones.
+            **kwargs: Passed on to httpx.AsyncClient.request.
+
+        Returns:
+            httpx.Response: The HTTP response."""
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        request_headers = dict(self.headers)
+        request_headers['Authorization'] = f'Bearer {await self._get_token()}'
+        if headers:
+            request_headers.update(headers)
+
+        async def send():
+            async with self._semaphore:
+                return await self.http_client.request(method, url, headers=request_headers, **kwargs)
+
+        recorder = metrics.get_recorder()
+        if recorder is not None:
+            send = recorder.wrap_asend(method, url, send)
+
+        idempotent = method in throttling.IDEMPOTENT_METHODS
+        key = None
+        if method == 'GET' and self.coalescer.enabled:
+            key = coalescing.request_key(method, url, request_headers['Authorization'], kwargs.get('params'), headers)
+
+        return await self.coalescer.call(key, lambda: self.retry_policy.acall(send, self.rate_limiter, idempotent))
+
+    async def get(self, url:str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url:str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def patch(self, url:str, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+    async def delete(self, url:str, **kwargs):
+        return await self.request('DELETE', url, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the connections if the httpx client was created by this object."""
+
+        if self._owns_http_client:
+            await self.http_client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _get_token(self) -> str:
+        if isinstance(self.access_token, str):
+            return self.access_token
+        # A token provider may have to fetch a token over blocking HTTP.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, resolve_access_token, self.access_token)
+
+    # Graph operations
+
+    async def get_group_by_name(self, group_name:str) -> dict:
+        return await get_group_by_name(group_name, self)
+
+    async def get_user_from_upn(self, user_upn:str) -> dict:
+        return await get_user_from_upn(user_upn, self)
+
+    async def get_user_membership_groups(self, user_upn:str) -> dict:
+        return await get_user_membership_groups(user_upn, self)
+
+    async def is_user_member_of(self, user_upn:str, group_name:str) -> bool:
+        return await is_user_member_of(user_upn, group_name, self)
+
+    async def get_user_group_by_name(self, user_id:str, group_name:str) -> dict:
+        return await get_user_group_by_name(user_id, group_name, self)
+
+    async def add_user_to_group(self, user_upn:str, group_name:str) -> dict:
+        return await add_user_to_group(user_upn, group_name, self)
+
+    async def remove_user_from_group(self, user_upn:str, group_name:str) -> dict:
+        return await remove_user_from_group(user_upn, group_name, self)
+
+    async def user_reset_password(self, user_upn:str, new_password:str, force_change_password_next_signin:bool = False) -> dict:
+        return await user_reset_password(user_upn, new_password, self, force_change_password_next_signin)
+
+    async def user_revoke_sessions(self, user_upn:str) -> dict:
+        return await user_revoke_sessions(user_upn, self)
+
+    async def user_set_account_status(self, user_upn:str, enable_account:bool) -> dict:
+        return await user_set_account_status(user_upn, enable_account, self)
+
+
+def _accepts_access_token(func):
+    """
+    Decorator letting a coroutine function or async generator take an access token or a token
+    provider in place of its client argument, like the graph_utils functions. A client is then
+    created for the call and closed when it returns.
+
+    Args:
+        func (function): The function with a client parameter.
+
+    Returns:
+        function: The decorated function."""
+
+    signature = inspect.signature(func)
+
+    def bind(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        client = bound.arguments['client']
+        return bound, None if isinstance(client, AsyncGraphClient) else client
+
+    if inspect.isasyncgenfunction(func):
+        @wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            bound, access_token = bind(args, kwargs)
+            if access_token is None:
+                async for item in func(*args, **kwargs):
+                    yield item
+                return
+            async with AsyncGraphClient(access_token) as client:
+                bound.arguments['client'] = client
+                async for item in func(*bound.args, **bound.kwargs):
+                    yield item
+
+        return generator_wrapper
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        bound, access_token = bind(args, kwargs)
+        if access_token is None:
+            return await func(*args, **kwargs)
+        async with AsyncGraphClient(access_token) as client:
+            bound.arguments['client'] = client
+            return await func(*bound.args, **bound.kwargs)
+
+    return wrapper
+
+
+@_accepts_access_token
+async def iter_pages(url:str, client:AsyncGraphClient, params:dict = None):
+    """
+    Asynchronously iterates over the pages of a Graph API collection, following @odata.nextLink.
+
+    Args:
+        url (str): The collection URL.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+        params (dict, optional): Query parameters for the first request. Next links already carry them.
+
+    Yields:
+        dict: The JSON body of each page.
+
+    Raises:
+        httpx.HTTPStatusError: If the HTTP request for a page fails. Raised while iterating."""
+
+    while url:
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+        page = response.json()
+        yield page
+
+        url = page.get('@odata.nextLink')
+        params = None
+
+
+@_accepts_access_token
+async def iter_user_membership_groups(user_upn:str, client:AsyncGraphClient, page_size:int = MAX_PAGE_SIZE,
+                                      select:list = None):
+    """
+    Asynchronously iterates over all AAD groups the user is a direct member of.
+
+    Args:
+        user_upn (str): The User Principal Name (UPN) or user id.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+        page_size (int, optional): Number of groups requested per page, up to 999. Defaults to 999.
+        select (list, optional): Group properties to request, as Graph names. Defaults to displayName and id.
+
+    Yields:
+        Group: A dictionary containing the group displayName and id, or the selected properties."""
+
+    url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}/memberOf/microsoft.graph.group'
+    properties = models.select_properties(models.Group, select, GROUP_PROPERTIES)
+    params = {
+        '$select': ','.join(properties),
+        '$top': page_size
+    }
+
+    async for page in iter_pages(url, client, params):
+        for group in page['value']:
+            yield models.Group.from_graph(group, properties)
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def get_group_by_name(group_name:str, client:AsyncGraphClient) -> dict:
+    """
+    Gets Azure AD group information by name. Coroutine version of graph_utils.get_group_by_name.
+
+    Args:
+        group_name (str): The group name to find. This could be a substring of the group name.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containings the group id and group name."""
+
+    url = f'{config.GRAPH_BASE_URL_GROUP}/'
+    params = {
+        '$count': 'true',
+        '$search': f'"displayName:{group_name}"',
+        '$select': 'displayName,id',
+        '$top': MAX_PAGE_SIZE
+    }
+
+    matches = []
+    async for page in iter_pages(url, client, params):
+        if page.get('@odata.count') == 0:
+            return models.OperationResult(
+                status_code=404,
+                message=f'No AAD group that contains {group_name} found. Try another name.'
+            )
+        matches.extend(group for group in page['value'] if group_name in group['displayName'])
+
+    if len(matches) > 1:
+        return models.OperationResult(
+            status_code=200,
+            message=f'Too much AAD group that contains {group_name} found. Try another name.'
+        )
+
+    elif len(matches) == 1:
+        return models.OperationResult(
+            status_code=200,
+            group_id=matches[0]['id'],
+            group_name=matches[0]['displayName']
+        )
+
+    return models.OperationResult(
+        status_code=200,
+        message=f'No AAD group that contains {group_name} found. Try another name.'
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def get_user_from_upn(user_upn:str, client:AsyncGraphClient, select:list = None) -> dict:
+    """
+    Gets AAD user Id from User Principal Name (UPN). Coroutine version of graph_utils.get_user_from_upn.
+
+    Args:
+        user_upn (str): User principal name to find.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+        select (list, optional): User properties to request, as Graph names or User keys. Defaults to id, userPrincipalName and jobTitle.
+
+    Returns:
+        User: A dictionary containing status_code, id, upn, job_title, or the selected properties."""
+
+    properties = models.select_properties(models.User, select, USER_PROPERTIES)
+    response = await client.get(f'{config.GRAPH_BASE_URL_USER}/{user_upn}', params={'$select': ','.join(properties)})
+    response.raise_for_status()
+
+    return models.User.from_graph(response.json(), properties, status_code=response.status_code)
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def get_user_membership_groups(user_upn:str, client:AsyncGraphClient) -> dict:
+    """
+    Lists all AAD groups the user is a member of. Coroutine version of graph_utils.get_user_membership_groups.
+
+    Args:
+        user_upn (str): The User Principal Name (UPN).
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing all group names and group ids which user is member of."""
+
+    groups = [group async for group in iter_user_membership_groups(user_upn, client)]
+
+    if not groups:
+        return models.OperationResult(
+            status_code=404,
+            message=f'No AAD groups found for user {user_upn}.'
+        )
+
+    return models.OperationResult(
+        status_code=200,
+        groups=groups
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def is_user_member_of(user_upn:str, group_name:str, client:AsyncGraphClient) -> bool:
+    """
+    Check if user is member of specific AAD group. Coroutine version of graph_utils.is_user_member_of.
+
+    Args:
+        user_upn (str): The User Principal Name (UPN).
+        group_name (str): The group name to search. This could be substring of the group name.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        bool: A boolean value."""
+
+    async for group in iter_user_membership_groups(user_upn, client):
+        if group_name in group['displayName']:
+            return True
+    return False
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def get_user_group_by_name(user_id:str, group_name:str, client:AsyncGraphClient) -> dict:
+    """
+    Gets specific AAD user group membership. Coroutine version of graph_utils.get_user_group_by_name.
+
+    Args:
+        user_id (str): AAD user Id or User Principal Name.
+        group_name (str): The group name to search. This could be substring of the group name.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing status code, group id, group name ."""
+
+    url = f'{config.GRAPH_BASE_URL_USER}/{user_id}/memberOf/microsoft.graph.group'
+    params = {
+        '$count': 'true',
+        '$search': f'"displayName:{group_name}"',
+        '$select': 'displayName,id'
+    }
+
+    async for page in iter_pages(url, client, params):
+        if page.get('@odata.count') == 0:
+            return models.OperationResult(
+                status_code=404,
+                message=f'No AAD group that contains {group_name} found for the user. Try another name.'
+            )
+        for group in page['value']:
+            if group_name in group['displayName']:
+                return models.OperationResult(
+                    status_code=200,
+                    group_id=group['id'],
+                    group_name=group['displayName']
+                )
+
+    return models.OperationResult(
+        status_code=404,
+        message=f'No AAD group that contains {group_name} found for the user. Try another name.'
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def add_user_to_group(user_upn:str, group_name:str, client:AsyncGraphClient) -> dict:
+    """
+    Adds user to Azure AD group. The user and the group are resolved concurrently.
+
+    Args:
+        user_upn (str): The User principal name to find.
+        group_name (str): The group to find. This could be a substring of the group name.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing the status code and a message."""
+
+    response_user_info, response_user_group = await asyncio.gather(
+        get_user_from_upn(user_upn, client),
+        get_group_by_name(group_name, client))
+
+    if response_user_info.get('status_code') != 200:
+        return response_user_info
+    if response_user_group.get('status_code') != 200 or 'group_id' not in response_user_group:
+        return response_user_group
+
+    url = f"{config.GRAPH_BASE_URL_GROUP}/{response_user_group['group_id']}/members/$ref"
+    payload = {
+        '@odata.id': f"{config.GRAPH_BASE_URL}/directoryObjects/{response_user_info['id']}"
+    }
+
+    response = await client.post(url, json=payload)
+    response.raise_for_status()
+
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f"User {user_upn} added to AAD group {response_user_group['group_name']} successfully."
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def remove_user_from_group(user_upn:str, group_name:str, client:AsyncGraphClient) -> dict:
+    """
+    Removes user from Azure AD group. The user and its group membership are resolved concurrently.
+
+    Args:
+        user_upn (str): The User principal name to find.
+        group_name (str): The group to find. This could be a substring of the group name.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing the status code and a message."""
+
+    response_user_info, response_user_group = await asyncio.gather(
+        get_user_from_upn(user_upn, client),
+        get_user_group_by_name(user_upn, group_name, client))
+
+    if response_user_info.get('status_code') != 200:
+        return response_user_info
+    if response_user_group.get('status_code') != 200:
+        return response_user_group
+
+    url = f"{config.GRAPH_BASE_URL_GROUP}/{response_user_group['group_id']}/members/{response_user_info['id']}/$ref"
+
+    response = await client.delete(url)
+    response.raise_for_status()
+
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f"User {user_upn} removed from AAD group {response_user_group['group_name']} successfully."
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def user_reset_password(user_upn:str, new_password:str, client:AsyncGraphClient, force_change_password_next_signin:bool = False) -> dict:
+    """
+    Resets the user's password. Coroutine version of graph_utils.user_reset_password.
+
+    Args:
+        user_upn (str): The user's principal name (UPN).
+        new_password (str): The new password to set for the user.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+        force_change_password_next_signin (bool, optional): If True, the user will be required to change the password at the next sign-in. Defaults to False.
+
+    Returns:
+        dict: A dictionary containing the status code and a message indicating the result of the operation."""
+
+    payload = {
+        'passwordProfile': {
+            'forceChangePasswordNextSignIn': force_change_password_next_signin,
+            'password': new_password
+        }
+    }
+
+    response = await client.patch(f'{config.GRAPH_BASE_URL_USER}/{user_upn}', json=payload)
+    response.raise_for_status()
+
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'Success. User {user_upn} password has been changed.'
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def user_revoke_sessions(user_upn:str, client:AsyncGraphClient) -> dict:
+    """
+    Revokes all active sessions for a specified user. Coroutine version of graph_utils.user_revoke_sessions.
+
+    Args:
+        user_upn (str): The user's principal name (UPN).
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing the status code and a message indicating that the user's sessions were revoked."""
+
+    response = await client.post(f'{config.GRAPH_BASE_URL_USER}/{user_upn}/revokeSignInSessions')
+    response.raise_for_status()
+
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User {user_upn} sessions have been revoked successfully.'
+    )
+
+
+@decorators.handle_async_http_exceptions
+@_accepts_access_token
+async def user_set_account_status(user_upn:str, enable_account:bool, client:AsyncGraphClient) -> dict:
+    """
+    Sets the user's account status (enabled or disabled). Coroutine version of graph_utils.user_set_account_status.
+
+    Args:
+        user_upn (str): The user's principal name.
+        enable_account (bool): True to enable the account, False to disable it.
+        client (AsyncGraphClient | str | TokenProvider): The client to send requests with, or an access token.
+
+    Returns:
+        dict: A dictionary containing the status code and the result of the operation."""
+
+    response = await client.patch(f'{config.GRAPH_BASE_URL_USER}/{user_upn}', json={'accountEnabled': enable_account})
+    response.raise_for_status()
+
+    status_message = "enabled" if enable_account else "disabled"
+
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User account {user_upn} has been {status_message} successfully.'
+    )
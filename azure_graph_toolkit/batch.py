@@ -0,0 +1,290 @@
+import time
+import logging
+from . import config
+from . import graph_client
+from .utils import throttling
+
+# Maximum number of sub-requests accepted by the Graph API in one $batch payload.
+MAX_BATCH_SIZE = 20
+
+# Sub-request statuses worth sending again: throttling and transient service errors. Only 429 is
+# retried for methods outside throttling.IDEMPOTENT_METHODS, see _is_retryable.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Status returned for a sub-request whose dependsOn request failed.
+FAILED_DEPENDENCY_STATUS = 424
+
+
+class BatchRequest:
+    """A single sub-request queued in a GraphBatch."""
+
+    __slots__ = ('id', 'method', 'url', 'body', 'headers', 'depends_on', 'message')
+
+    def __init__(self, request_id:str, method:str, url:str, body:dict = None, headers:dict = None,
+                 depends_on:list = None, message:str = None):
+        self.id = request_id
+        self.method = method.upper()
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.depends_on = list(depends_on or [])
+        self.message = message
+
+    def to_payload(self, pending_ids:set) -> dict:
+        payload = {
+            'id': self.id,
+            'method': self.method,
+            'url': self.url
+        }
+        if self.body is not None:
+            payload['body'] = self.body
+            payload['headers'] = {'Content-Type': 'application/json', **(self.headers or {})}
+        elif self.headers:
+            payload['headers'] = dict(self.headers)
+
+        # Dependencies that already succeeded in an earlier round are not part of this payload.
+        depends_on = [request_id for request_id in self.depends_on if request_id in pending_ids]
+        if depends_on:
+            payload['dependsOn'] = depends_on
+        return payload
+
+
+def _relative_url(url:str) -> str:
+    if url.startswith(config.GRAPH_BASE_URL):
+        url = url[len(config.GRAPH_BASE_URL):]
+    return url if url.startswith('/') else f'/{url}'
+
+
+def _parse_response(request:BatchRequest, response:dict) -> dict:
+    status_code = response.get('status')
+    body = response.get('body')
+
+    if status_code >= 400:
+        message = body.get('error', {}).get('message') if isinstance(body, dict) else None
+        return {
+            'status_code': status_code,
+            'message': message
+        }
+
+    if request.message is not None:
+        return {
+            'status_code': status_code,
+            'message': request.message
+        }
+
+    return {
+        'status_code': status_code,
+        'body': body
+    }
+
+
+def _is_retryable(request:BatchRequest, status_code:int) -> bool:
+    # A 5xx sub-response may come back after the request was applied: only idempotent requests are sent again.
+    if status_code == 429:
+        return True
+    return status_code in RETRYABLE_STATUS_CODES and request.method in throttling.IDEMPOTENT_METHODS
+
+
+def _retry_after(sub_response:dict) -> float:
+    # Sub-response headers are a plain dict: look Retry-After up case-insensitively.
+    headers = sub_response.get('headers') or {}
+    value = next((value for name, value in headers.items() if name.lower() == 'retry-after'), None)
+    return throttling.parse_retry_after(value)
+
+
+class GraphBatch:
+    """
+    Collects Graph API requests and sends them as JSON $batch payloads of up to 20 sub-requests.
+
+    Requests linked through depends_on are always sent in the same payload, in dependency order.
+    Sub-requests that are throttled (429), or idempotent ones (see throttling.IDEMPOTENT_METHODS)
+    that fail with a transient 5xx error, are sent again in a later round, after waiting for the
+    longest Retry-After returned, until max_retries is reached. Other requests, e.g. POST
+    members/$ref, may have been applied despite the error and are not retried. Requests that failed
+    because one of their dependencies was retried are retried with it.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        max_retries (int, optional): Maximum number of extra rounds for retryable sub-requests. Defaults to 3.
+        batch_size (int, optional): Maximum number of sub-requests per payload, up to 20. Defaults to 20.
+        default_retry_after (float, optional): Seconds to wait before a retry round when no Retry-After was returned. Defaults to 1.
+        max_retry_after (float, optional): Cap for Retry-After delays, in seconds. Defaults to 120.
+    """
+
+    def __init__(self, access_token, max_retries:int = 3, batch_size:int = MAX_BATCH_SIZE, default_retry_after:float = 1,
+                 max_retry_after:float = 120.0):
+
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}.')
+
+        self.client = graph_client.get_client(access_token)
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self._requests = {}
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, method:str, url:str, body:dict = None, headers:dict = None, depends_on:list = None,
+            request_id:str = None, message:str = None) -> str:
+        """
+        Queues a sub-request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The request URL, absolute or relative to config.GRAPH_BASE_URL.
+            body (dict, optional): JSON body of the request.
+            headers (dict, optional): Extra headers of the request.
+            depends_on (list, optional): Ids of queued requests that must succeed before this one runs.
+            request_id (str, optional): Id of the request. Defaults to a sequential id.
+            message (str, optional): Message returned in the result when the request succeeds.
+
+        Returns:
+            str: The id of the queued request, used as key in the execute() result.
+
+        Raises:
+            ValueError: If the id is already used or a dependency is not queued."""
+
+        request_id = str(request_id) if request_id is not None else str(len(self._requests) + 1)
+        if request_id in self._requests:
+            raise ValueError(f'Batch request id {request_id} is already used.')
+
+        for dependency in depends_on or []:
+            if dependency not in self._requests:
+                raise ValueError(f'Batch request {request_id} depends on unknown request {dependency}.')
+
+        self._requests[request_id] = BatchRequest(request_id, method, _relative_url(url), body, headers, depends_on, message)
+        return request_id
+
+    def add_user_to_group(self, user_id:str, group_id:str, **kwargs) -> str:
+        """Queues the same request as graph_utils.add_user_to_group for already resolved ids."""
+
+        payload = {
+            '@odata.id': f'{config.GRAPH_BASE_URL}/directoryObjects/{user_id}'
+        }
+        return self.add('POST', f'/groups/{group_id}/members/$ref', body=payload,
+                        message=f'User {user_id} added to AAD group {group_id} successfully.', **kwargs)
+
+    def remove_user_from_group(self, user_id:str, group_id:str, **kwargs) -> str:
+        """Queues the same request as graph_utils.remove_user_from_group for already resolved ids."""
+
+        return self.add('DELETE', f'/groups/{group_id}/members/{user_id}/$ref',
+                        message=f'User {user_id} removed from AAD group {group_id} successfully.', **kwargs)
+
+    def user_set_account_status(self, user_upn:str, enable_account:bool, **kwargs) -> str:
+        """Queues the same request as graph_utils.user_set_account_status."""
+
+        status_message = "enabled" if enable_account else "disabled"
+        return self.add('PATCH', f'/users/{user_upn}', body={'accountEnabled': enable_account},
+                        message=f'User account {user_upn} has been {status_message} successfully.', **kwargs)
+
+    def user_revoke_sessions(self, user_upn:str, **kwargs) -> str:
+        """Queues the same request as graph_utils.user_revoke_sessions."""
+
+        return self.add('POST', f'/users/{user_upn}/revokeSignInSessions',
+                        message=f'User {user_upn} sessions have been revoked successfully.', **kwargs)
+
+    def user_reset_password(self, user_upn:str, new_password:str, force_change_password_next_signin:bool = False, **kwargs) -> str:
+        """Queues the same request as graph_utils.user_reset_password."""
+
+        payload = {
+            'passwordProfile': {
+                'forceChangePasswordNextSignIn': force_change_password_next_signin,
+                'password': new_password
+            }
+        }
+        return self.add('PATCH', f'/users/{user_upn}', body=payload,
+                        message=f'Success. User {user_upn} password has been changed.', **kwargs)
+
+    def execute(self) -> dict:
+        """
+        Sends all queued requests and clears the queue.
+
+        Returns:
+            dict: A dictionary mapping each request id to a dictionary containing the status code and
+                either a message or the response body.
+
+        Raises:
+            requests.exceptions.HTTPError: If a $batch request itself fails.
+            ValueError: If more than batch_size requests are linked through depends_on."""
+
+        pending = self._requests
+        self._requests = {}
+        results = {}
+        attempt = 0
+
+        while pending:
+            retry_after = 0
+            for chunk in self._chunks(pending):
+                chunk_ids = {request.id for request in chunk}
+                payload = {'requests': [request.to_payload(chunk_ids) for request in chunk]}
+
+                response = self.client.post(f'{config.GRAPH_BASE_URL}/$batch', json=payload)
+                response.raise_for_status()
+
+                for sub_response in response.json().get('responses', []):
+                    request = pending[sub_response['id']]
+                    results[request.id] = _parse_response(request, sub_response)
+                    delay = _retry_after(sub_response)
+                    if delay is not None and _is_retryable(request, sub_response.get('status')):
+                        retry_after = max(retry_after, min(delay, self.max_retry_after))
+
+            retry_ids = self._retryable_ids(pending, results)
+            if not retry_ids or attempt >= self.max_retries:
+                break
+
+            attempt = attempt + 1
+            logging.info('Retrying %s throttled batch sub-requests (round %s).', len(retry_ids), attempt)
+            time.sleep(retry_after or self.default_retry_after * 2 ** (attempt - 1))
+            pending = {request_id: pending[request_id] for request_id in pending if request_id in retry_ids}
+
+        return results
+
+    def _retryable_ids(self, pending:dict, results:dict) -> set:
+        retry_ids = {request_id for request_id, request in pending.items()
+                     if _is_retryable(request, results.get(request_id, {}).get('status_code'))}
+
+        # Requests that failed only because a dependency is retried are retried with it.
+        changed = True
+        while changed:
+            changed = False
+            for request_id, request in pending.items():
+                if request_id not in retry_ids and results.get(request_id, {}).get('status_code') == FAILED_DEPENDENCY_STATUS \
+                        and any(dependency in retry_ids for dependency in request.depends_on):
+                    retry_ids.add(request_id)
+                    changed = True
+        return retry_ids
+
+    def _chunks(self, pending:dict) -> list:
+        # Group requests linked through dependsOn (union-find), keeping the queue order inside each group.
+        parent = {request_id: request_id for request_id in pending}
+
+        def find(request_id):
+            while parent[request_id] != request_id:
+                parent[request_id] = parent[parent[request_id]]
+                request_id = parent[request_id]
+            return request_id
+
+        for request in pending.values():
+            for dependency in request.depends_on:
+                if dependency in pending:
+                    parent[find(request.id)] = find(dependency)
+
+        groups = {}
+        for request in pending.values():
+            groups.setdefault(find(request.id), []).append(request)
+
+        chunks = []
+        current = []
+        for group in groups.values():
+            if len(group) > self.batch_size:
+                raise ValueError(f'{len(group)} batch requests are linked through depends_on; at most {self.batch_size} fit in one batch.')
+            if len(current) + len(group) > self.batch_size:
+                chunks.append(current)
+                current = []
+            current.extend(group)
+        if current:
+            chunks.append(current)
+        return chunks
@@ -0,0 +1,101 @@
+"""
+Transport benchmark against the local Graph API emulator.
+
+Sends the same user lookups through GraphClient with the requests (HTTP/1.1) transport and with
+HTTP2Transport at several concurrency levels, and reports the throughput and the number of
+connections the emulator accepted:
+
+    python -m azure_graph_toolkit.benchmark --requests 2000 --latency 0.05 --concurrency 10 100 1000
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import graph_utils
+from . import transport as graph_transport
+from .emulator import GraphEmulator
+from .graph_client import GraphClient
+
+DEFAULT_CONCURRENCY = (10, 100, 1000)
+TRANSPORTS = ('http1', 'http2')
+
+
+def _create_client(name:str, concurrency:int) -> tuple:
+    # Returns the client and the transport to close with it: GraphClient doesn't close a transport it was given.
+    if name == 'http2':
+        transport = graph_transport.HTTP2Transport(prior_knowledge=True)
+        return GraphClient('benchmark-token', transport=transport), transport
+    # Let the pool keep a connection per worker, as a tuned HTTP/1.1 client would.
+    return GraphClient('benchmark-token', pool_connections=1, pool_maxsize=concurrency), None
+
+
+def run_transport_benchmark(requests:int = 2000, concurrency=DEFAULT_CONCURRENCY, transports=TRANSPORTS,
+                            latency:float = 0.05, users:int = 10000) -> list:
+    """
+    Compares the transports on user lookups against a local GraphEmulator serving HTTP/1.1 and HTTP/2.
+
+    Args:
+        requests (int, optional): Lookups sent per run. Defaults to 2000.
+        concurrency (tuple, optional): Concurrent requests of each run. Defaults to (10, 100, 1000).
+        transports (tuple, optional): 'http1' (requests session) and/or 'http2' (HTTP2Transport). Defaults to both.
+        latency (float, optional): Seconds the emulator waits before answering each request. Defaults to 0.05.
+        users (int, optional): Users in the emulated directory. Defaults to 10000.
+
+    Returns:
+        list: One dictionary per run with transport, concurrency, requests, errors, seconds,
+            requests_per_second and connections (sockets opened to the emulator).
+
+    Raises:
+        ImportError: If 'http2' is requested and the h2 package is not installed."""
+
+    results = []
+    with GraphEmulator(users=users, groups=10, latency=latency, http2='http2' in transports) as emulator:
+        for name in transports:
+            for workers in concurrency:
+                client, transport = _create_client(name, workers)
+                emulator.stats.reset()
+
+                def lookup(index:int) -> bool:
+                    # Distinct users, so the client doesn't coalesce identical lookups.
+                    result = graph_utils.get_user_from_upn(f'user{index % users}@{emulator.directory.domain}', client, select=['id'])
+                    return result.get('status_code') == 200
+
+                started = time.monotonic()
+                try:
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='graph-benchmark') as executor:
+                        succeeded = sum(executor.map(lookup, range(requests)))
+                    seconds = time.monotonic() - started
+                finally:
+                    client.close()
+                    if transport is not None:
+                        transport.close()
+
+                results.append({
+                    'transport': name,
+                    'concurrency': workers,
+                    'requests': requests,
+                    'errors': requests - succeeded,
+                    'seconds': seconds,
+                    'requests_per_second': requests / seconds,
+                    'connections': emulator.stats.snapshot()['connections']
+                })
+    return results
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description='Compare the HTTP/1.1 and HTTP/2 transports against the local Graph API emulator.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument('--transports', nargs='+', choices=TRANSPORTS, default=list(TRANSPORTS))
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    print(f'{"transport":<10}{"concurrency":>12}{"req/s":>10}{"seconds":>10}{"sockets":>9}{"errors":>8}')
+    for result in run_transport_benchmark(args.requests, args.concurrency, args.transports, args.latency, args.users):
+        print(f'{result["transport"]:<10}{result["concurrency"]:>12}{result["requests_per_second"]:>10.0f}'
+              f'{result["seconds"]:>10.2f}{result["connections"]:>9}{result["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import re
+from . import config
+from . import graph_client
+from . import graph_utils
+from . import batch as graph_batch
+from .utils import decorators
+from .utils import scheduling
+
+# Maximum number of members accepted by one members@odata.bind PATCH.
+MAX_MEMBERS_PER_PATCH = 20
+
+# Ids per members $filter=id in (...) request, keeping the request URL short.
+MEMBER_FILTER_SIZE = 15
+
+_OBJECT_ID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}$')
+
+
+def is_object_id(value:str) -> bool:
+    """
+    Returns True if value looks like a directory object id (GUID) rather than a UPN."""
+
+    return bool(_OBJECT_ID_PATTERN.match(value))
+
+
+def _chunks(items:list, size:int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def resolve_user_ids(users, access_token) -> tuple:
+    """
+    Resolves many UPNs to user ids with $batch requests. Values that already are object ids are kept as they are.
+
+    Args:
+        users (iterable): User Principal Names (UPN) or user ids.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+
+    Returns:
+        tuple: A dictionary mapping each resolved user to its id, and a dictionary mapping each unresolved user to its error.
+
+    Raises:
+        requests.exceptions.HTTPError: If a $batch request fails."""
+
+    client = graph_client.get_client(access_token)
+    cache = client.resolution_cache
+    user_ids = {}
+    errors = {}
+
+    batch = graph_batch.GraphBatch(client)
+    pending = {}
+    for user in dict.fromkeys(users):
+        if is_object_id(user):
+            user_ids[user] = user
+            continue
+        cached = cache.get('user', user) if cache is not None else None
+        if cached is not None:
+            if cached.get('status_code') == 200:
+                user_ids[user] = cached['id']
+            else:
+                errors[user] = cached
+            continue
+        pending[batch.add('GET', f'/users/{user}?$select=id,userPrincipalName,jobTitle')] = user
+
+    for request_id, result in batch.execute().items():
+        user = pending[request_id]
+        if result.get('status_code') != 200:
+            errors[user] = result
+            if cache is not None:
+                cache.set('user', user, result)
+            continue
+
+        body = result.get('body') or {}
+        user_ids[user] = body.get('id')
+        if cache is not None:
+            cache.set('user', user, {
+                'status_code': 200,
+                'id': body.get('id'),
+                'upn': body.get('userPrincipalName'),
+                'job_title': body.get('jobTitle')
+            })
+
+    return user_ids, errors
+
+
+def get_group_member_ids(group_id:str, user_ids, access_token) -> tuple:
+    """
+    Returns which of the given users are direct members of the group, with $batch filtered member queries.
+
+    Args:
+        group_id (str): The group id.
+        user_ids (iterable): The user ids to check.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+
+    Returns:
+        tuple: The set of ids of the users that are members of the group, and the set of ids whose
+            membership could not be checked.
+
+    Raises:
+        requests.exceptions.HTTPError: If a $batch request fails."""
+
+    batch = graph_batch.GraphBatch(access_token)
+    chunks = {}
+    for chunk in _chunks(list(dict.fromkeys(user_ids)), MEMBER_FILTER_SIZE):
+        id_filter = ','.join(f"'{user_id}'" for user_id in chunk)
+        request_id = batch.add('GET', f'/groups/{group_id}/members?$count=true&$select=id&$filter=id in ({id_filter})',
+                               headers={'ConsistencyLevel': 'eventual'})
+        chunks[request_id] = chunk
+
+    member_ids = set()
+    unknown_ids = set()
+    for request_id, result in batch.execute().items():
+        if result.get('status_code') != 200:
+            unknown_ids.update(chunks[request_id])
+            continue
+        member_ids.update(member['id'] for member in (result.get('body') or {}).get('value', []))
+    return member_ids, unknown_ids
+
+
+def _resolve_group(group_name:str, group_id:str, client) -> dict:
+    if group_id is not None:
+        return {'status_code': 200, 'group_id': group_id, 'group_name': group_name or group_id}
+    return graph_utils._resolve(client, 'group', group_name, lambda: graph_utils.get_group_by_name(group_name, client))
+
+
+def _add_members(group_id:str, group_name:str, user_ids:dict, client) -> dict:
+    # Adds users known not to be members: members@odata.bind PATCHes of 20, then one by one for failed PATCHes.
+    results = {}
+    retry_one_by_one = []
+    users = list(user_ids)
+    for chunk in _chunks(users, MAX_MEMBERS_PER_PATCH):
+        payload = {
+            'members@odata.bind': [f'{config.GRAPH_BASE_URL}/directoryObjects/{user_ids[user]}' for user in chunk]
+        }
+        response = client.patch(f'{config.GRAPH_BASE_URL_GROUP}/{group_id}', json=payload)
+        if response.status_code < 400:
+            for user in chunk:
+                results[user] = {'status_code': response.status_code, 'message': f'User {user} added to AAD group {group_name} successfully.'}
+        else:
+            retry_one_by_one.extend(chunk)
+
+    if retry_one_by_one:
+        batch = graph_batch.GraphBatch(client)
+        request_users = {batch.add_user_to_group(user_ids[user], group_id): user for user in retry_one_by_one}
+        for request_id, result in batch.execute().items():
+            user = request_users[request_id]
+            if result.get('status_code') < 400:
+                result = {'status_code': result['status_code'], 'message': f'User {user} added to AAD group {group_name} successfully.'}
+            results[user] = result
+
+    return results
+
+
+def _remove_members(group_id:str, group_name:str, user_ids:dict, client) -> dict:
+    # Removes users through $batch, 20 removals per request.
+    results = {}
+    batch = graph_batch.GraphBatch(client)
+    request_users = {batch.remove_user_from_group(user_id, group_id): user for user, user_id in user_ids.items()}
+
+    for request_id, result in batch.execute().items():
+        user = request_users[request_id]
+        if result.get('status_code') < 400:
+            result = {'status_code': result['status_code'], 'message': f'User {user} removed from AAD group {group_name} successfully.'}
+        results[user] = result
+
+    return results
+
+
+@decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.BULK)
+def add_users_to_group(users, group_name:str, access_token, group_id:str = None) -> dict:
+    """
+    Adds many users to an Azure AD group with members@odata.bind, 20 users per request.
+
+    Users are resolved in bulk and users that already are members are skipped. If a bulk request
+    fails, the users of that request are added one by one so that every user gets its own outcome.
+
+    Args:
+        users (iterable): User Principal Names (UPN) or user ids.
+        group_name (str): The group to find. This could be a substring of the group name. Ignored if group_id is given.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        group_id (str, optional): The group id, to skip the group lookup.
+
+    Returns:
+        dict: A dictionary containing the status code and a results dictionary mapping each user to
+            a dictionary containing its status code and message.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to resolve the group or the users fails."""
+
+    client = graph_client.get_client(access_token)
+    users = list(dict.fromkeys(users))
+
+    group = _resolve_group(group_name, group_id, client)
+    if group.get('status_code') != 200 or 'group_id' not in group:
+        return group
+    group_id, group_name = group['group_id'], group['group_name']
+
+    user_ids, results = resolve_user_ids(users, client)
+    member_ids, _ = get_group_member_ids(group_id, user_ids.values(), client)
+
+    to_add = {}
+    for user, user_id in user_ids.items():
+        if user_id in member_ids:
+            results[user] = {'status_code': 200, 'message': f'User {user} is already a member of AAD group {group_name}.'}
+        else:
+            to_add[user] = user_id
+
+    results.update(_add_members(group_id, group_name, to_add, client))
+
+    if client.resolution_cache is not None:
+        client.resolution_cache.invalidate_users(user_ids.values())
+
+    return {
+        'status_code': 200,
+        'results': {user: results[user] for user in users}
+    }
+
+
+@decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.BULK)
+def remove_users_from_group(users, group_name:str, access_token, group_id:str = None) -> dict:
+    """
+    Removes many users from an Azure AD group, sending the removals through $batch, 20 per request.
+
+    Users are resolved in bulk and users that are not members of the group are skipped.
+
+    Args:
+        users (iterable): User Principal Names (UPN) or user ids.
+        group_name (str): The group to find. This could be a substring of the group name. Ignored if group_id is given.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        group_id (str, optional): The group id, to skip the group lookup.
+
+    Returns:
+        dict: A dictionary containing the status code and a results dictionary mapping each user to
+            a dictionary containing its status code and message.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to resolve the group or the users fails."""
+
+    client = graph_client.get_client(access_token)
+    users = list(dict.fromkeys(users))
+
+    group = _resolve_group(group_name, group_id, client)
+    if group.get('status_code') != 200 or 'group_id' not in group:
+        return group
+    group_id, group_name = group['group_id'], group['group_name']
+
+    user_ids, results = resolve_user_ids(users, client)
+    member_ids, unknown_ids = get_group_member_ids(group_id, user_ids.values(), client)
+
+    to_remove = {}
+    for user, user_id in user_ids.items():
+        if user_id in member_ids or user_id in unknown_ids:
+            to_remove[user] = user_id
+        else:
+            results[user] = {'status_code': 200, 'message': f'User {user} is not a member of AAD group {group_name}.'}
+
+    results.update(_remove_members(group_id, group_name, to_remove, client))
+
+    if client.resolution_cache is not None:
+        client.resolution_cache.invalidate_users(user_ids.values())
+
+    return {
+        'status_code': 200,
+        'results': {user: results[user] for user in users}
+    }
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict
+from .utils.stats import Counters
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe bounded cache with per-entry expiry and least-recently-used eviction.
+
+    Args:
+        max_size (int, optional): Maximum number of entries. Defaults to 10000.
+        ttl (float, optional): Default time to live of an entry, in seconds. Defaults to 300.
+    """
+
+    def __init__(self, max_size:int = DEFAULT_MAX_SIZE, ttl:float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = Counters('hits', 'misses', 'evictions', 'expirations')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default if it is missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.stats.add('hits')
+                    return value
+                del self._entries[key]
+                self.stats.add('expirations')
+        self.stats.add('misses')
+        return default
+
+    def set(self, key, value, ttl:float = None):
+        """
+        Stores value under key for ttl seconds (the cache default if None), evicting the least recently used entries when full."""
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.add('evictions')
+
+    def invalidate(self, key):
+        """Removes key from the cache, if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Removes every entry whose key satisfies predicate(key)."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResolutionCache:
+    """
+    Caches the UPN-to-user and name-to-group resolutions made by composite graph_utils operations.
+
+    Successful resolutions are kept for ttl seconds. Not found answers (404, or a group name that
+    matches no group or several groups) are kept for negative_ttl seconds. Other errors, such as
+    throttling, are never cached. Attach the cache to a GraphClient to make add_user_to_group and
+    remove_user_from_group use it.
+
+    Args:
+        max_size (int, optional): Maximum number of cached resolutions. Defaults to 10000.
+        ttl (float, optional): Seconds a successful resolution is kept. Defaults to 300.
+        negative_ttl (float, optional): Seconds a not found answer is kept. Defaults to 30.
+    """
+
+    def __init__(self, max_size:int = DEFAULT_MAX_SIZE, ttl:float = DEFAULT_TTL, negative_ttl:float = DEFAULT_NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_size, ttl)
+        self._counters = Counters('negative_hits')
+
+    def resolve(self, kind:str, key:str, loader) -> dict:
+        """
+        Returns the cached resolution of (kind, key), calling loader() on a miss.
+
+        Args:
+            kind (str): The resolution kind, e.g. 'user', 'group' or 'user_group'.
+            key (str): The looked up value, e.g. the UPN or the group name.
+            loader (callable): Function returning the graph_utils result dictionary.
+
+        Returns:
+            dict: A copy of the resolution result."""
+
+        cached = self.get(kind, key)
+        if cached is not None:
+            return cached
+
+        result = loader()
+        self.set(kind, key, result)
+        return dict(result)
+
+    def get(self, kind:str, key:str) -> dict:
+        """
+        Returns a copy of the cached resolution of (kind, key), or None on a miss."""
+
+        cached = self._cache.get((kind, key), _MISSING)
+        if cached is _MISSING:
+            return None
+        if not _is_found(cached):
+            self._counters.add('negative_hits')
+        return dict(cached)
+
+    def set(self, kind:str, key:str, result:dict):
+        """
+        Caches a resolution result: found results for ttl, not found results for negative_ttl, errors not at all."""
+
+        if _is_found(result):
+            self._cache.set((kind, key), result)
+        elif _is_not_found(result):
+            self._cache.set((kind, key), result, self.negative_ttl)
+
+    def invalidate(self, kind:str, key:str):
+        """Drops a single cached resolution."""
+        self._cache.invalidate((kind, key))
+
+    def invalidate_user(self, user:str):
+        """
+        Drops every cached resolution involving the user, identified by UPN or id."""
+
+        self.invalidate_users([user])
+
+    def invalidate_users(self, users):
+        """
+        Drops every cached resolution involving any of the users, identified by UPN or id."""
+
+        users = set(users)
+        self._cache.invalidate_where(lambda cache_key: cache_key[1] in users if not isinstance(cache_key[1], tuple)
+                                     else cache_key[1][0] in users)
+
+    def invalidate_group(self, group_name:str):
+        """
+        Drops every cached resolution of the group name."""
+
+        self._cache.invalidate_where(lambda cache_key: cache_key[1] == group_name or
+                                     (isinstance(cache_key[1], tuple) and cache_key[1][1] == group_name))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters.
+
+        Returns:
+            dict: A dictionary containing hits, negative_hits, misses, evictions, expirations and size."""
+
+        return {
+            **self._cache.stats.snapshot(),
+            **self._counters.snapshot(),
+            'size': len(self._cache)
+        }
+
+
+def _is_found(result:dict) -> bool:
+    return result.get('status_code') == 200 and ('id' in result or 'group_id' in result)
+
+
+def _is_not_found(result:dict) -> bool:
+    return result.get('status_code') == 404 or (result.get('status_code') == 200 and not _is_found(result))
@@ -1,7 +1,28 @@
+import os
 
-AUTH_BASE_URL = 'https://login.microsoftonline.com'
-GRAPH_BASE_URL = 'https://graph.microsoft.com/v1.0'
+AUTH_BASE_URL = os.environ.get('AZURE_GRAPH_TOOLKIT_AUTH_BASE_URL', 'https://login.microsoftonline.com')
+GRAPH_BASE_URL = os.environ.get('AZURE_GRAPH_TOOLKIT_GRAPH_BASE_URL', 'https://graph.microsoft.com/v1.0')
 GRAPH_BASE_URL_USER = f'{GRAPH_BASE_URL}/users'
 GRAPH_BASE_URL_GROUP = f'{GRAPH_BASE_URL}/groups'
 GRAPH_SCOPE = 'https://graph.microsoft.com/.default'
 
+
+def set_base_urls(graph_base_url:str = None, auth_base_url:str = None):
+    """
+    Points the toolkit at other Graph API and token endpoints, e.g. a local emulator.
+
+    The defaults can also be overridden with the AZURE_GRAPH_TOOLKIT_GRAPH_BASE_URL and
+    AZURE_GRAPH_TOOLKIT_AUTH_BASE_URL environment variables.
+
+    Args:
+        graph_base_url (str, optional): The Graph API base URL, including the version segment.
+        auth_base_url (str, optional): The OAuth 2.0 authority base URL."""
+
+    global AUTH_BASE_URL, GRAPH_BASE_URL, GRAPH_BASE_URL_USER, GRAPH_BASE_URL_GROUP
+
+    if auth_base_url is not None:
+        AUTH_BASE_URL = auth_base_url.rstrip('/')
+    if graph_base_url is not None:
+        GRAPH_BASE_URL = graph_base_url.rstrip('/')
+        GRAPH_BASE_URL_USER = f'{GRAPH_BASE_URL}/users'
+        GRAPH_BASE_URL_GROUP = f'{GRAPH_BASE_URL}/groups'
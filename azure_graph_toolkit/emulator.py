@@ -0,0 +1,787 @@
+"""
+Local Graph API stand-in for offline load testing.
+
+GraphEmulator serves the endpoints used by graph_auth and graph_utils from a seeded, lazily
+generated directory on localhost, so throughput, pagination, throttling and connection reuse can
+be measured without touching a tenant:
+
+    with GraphEmulator(users=1_000_000, groups=10_000, latency=0.02, throttle_rate=0.01) as emulator:
+        client = GraphClient('any-token')
+        graph_utils.get_user_membership_groups('user42@contoso.test', client)
+
+It can also be started from the command line: python -m azure_graph_toolkit.emulator --users 1000000
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from . import config
+from .utils.stats import Counters
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+    import h2.settings
+except ImportError:
+    h2 = None
+
+API_VERSION = 'v1.0'
+MAX_PAGE_SIZE = 999
+DEFAULT_DOMAIN = 'contoso.test'
+
+_USER_ID_PREFIX = '00000000-0000-4000-8000-'
+_GROUP_ID_PREFIX = '00000000-0000-4000-9000-'
+_ID_IN_FILTER = re.compile(r"^id in \((.*)\)$")
+
+# Client connection preface of HTTP/2 with prior knowledge (RFC 9113, section 3.4).
+_HTTP2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+HTTP2_MAX_CONCURRENT_STREAMS = 100
+
+
+class GraphError(Exception):
+    """Error answered by the emulator with a Graph API error body."""
+
+    def __init__(self, status:int, code:str, message:str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+    def body(self) -> dict:
+        return {'error': {'code': self.code, 'message': self.message}}
+
+
+def _not_found(key:str) -> GraphError:
+    return GraphError(404, 'Request_ResourceNotFound',
+                      f"Resource '{key}' does not exist or one of its queried reference-property objects are not present.")
+
+
+class Directory:
+    """
+    Seeded directory of users and groups, generated on demand so millions of objects cost no memory.
+
+    User i is user{i}@domain and group j is Group-{j:07d}. User i is a direct member of the
+    memberships_per_user groups j = (i + k) mod groups, k < memberships_per_user. Changes made
+    through the API are kept as overlays and recorded in a change log for delta queries.
+
+    Args:
+        users (int): Number of users.
+        groups (int): Number of groups.
+        memberships_per_user (int): Number of seeded group memberships of every user.
+        domain (str): Domain of the generated UPNs.
+    """
+
+    def __init__(self, users:int, groups:int, memberships_per_user:int, domain:str = DEFAULT_DOMAIN):
+        self.user_count = users
+        self.group_count = groups
+        self.memberships_per_user = min(memberships_per_user, groups)
+        self.domain = domain
+
+        self._lock = threading.RLock()
+        self._user_patches = {}
+        self._group_patches = {}
+        self._added = {}                # group index -> set of user indexes
+        self._removed = {}              # group index -> set of user indexes
+        self._added_by_user = {}        # user index -> set of group indexes
+        self._member_cache = {}         # group index -> list of user indexes
+        self.version = 0
+        self._changes = []              # (version, 'user' / 'group', index) / (version, 'member', group index, user index, removed)
+
+    # Identifiers
+
+    def user_id(self, index:int) -> str:
+        return f'{_USER_ID_PREFIX}{index:012d}'
+
+    def group_id(self, index:int) -> str:
+        return f'{_GROUP_ID_PREFIX}{index:012d}'
+
+    def user_index(self, key:str) -> int:
+        """Returns the index of a user given by id or UPN. Raises GraphError 404 if it does not exist."""
+
+        index = None
+        if key.startswith(_USER_ID_PREFIX):
+            index = int(key[len(_USER_ID_PREFIX):])
+        elif key.lower().startswith('user') and key.lower().endswith(f'@{self.domain}'):
+            try:
+                index = int(key[4:key.index('@')])
+            except ValueError:
+                index = None
+        if index is None or not 0 <= index < self.user_count:
+            raise _not_found(key)
+        return index
+
+    def group_index(self, key:str) -> int:
+        """Returns the index of a group given by id. Raises GraphError 404 if it does not exist."""
+
+        index = int(key[len(_GROUP_ID_PREFIX):]) if key.startswith(_GROUP_ID_PREFIX) else None
+        if index is None or not 0 <= index < self.group_count:
+            raise _not_found(key)
+        return index
+
+    def object_index(self, key:str) -> int:
+        """Returns the user index of a directoryObjects reference URL or id."""
+        return self.user_index(key.rstrip('/').split('/')[-1])
+
+    # Objects
+
+    def user(self, index:int) -> dict:
+        user = {
+            'id': self.user_id(index),
+            'userPrincipalName': f'user{index}@{self.domain}',
+            'displayName': f'User {index}',
+            'jobTitle': 'Engineer',
+            'accountEnabled': True
+        }
+        patch = self._user_patches.get(index)
+        if patch:
+            user.update(patch)
+        return user
+
+    def group(self, index:int) -> dict:
+        group = {
+            'id': self.group_id(index),
+            'displayName': f'Group-{index:07d}',
+            'securityEnabled': True
+        }
+        patch = self._group_patches.get(index)
+        if patch:
+            group.update(patch)
+        return group
+
+    # Memberships
+
+    def is_member(self, user:int, group:int) -> bool:
+        with self._lock:
+            if user in self._added.get(group, ()):
+                return True
+            if user in self._removed.get(group, ()):
+                return False
+        return (group - user) % self.group_count < self.memberships_per_user
+
+    def user_groups(self, user:int) -> list:
+        with self._lock:
+            groups = {(user + k) % self.group_count for k in range(self.memberships_per_user)}
+            groups.update(self._added_by_user.get(user, ()))
+            return sorted(group for group in groups if self.is_member(user, group))
+
+    def group_members(self, group:int) -> list:
+        with self._lock:
+            members = self._member_cache.get(group)
+            if members is None:
+                members = []
+                for k in range(self.memberships_per_user):
+                    members.extend(range((group - k) % self.group_count, self.user_count, self.group_count))
+                removed = self._removed.get(group, set())
+                members = sorted(set(members).difference(removed).union(self._added.get(group, ())))
+                self._member_cache[group] = members
+            return members
+
+    def add_member(self, group:int, user:int):
+        with self._lock:
+            if self.is_member(user, group):
+                raise GraphError(400, 'Request_BadRequest',
+                                 "One or more added object references already exist for the following modified properties: 'members'.")
+            self._removed.get(group, set()).discard(user)
+            if not self.is_member(user, group):
+                self._added.setdefault(group, set()).add(user)
+                self._added_by_user.setdefault(user, set()).add(group)
+            self._member_changed(group, user, False)
+
+    def remove_member(self, group:int, user:int):
+        with self._lock:
+            if not self.is_member(user, group):
+                raise _not_found(self.user_id(user))
+            self._added.get(group, set()).discard(user)
+            self._added_by_user.get(user, set()).discard(group)
+            if self.is_member(user, group):
+                self._removed.setdefault(group, set()).add(user)
+            self._member_changed(group, user, True)
+
+    def patch_user(self, user:int, changes:dict):
+        with self._lock:
+            self._user_patches.setdefault(user, {}).update(changes)
+            self.version = self.version + 1
+            self._changes.append((self.version, 'user', user))
+
+    def patch_group(self, group:int, changes:dict):
+        with self._lock:
+            self._group_patches.setdefault(group, {}).update(changes)
+            self.version = self.version + 1
+            self._changes.append((self.version, 'group', group))
+
+    def _member_changed(self, group:int, user:int, removed:bool):
+        self._member_cache.pop(group, None)
+        self.version = self.version + 1
+        self._changes.append((self.version, 'member', group, user, removed))
+
+    def changes_since(self, version:int) -> list:
+        with self._lock:
+            return [change for change in self._changes if change[0] > version]
+
+
+class GraphEmulator:
+    """
+    Serves a seeded Directory over a Graph API compatible HTTP interface on localhost.
+
+    Used as a context manager, the emulator starts, points config at itself and restores the
+    previous base URLs when it stops.
+
+    Args:
+        users (int, optional): Number of seeded users. Defaults to 1000.
+        groups (int, optional): Number of seeded groups. Defaults to 100.
+        memberships_per_user (int, optional): Seeded direct group memberships per user. Defaults to 5.
+        page_size (int, optional): Page size of collections when the request has no $top. Defaults to 100.
+        latency (float, optional): Seconds added to every HTTP request. Defaults to 0.
+        throttle_rate (float, optional): Probability of answering a request (or $batch sub-request) with 429. Defaults to 0.
+        retry_after (float, optional): Retry-After seconds sent with injected 429 responses. Defaults to 1.
+        seed (int, optional): Seed of the throttling random generator. Defaults to 0.
+        host (str, optional): Interface to listen on. Defaults to 127.0.0.1.
+        port (int, optional): Port to listen on. Defaults to 0 (any free port).
+        http2 (bool, optional): If True, connections opened with the HTTP/2 preface (cleartext, prior knowledge)
+            are served over HTTP/2 with up to 100 concurrent streams. HTTP/1.1 keeps working. Defaults to False.
+
+    Raises:
+        ImportError: If http2 is set and the h2 package is not installed.
+    """
+
+    def __init__(self, users:int = 1000, groups:int = 100, memberships_per_user:int = 5, page_size:int = 100,
+                 latency:float = 0.0, throttle_rate:float = 0.0, retry_after:float = 1, seed:int = 0,
+                 host:str = '127.0.0.1', port:int = 0, http2:bool = False):
+
+        if http2 and h2 is None:
+            raise ImportError('GraphEmulator(http2=True) requires h2. Install it with: pip install h2')
+
+        self.directory = Directory(users, groups, memberships_per_user)
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.http2 = http2
+        self.stats = Counters('connections', 'requests', 'batch_requests', 'throttled', 'errors')
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+        self._previous_urls = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def graph_base_url(self) -> str:
+        return f'{self.base_url}/{API_VERSION}'
+
+    @property
+    def auth_base_url(self) -> str:
+        return self.base_url
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='graph-emulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the listening socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        self._previous_urls = (config.GRAPH_BASE_URL, config.AUTH_BASE_URL)
+        config.set_base_urls(self.graph_base_url, self.auth_base_url)
+        return self
+
+    def __exit__(self, *exc_info):
+        config.set_base_urls(*self._previous_urls)
+        self.stop()
+
+    def should_throttle(self) -> bool:
+        if not self.throttle_rate:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.throttle_rate
+
+    def throttled_response(self) -> tuple:
+        self.stats.add('throttled')
+        error = GraphError(429, 'TooManyRequests', 'Too many requests. Retry after the delay in the Retry-After header.')
+        return 429, {'Retry-After': str(self.retry_after)}, error.body()
+
+    # Dispatch
+
+    def dispatch(self, method:str, url:str, body, headers:dict) -> tuple:
+        """
+        Answers one Graph API request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The path and query, relative to the emulator root.
+            body (dict): The decoded JSON body, or None.
+            headers (dict): The request headers.
+
+        Returns:
+            tuple: The status code, the response headers and the JSON body (or None)."""
+
+        parts = urlsplit(url)
+        query = {key: values[-1] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        segments = [segment for segment in parts.path.split('/') if segment]
+
+        try:
+            if segments[-3:] == ['oauth2', 'v2.0', 'token'] and method == 'POST':
+                return 200, {}, self._token()
+
+            if not segments or segments[0] != API_VERSION:
+                raise _not_found(parts.path)
+            segments = segments[1:]
+
+            if not headers.get('Authorization', '').startswith('Bearer '):
+                raise GraphError(401, 'InvalidAuthenticationToken', 'Access token is empty.')
+
+            if segments == ['$batch'] and method == 'POST':
+                return 200, {}, self._batch(body or {}, headers)
+
+            if self.should_throttle():
+                return self.throttled_response()
+
+            if segments and segments[0] == 'users':
+                return self._users(method, segments[1:], query, body, parts.path)
+            if segments and segments[0] == 'groups':
+                return self._groups(method, segments[1:], query, body, parts.path)
+            raise _not_found(parts.path)
+
+        except GraphError as error:
+            self.stats.add('errors')
+            return error.status, {}, error.body()
+
+    def _token(self) -> dict:
+        return {
+            'token_type': 'Bearer',
+            'expires_in': 3599,
+            'ext_expires_in': 3599,
+            'access_token': f'emulator-{uuid.uuid4().hex}'
+        }
+
+    def _batch(self, body:dict, headers:dict) -> dict:
+        requests_ = body.get('requests', [])
+        if len(requests_) > 20:
+            raise GraphError(400, 'BadRequest', 'Limit of 20 requests in a batch exceeded.')
+
+        responses = []
+        statuses = {}
+        for request in requests_:
+            self.stats.add('batch_requests')
+            if any(statuses.get(dependency, 500) >= 400 for dependency in request.get('dependsOn', [])):
+                status, response_headers, response_body = 424, {}, GraphError(424, 'FailedDependency', 'Failed dependency.').body()
+            else:
+                sub_headers = dict(headers)
+                sub_headers.update(request.get('headers') or {})
+                status, response_headers, response_body = self.dispatch(
+                    request.get('method', 'GET').upper(), f"/{API_VERSION}{request['url']}", request.get('body'), sub_headers)
+
+            statuses[request['id']] = status
+            response = {'id': request['id'], 'status': status, 'headers': response_headers}
+            if response_body is not None:
+                response['body'] = response_body
+            responses.append(response)
+
+        return {'responses': responses}
+
+    def _page(self, path:str, query:dict, count:int, item_at, extra_query:dict = None) -> dict:
+        top = min(int(query.get('$top', self.page_size)), MAX_PAGE_SIZE)
+        skip = int(query.get('$skiptoken', 0))
+        select = [field for field in query.get('$select', '').split(',') if field]
+
+        values = [_project(item_at(index), select) for index in range(skip, min(skip + top, count))]
+        page = {'value': values}
+        if query.get('$count') == 'true':
+            page['@odata.count'] = count
+
+        if skip + top < count:
+            next_query = dict(query)
+            next_query.update(extra_query or {})
+            next_query['$skiptoken'] = skip + top
+            page['@odata.nextLink'] = f'{self.base_url}{path}?{urlencode(next_query)}'
+        return page
+
+    def _users(self, method:str, segments:list, query:dict, body, path:str) -> tuple:
+        directory = self.directory
+
+        if segments == ['delta'] and method == 'GET':
+            return 200, {}, self._delta(query, path, 'users')
+
+        if not segments:
+            return 200, {}, self._page(path, query, directory.user_count, directory.user)
+
+        user = directory.user_index(segments[0])
+        action = segments[1:]
+
+        if not action:
+            if method == 'GET':
+                return 200, {}, _project(directory.user(user), _select(query))
+            if method == 'PATCH':
+                directory.patch_user(user, {key: value for key, value in (body or {}).items() if key != 'passwordProfile'})
+                return 204, {}, None
+
+        if action == ['revokeSignInSessions'] and method == 'POST':
+            return 200, {}, {'value': True}
+
+        if action == ['checkMemberGroups'] and method == 'POST':
+            groups = set(directory.user_groups(user))
+            member_of = []
+            for group_id in (body or {}).get('groupIds', []):
+                try:
+                    if directory.group_index(group_id) in groups:
+                        member_of.append(group_id)
+                except GraphError:
+                    continue
+            return 200, {}, {'value': member_of}
+
+        if action in (['memberOf'], ['memberOf', 'microsoft.graph.group']) and method == 'GET':
+            groups = [directory.group(group) for group in directory.user_groups(user)]
+            groups = _filter_objects(groups, query)
+            return 200, {}, self._page(path, query, len(groups), lambda index: groups[index])
+
+        raise _not_found(path)
+
+    def _groups(self, method:str, segments:list, query:dict, body, path:str) -> tuple:
+        directory = self.directory
+
+        if segments == ['delta'] and method == 'GET':
+            return 200, {}, self._delta(query, path, 'groups')
+
+        if not segments:
+            if '$search' in query or '$filter' in query:
+                groups = _filter_objects((directory.group(index) for index in range(directory.group_count)), query)
+                return 200, {}, self._page(path, query, len(groups), lambda index: groups[index])
+            return 200, {}, self._page(path, query, directory.group_count, directory.group)
+
+        group = directory.group_index(segments[0])
+        action = segments[1:]
+
+        if not action:
+            if method == 'GET':
+                return 200, {}, _project(directory.group(group), _select(query))
+            if method == 'PATCH':
+                changes = {key: value for key, value in (body or {}).items() if key in ('displayName', 'description')}
+                if changes:
+                    directory.patch_group(group, changes)
+                references = (body or {}).get('members@odata.bind', [])
+                if len(references) > 20:
+                    raise GraphError(400, 'Request_BadRequest', 'A maximum of 20 members can be added in a single request.')
+                users = [directory.object_index(reference) for reference in references]
+                for user in users:
+                    if directory.is_member(user, group):
+                        raise GraphError(400, 'Request_BadRequest',
+                                         "One or more added object references already exist for the following modified properties: 'members'.")
+                for user in users:
+                    directory.add_member(group, user)
+                return 204, {}, None
+
+        if action in (['members'], ['members', 'microsoft.graph.user']) and method == 'GET':
+            members = directory.group_members(group)
+            if '$filter' in query:
+                wanted = _filter_ids(query['$filter'])
+                members = [user for user in members if directory.user_id(user) in wanted]
+            return 200, {}, self._page(path, query, len(members), lambda index: directory.user(members[index]))
+
+        if action == ['members', '$ref'] and method == 'POST':
+            directory.add_member(group, directory.object_index((body or {}).get('@odata.id', '')))
+            return 204, {}, None
+
+        if len(action) == 3 and action[0] == 'members' and action[2] == '$ref' and method == 'DELETE':
+            directory.remove_member(group, directory.user_index(action[1]))
+            return 204, {}, None
+
+        raise _not_found(path)
+
+    def _delta(self, query:dict, path:str, collection:str) -> dict:
+        directory = self.directory
+
+        if '$deltatoken' in query:
+            since = int(query['$deltatoken'])
+            changes = directory.changes_since(since)
+            version = changes[-1][0] if changes else since
+
+            if collection == 'users':
+                changed = sorted({change[2] for change in changes if change[1] == 'user'})
+                values = [directory.user(user) for user in changed]
+            else:
+                members = {change[2]: {} for change in changes if change[1] == 'group'}
+                for change in changes:
+                    if change[1] == 'member':
+                        entry = {'@odata.type': '#microsoft.graph.user', 'id': directory.user_id(change[3])}
+                        if change[4]:
+                            entry['@removed'] = {'reason': 'deleted'}
+                        members.setdefault(change[2], {})[entry['id']] = entry
+                values = []
+                for group, entries in sorted(members.items()):
+                    value = directory.group(group)
+                    if entries:
+                        value['members@delta'] = list(entries.values())
+                    values.append(value)
+            return {'value': values, '@odata.deltaLink': f'{self.base_url}{path}?$deltatoken={version}'}
+
+        # Initial sync: page through every object, then hand out a delta link at the version the sync started at.
+        snapshot = int(query.get('$snapshot', directory.version))
+        if collection == 'users':
+            count, item_at = directory.user_count, directory.user
+        else:
+            count = directory.group_count
+
+            with_members = not _select(query) or 'members' in _select(query)
+
+            def item_at(index):
+                group = directory.group(index)
+                if with_members:
+                    group['members@delta'] = [{'@odata.type': '#microsoft.graph.user', 'id': directory.user_id(user)}
+                                              for user in directory.group_members(index)]
+                return group
+
+        page = self._page(path, query, count, item_at, {'$snapshot': snapshot})
+        if '@odata.nextLink' not in page:
+            page['@odata.deltaLink'] = f'{self.base_url}{path}?$deltatoken={snapshot}'
+        return page
+
+
+def _select(query:dict) -> list:
+    return [field for field in query.get('$select', '').split(',') if field]
+
+
+def _project(item:dict, select:list) -> dict:
+    if not select:
+        return item
+    projected = {key: item[key] for key in select if key in item}
+    projected.setdefault('id', item.get('id'))
+    for key in item:
+        if key.startswith('@') or key.endswith('@delta'):
+            projected[key] = item[key]
+    return projected
+
+
+def _filter_ids(expression:str) -> set:
+    match = _ID_IN_FILTER.match(expression.strip())
+    if not match:
+        raise GraphError(400, 'Request_UnsupportedQuery', f'Unsupported filter: {expression}')
+    return {value.strip().strip("'") for value in match.group(1).split(',') if value.strip()}
+
+
+def _filter_objects(objects, query:dict) -> list:
+    objects = list(objects)
+    if '$filter' in query:
+        wanted = _filter_ids(query['$filter'])
+        objects = [item for item in objects if item['id'] in wanted]
+    if '$search' in query:
+        term = query['$search'].strip('"')
+        if ':' in term:
+            field, term = term.split(':', 1)
+        else:
+            field = 'displayName'
+        objects = [item for item in objects if term.lower() in str(item.get(field, '')).lower()]
+    return objects
+
+
+def _make_handler(emulator:GraphEmulator):
+
+    class GraphRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; without TCP_NODELAY delayed ACKs add ~40 ms per response.
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            emulator.stats.add('connections')
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            if emulator.http2 and self.rfile.peek(len(_HTTP2_PREFACE)).startswith(_HTTP2_PREFACE):
+                _Http2Connection(emulator, self.connection, self.rfile).serve()
+            else:
+                super().handle()
+
+        def _handle(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            status, headers, payload = _answer(emulator, self.command, self.path, raw_body,
+                                             self.headers.get('Content-Type'), dict(self.headers))
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if payload:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    return GraphRequestHandler
+
+
+def _answer(emulator:GraphEmulator, method:str, path:str, raw_body:bytes, content_type:str, headers:dict) -> tuple:
+    # Decodes a request, dispatches it and encodes the response body, for both protocols.
+    emulator.stats.add('requests')
+    if emulator.latency:
+        time.sleep(emulator.latency)
+
+    body = None
+    if raw_body:
+        if 'json' in (content_type or ''):
+            body = json.loads(raw_body)
+        else:
+            body = parse_qs(raw_body.decode())
+
+    status, response_headers, response_body = emulator.dispatch(method, path, body, headers)
+    payload = json.dumps(response_body).encode() if response_body is not None else b''
+    return status, response_headers, payload
+
+
+class _Http2Connection:
+    """
+    Serves one HTTP/2 connection: frames are read on the connection thread and every request runs
+    on its own thread, so concurrent streams are answered concurrently."""
+
+    def __init__(self, emulator:GraphEmulator, sock, rfile):
+        self.emulator = emulator
+        self.sock = sock
+        self.rfile = rfile
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        # Guards the connection state; waited on by senders blocked by flow control.
+        self.condition = threading.Condition()
+        self.streams = {}
+        self.closed = False
+
+    def serve(self):
+        with self.condition:
+            self.connection.local_settings = h2.settings.Settings(
+                client=False, initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: HTTP2_MAX_CONCURRENT_STREAMS})
+            self.connection.initiate_connection()
+            self._flush()
+
+        try:
+            while True:
+                data = self.rfile.read1(65536)
+                if not data:
+                    break
+                with self.condition:
+                    events = self.connection.receive_data(data)
+                    for event in events:
+                        self._on_event(event)
+                    self._flush()
+                    self.condition.notify_all()
+                if any(isinstance(event, h2.events.ConnectionTerminated) for event in events):
+                    break
+        except (OSError, h2.exceptions.ProtocolError):
+            pass
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+
+    def _on_event(self, event):
+        # Caller must hold self.condition.
+        if isinstance(event, h2.events.RequestReceived):
+            self.streams[event.stream_id] = (event.headers, bytearray())
+        elif isinstance(event, h2.events.DataReceived):
+            self.streams[event.stream_id][1].extend(event.data)
+            self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            headers, body = self.streams.pop(event.stream_id)
+            threading.Thread(target=self._respond, args=(event.stream_id, headers, bytes(body)), daemon=True).start()
+        elif isinstance(event, h2.events.StreamReset):
+            self.streams.pop(event.stream_id, None)
+
+    def _respond(self, stream_id:int, request_headers:list, raw_body:bytes):
+        pseudo = {name: value for name, value in request_headers if name.startswith(':')}
+        headers = {'-'.join(part.capitalize() for part in name.split('-')): value
+                   for name, value in request_headers if not name.startswith(':')}
+
+        try:
+            status, response_headers, payload = _answer(self.emulator, pseudo[':method'], pseudo[':path'], raw_body,
+                                                        headers.get('Content-Type'), headers)
+        except Exception:
+            self.emulator.stats.add('errors')
+            status, response_headers, payload = 500, {}, b''
+
+        response = [(':status', str(status)), ('content-length', str(len(payload)))]
+        response.extend((name.lower(), str(value)) for name, value in response_headers.items())
+        if payload:
+            response.append(('content-type', 'application/json'))
+
+        with self.condition:
+            try:
+                if self.closed:
+                    return
+                self.connection.send_headers(stream_id, response, end_stream=not payload)
+                self._flush()
+
+                offset = 0
+                while offset < len(payload) and not self.closed:
+                    window = min(self.connection.local_flow_control_window(stream_id), self.connection.max_outbound_frame_size)
+                    if window <= 0:
+                        self.condition.wait()
+                        continue
+                    chunk = payload[offset:offset + window]
+                    offset = offset + len(chunk)
+                    self.connection.send_data(stream_id, chunk, end_stream=offset >= len(payload))
+                    self._flush()
+            except h2.exceptions.ProtocolError:
+                # The client reset the stream or closed the connection.
+                pass
+
+    def _flush(self):
+        # Caller must hold self.condition.
+        data = self.connection.data_to_send()
+        if data:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.closed = True
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description='Run a local Graph API emulator.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--memberships-per-user', type=int, default=5)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--http2', action='store_true', help='Also serve cleartext HTTP/2 (prior knowledge).')
+    args = parser.parse_args(argv)
+
+    emulator = GraphEmulator(args.users, args.groups, args.memberships_per_user, args.page_size, args.latency,
+                             args.throttle_rate, args.retry_after, host=args.host, port=args.port, http2=args.http2)
+    print(f'Graph API emulator listening on {emulator.graph_base_url} (token endpoint {emulator.auth_base_url})')
+    print(f'Set AZURE_GRAPH_TOOLKIT_GRAPH_BASE_URL={emulator.graph_base_url} '
+          f'and AZURE_GRAPH_TOOLKIT_AUTH_BASE_URL={emulator.auth_base_url} to use it.')
+    try:
+        emulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
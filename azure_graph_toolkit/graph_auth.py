@@ -1,28 +1,71 @@
 from . import config
 import requests
+import hashlib
 import logging
+import threading
+import time
 from .utils import decorators
 from pprint import pprint
 
-@decorators.handle_http_exceptions
-def get_access_token(tenant_id:str, client_id:str, client_secret:str):
+# Seconds before expiry at which a cached token is considered due for refresh.
+TOKEN_REFRESH_MARGIN = 300
+
+
+class _CachedToken:
+    """Token cache entry shared by every provider with the same (tenant, client, secret, scope)."""
+
+    __slots__ = ('token', 'expires_at', 'lock')
+
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        # Held by whichever thread is currently fetching a new token (single-flight).
+        self.lock = threading.Lock()
+
+
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+
+def _secret_digest(client_secret:str) -> str:
+    # Keys the cache by secret without keeping the secret itself in the key.
+    return hashlib.sha256((client_secret or '').encode()).hexdigest()
+
+
+def _get_cache_entry(key:tuple) -> _CachedToken:
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            entry = _token_cache[key] = _CachedToken()
+        return entry
+
+
+def clear_token_cache():
     """
-    Retrieves an access token using client credentials.
+    Drops every cached access token. The next request for a token fetches a new one."""
+
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def request_token(tenant_id:str, client_id:str, client_secret:str, scope:str = config.GRAPH_SCOPE) -> dict:
+    """
+    Requests a new token from the OAuth 2.0 token endpoint using client credentials.
 
     Args:
         tenant_id (str): The tenant ID of the Azure AD.
         client_id (str): The client ID of the application.
         client_secret (str): The client secret of the application.
+        scope (str, optional): The requested scope. Defaults to the Graph API default scope.
 
     Returns:
-        str: The access token retrieved from the OAuth 2.0 token endpoint.
+        dict: The token endpoint JSON response, containing access_token and expires_in.
 
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to obtain the token fails.
     """
 
     auth_url = f'{config.AUTH_BASE_URL}/{tenant_id}/oauth2/v2.0/token'
-    scope = {config.GRAPH_SCOPE}
 
     header = {
         'Content-type': 'application/x-www-form-urlencoded'
@@ -36,6 +79,132 @@ def get_access_token(tenant_id:str, client_id:str, client_secret:str):
     }
 
     response = requests.post(auth_url,headers=header, data=data)
-    response.raise_for_status()        
-    return response.json().get('access_token')
+    response.raise_for_status()
+    return response.json()
+
+
+class TokenProvider:
+    """
+    Thread-safe access token provider with an expiry-aware cache.
+
+    Tokens are cached per (tenant, client, secret, scope) and shared by all providers with the same
+    key, so a wrong or rotated secret is never answered with a token issued for another one.
+    A token is refreshed in a background thread once it enters the refresh margin, and fetched
+    synchronously only when it is missing or already expired. Concurrent callers never trigger
+    more than one token request at a time for the same key.
+
+    Args:
+        tenant_id (str): The tenant ID of the Azure AD.
+        client_id (str): The client ID of the application.
+        client_secret (str): The client secret of the application.
+        scope (str, optional): The requested scope. Defaults to the Graph API default scope.
+        refresh_margin (float, optional): Seconds before expiry at which the token is refreshed. Defaults to 300.
+        background_refresh (bool, optional): If True, tokens inside the refresh margin are refreshed
+            in a background thread while the still valid token is returned. Defaults to True.
+    """
+
+    def __init__(self, tenant_id:str, client_id:str, client_secret:str, scope:str = config.GRAPH_SCOPE,
+                 refresh_margin:float = TOKEN_REFRESH_MARGIN, background_refresh:bool = True):
+
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self._client_secret = client_secret
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self._entry = _get_cache_entry((tenant_id, client_id, _secret_digest(client_secret), scope))
+
+    def get_token(self) -> str:
+        """
+        Returns a valid access token, fetching or refreshing it when needed.
+
+        Returns:
+            str: The access token.
+
+        Raises:
+            requests.exceptions.HTTPError: If a token has to be fetched and the token request fails.
+        """
+
+        entry = self._entry
+        token, expires_at = entry.token, entry.expires_at
+        now = time.monotonic()
+
+        if token is not None and now < expires_at - self.refresh_margin:
+            return token
+
+        if token is not None and now < expires_at and self.background_refresh:
+            if entry.lock.acquire(blocking=False):
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+            return token
+
+        with entry.lock:
+            # Another thread may have refreshed the token while we were waiting on the lock.
+            if entry.token is not None and time.monotonic() < entry.expires_at - self.refresh_margin:
+                return entry.token
+            return self._fetch()
+
+    def invalidate(self):
+        """
+        Marks the cached token as expired, e.g. after the Graph API rejected it with 401."""
+
+        self._entry.expires_at = 0.0
+
+    def _fetch(self) -> str:
+        # Caller must hold self._entry.lock.
+        requested_at = time.monotonic()
+        token_data = request_token(self.tenant_id, self.client_id, self._client_secret, self.scope)
+
+        entry = self._entry
+        entry.token = token_data.get('access_token')
+        entry.expires_at = requested_at + float(token_data.get('expires_in', 0))
+        return entry.token
+
+    def _background_refresh(self):
+        try:
+            self._fetch()
+        except requests.exceptions.RequestException as err:
+            # The current token is still valid: keep serving it and retry on the next call.
+            logging.warning('Background token refresh for client %s failed: %s', self.client_id, err)
+        finally:
+            self._entry.lock.release()
+
+    __call__ = get_token
+
+
+def resolve_access_token(access_token) -> str:
+    """
+    Returns a raw access token from either a token string or a TokenProvider.
+
+    Args:
+        access_token (str | TokenProvider): A Graph API access token or an object exposing get_token().
+
+    Returns:
+        str: The access token."""
+
+    get_token = getattr(access_token, 'get_token', None)
+    if get_token is not None:
+        return get_token()
+    return access_token
+
+
+@decorators.handle_http_exceptions
+def get_access_token(tenant_id:str, client_id:str, client_secret:str):
+    """
+    Retrieves an access token using client credentials.
+
+    The token is served from the shared token cache and is only requested again when it
+    is about to expire.
+
+    Args:
+        tenant_id (str): The tenant ID of the Azure AD.
+        client_id (str): The client ID of the application.
+        client_secret (str): The client secret of the application.
+
+    Returns:
+        str: The access token retrieved from the OAuth 2.0 token endpoint.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to obtain the token fails.
+    """
 
+    return TokenProvider(tenant_id, client_id, client_secret).get_token()
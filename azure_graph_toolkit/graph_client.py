@@ -0,0 +1,282 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from . import bulk
+from . import graph_utils
+from . import incident
+from . import reconcile
+from . import transport as graph_transport
+from .graph_auth import resolve_access_token
+from .utils import circuit_breaker as graph_circuit_breaker
+from .utils import hedging as graph_hedging
+from .utils import coalescing, metrics, scheduling, throttling
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 32
+
+# Retry policy shared by clients created without one, so its counters cover the module-level functions.
+DEFAULT_RETRY_POLICY = throttling.RetryPolicy()
+
+# Coalescer shared by clients created without one, so that identical reads of the module-level
+# functions called from different threads share one request.
+DEFAULT_COALESCER = coalescing.RequestCoalescer()
+
+# Scheduler shared by clients created without one, so bulk jobs and incident actions sent through different
+# clients compete for the same slots. Unlimited until configured, see scheduling.PriorityScheduler.configure.
+DEFAULT_SCHEDULER = scheduling.PriorityScheduler()
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def create_session(pool_connections:int = DEFAULT_POOL_CONNECTIONS, pool_maxsize:int = DEFAULT_POOL_MAXSIZE,
+                   pool_block:bool = False) -> requests.Session:
+    """
+    Creates a requests session with a keep-alive connection pool.
+
+    Args:
+        pool_connections (int, optional): Number of host pools to cache. Defaults to 10.
+        pool_maxsize (int, optional): Maximum number of connections kept alive per host. Defaults to 32.
+        pool_block (bool, optional): If True, requests wait for a free connection instead of opening extra ones. Defaults to False.
+
+    Returns:
+        requests.Session: The configured session."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_default_session() -> requests.Session:
+    """
+    Returns the process-wide session used by the module-level graph_utils functions.
+
+    Returns:
+        requests.Session: The shared session."""
+
+    global _default_session
+    if _default_session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                _default_session = create_session()
+    return _default_session
+
+
+class GraphClient:
+    """
+    Graph API client that reuses pooled keep-alive connections across calls.
+
+    Requests are sent over HTTP/1.1 through a requests session by default. Pass
+    transport=transport.HTTP2Transport() to multiplex concurrent requests over a few HTTP/2 connections.
+
+    Every graph_utils operation is available as a method, so the client can be used instead of
+    passing an access token to each function. The client can also be passed to the graph_utils
+    functions in place of the access token.
+
+    Args:
+        access_token (str | TokenProvider): Graph API access token, or a token provider asked for a token on every request.
+        session (requests.Session, optional): Session to send requests with. Defaults to a new pooled session owned by the client.
+        pool_connections (int, optional): Number of host pools to cache when the client creates its session. Defaults to 10.
+        pool_maxsize (int, optional): Maximum connections kept alive per host when the client creates its session. Defaults to 32.
+        timeout (float, optional): Timeout in seconds for each request. Defaults to None (no timeout).
+        retry_policy (RetryPolicy, optional): Retries for throttled and transient failures. Defaults to DEFAULT_RETRY_POLICY.
+            Pass RetryPolicy(max_retries=0) to disable retries.
+        rate_limiter (AdaptiveRateLimiter, optional): Limiter shared with other clients. Defaults to the limiter of the
+            token provider's tenant.
+        resolution_cache (ResolutionCache, optional): Cache used by composite operations to resolve users and groups.
+            Defaults to None (no caching).
+        coalescer (RequestCoalescer, optional): Lets identical concurrent GET requests share one HTTP call.
+            Defaults to DEFAULT_COALESCER. Pass RequestCoalescer(enabled=False) to disable coalescing.
+        group_directory (GroupDirectory, optional): Local group name index answering group name lookups instead of
+            $search requests. Defaults to None.
+        scheduler (PriorityScheduler, optional): Admits requests by priority within a concurrency limit.
+            Defaults to DEFAULT_SCHEDULER.
+        transport (RequestsTransport | HTTP2Transport, optional): Sends the HTTP requests. Defaults to a RequestsTransport
+            over session. The client doesn't close a transport it was given.
+        hedging (HedgingPolicy, optional): Sends a backup copy of slow GET requests. Defaults to None (no hedging).
+        circuit_breaker (CircuitBreaker, optional): Fails fast, or serves from its fallback cache, the requests to an
+            endpoint whose error rate crossed a threshold. Defaults to None.
+        nested_groups (NestedGroups, optional): Local nesting graph answering get_user_membership_groups and
+            is_user_member_of with effective (nested) memberships instead of memberOf requests. Defaults to None.
+    """
+
+    def __init__(self, access_token, session:requests.Session = None, pool_connections:int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize:int = DEFAULT_POOL_MAXSIZE, timeout:float = None, retry_policy:throttling.RetryPolicy = None,
+                 rate_limiter:throttling.AdaptiveRateLimiter = None, resolution_cache=None,
+                 coalescer:coalescing.RequestCoalescer = None, group_directory=None,
+                 scheduler:scheduling.PriorityScheduler = None, transport=None,
+                 hedging:graph_hedging.HedgingPolicy = None, circuit_breaker:graph_circuit_breaker.CircuitBreaker = None,
+                 nested_groups=None):
+
+        self.access_token = access_token
+        self.timeout = timeout
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.rate_limiter = rate_limiter or throttling.get_rate_limiter(getattr(access_token, 'tenant_id', None))
+        self.resolution_cache = resolution_cache
+        self.coalescer = coalescer or DEFAULT_COALESCER
+        self.group_directory = group_directory
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+        self.hedging = hedging
+        self.circuit_breaker = circuit_breaker
+        self.nested_groups = nested_groups
+        self._owns_session = session is None and transport is None
+        if transport is None:
+            self.session = create_session(pool_connections, pool_maxsize) if session is None else session
+            transport = graph_transport.RequestsTransport(self.session)
+        else:
+            self.session = session
+        self.transport = transport
+
+        self.headers = {
+            'Content-type': 'application/json',
+            'ConsistencyLevel': 'eventual'
+        }
+
+    def request(self, method:str, url:str, headers:dict = None, **kwargs) -> requests.Response:
+        """
+        Sends a request to the Graph API with the client's default headers and a valid access token.
+
+        Throttled and transient failures are retried according to the retry policy. A 401 response from a token
+        provider's token invalidates the cached token and the request is sent once more. Identical GET requests
+        in flight at the same time share one HTTP call and its response. Every attempt waits for a slot of the
+        client's scheduler at the priority of the calling context (see scheduling.priority). With a hedging policy,
+        a slow GET attempt gets a backup copy; with a circuit breaker, requests to a failing endpoint are answered
+        without being sent.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The request URL.
+            headers (dict, optional): Extra headers, merged over the default ones.
+            **kwargs: Passed on to the transport, e.g. params or json.
+
+        Returns:
+            requests.Response: The HTTP response."""
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send():
+            response = self.transport.request(method, url, headers=self._build_headers(headers), **kwargs)
+
+            if response.status_code == 401 and hasattr(self.access_token, 'invalidate'):
+                self.access_token.invalidate()
+                response = self.transport.request(method, url, headers=self._build_headers(headers), **kwargs)
+
+            return response
+
+        recorder = metrics.get_recorder()
+        if recorder is not None:
+            send = recorder.wrap_send(method, url, send)
+
+        level = scheduling.current_priority()
+        rate_limiter = self.scheduler.pace(level, self.rate_limiter)
+        scheduled_send = lambda: self.scheduler.run(level, send)
+        if self.hedging is not None:
+            unhedged_send = scheduled_send
+            scheduled_send = lambda: self.hedging.call(method, url, unhedged_send)
+
+        key = None
+        if method == 'GET' and (self.coalescer.enabled or self.circuit_breaker is not None):
+            key = coalescing.request_key(method, url, resolve_access_token(self.access_token), kwargs.get('params'), headers)
+
+        idempotent = method in throttling.IDEMPOTENT_METHODS
+        call = lambda: self.retry_policy.call(scheduled_send, rate_limiter, idempotent)
+        if self.circuit_breaker is not None:
+            retried_call = call
+            call = lambda: self.circuit_breaker.call(method, url, retried_call, key)
+
+        return self.coalescer.call(key, call)
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url:str, **kwargs) -> requests.Response:
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url:str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """
+        Closes the pooled connections if the session was created by the client."""
+
+        if self._owns_session:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _build_headers(self, headers:dict = None) -> dict:
+        request_headers = dict(self.headers)
+        request_headers['Authorization'] = f'Bearer {resolve_access_token(self.access_token)}'
+        if headers:
+            request_headers.update(headers)
+        return request_headers
+
+    # Graph operations
+
+    def get_group_by_name(self, group_name:str) -> dict:
+        return graph_utils.get_group_by_name(group_name, self)
+
+    def get_user_from_upn(self, user_upn:str) -> dict:
+        return graph_utils.get_user_from_upn(user_upn, self)
+
+    def get_user_membership_groups(self, user_upn:str) -> dict:
+        return graph_utils.get_user_membership_groups(user_upn, self)
+
+    def is_user_member_of(self, user_upn:str, group_name:str) -> bool:
+        return graph_utils.is_user_member_of(user_upn, group_name, self)
+
+    def get_user_group_by_name(self, user_id:str, group_name:str) -> dict:
+        return graph_utils.get_user_group_by_name(user_id, group_name, self)
+
+    def add_user_to_group(self, user_upn:str, group_name:str) -> dict:
+        return graph_utils.add_user_to_group(user_upn, group_name, self)
+
+    def remove_user_from_group(self, user_upn:str, group_name:str) -> dict:
+        return graph_utils.remove_user_from_group(user_upn, group_name, self)
+
+    def user_reset_password(self, user_upn:str, new_password:str, force_change_password_next_signin:bool = False) -> dict:
+        return graph_utils.user_reset_password(user_upn, new_password, self, force_change_password_next_signin)
+
+    def user_revoke_sessions(self, user_upn:str) -> dict:
+        return graph_utils.user_revoke_sessions(user_upn, self)
+
+    def user_set_account_status(self, user_upn:str, enable_account:bool) -> dict:
+        return graph_utils.user_set_account_status(user_upn, enable_account, self)
+
+    def add_users_to_group(self, users, group_name:str, group_id:str = None) -> dict:
+        return bulk.add_users_to_group(users, group_name, self, group_id)
+
+    def remove_users_from_group(self, users, group_name:str, group_id:str = None) -> dict:
+        return bulk.remove_users_from_group(users, group_name, self, group_id)
+
+    def reconcile_group_membership(self, group_name:str, desired_users, group_id:str = None, dry_run:bool = False,
+                                   remove_extra_members:bool = True) -> dict:
+        return reconcile.reconcile_group_membership(group_name, desired_users, self, group_id, dry_run, remove_extra_members)
+
+    def lockdown_users(self, upns, steps=incident.LOCKDOWN_STEPS, passwords:dict = None,
+                       force_change_password_next_signin:bool = True, max_workers:int = incident.DEFAULT_MAX_WORKERS) -> dict:
+        return incident.lockdown_users(upns, self, steps, passwords, force_change_password_next_signin, max_workers)
+
+
+def get_client(access_token) -> GraphClient:
+    """
+    Returns a GraphClient for the given access token.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): Graph API access token, token provider or client.
+
+    Returns:
+        GraphClient: The client itself if one was given, otherwise a client using the shared default session."""
+
+    if isinstance(access_token, GraphClient):
+        return access_token
+    return GraphClient(access_token, session=get_default_session())
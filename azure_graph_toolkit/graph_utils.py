@@ -1,27 +1,203 @@
 import requests
 import logging
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from . import config
+from . import graph_client
+from . import models
+from .graph_auth import resolve_access_token
 from .utils import decorators
+from .utils import scheduling
 logging.basicConfig(level=logging.ERROR)
 
-def get_http_header(access_token:str) -> dict:
+def get_http_header(access_token) -> dict:
 
     """
     Return common http header with access token updated.
 
     Args:
-        access_token (str): Graph API access token.
+        access_token (str | TokenProvider): Graph API access token, or a token provider
+            that is asked for a valid token on every call.
 
     Returns:
         dict: A dictionary containing the HTTP header with new access token."""
 
     return{
-        'Authorization': f'Bearer {access_token}',
+        'Authorization': f'Bearer {resolve_access_token(access_token)}',
         'Content-type': 'application/json',
         'ConsistencyLevel': 'eventual'
     }
 
 
+# Largest $top value accepted by the directory object list endpoints.
+MAX_PAGE_SIZE = 999
+
+# Graph properties selected when the caller doesn't pass select.
+GROUP_PROPERTIES = ('displayName', 'id')
+MEMBER_PROPERTIES = ('id', 'userPrincipalName')
+USER_PROPERTIES = ('id', 'userPrincipalName', 'jobTitle')
+
+
+def _check_page_size(page_size:int):
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'page_size must be between 1 and {MAX_PAGE_SIZE}, got {page_size}.')
+
+
+def iter_pages(url:str, access_token, params:dict = None, prefetch:bool = False):
+    """
+    Lazily iterates over the pages of a Graph API collection, following @odata.nextLink.
+
+    Only the current page (and the next one, when prefetching) is held in memory.
+
+    Args:
+        url (str): The collection URL.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        params (dict, optional): Query parameters for the first request. Next links already carry them.
+        prefetch (bool, optional): If True, the next page is requested in a background thread
+            while the caller is still processing the current one. Defaults to False.
+
+    Yields:
+        dict: The JSON body of each page.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request for a page fails. Raised while iterating."""
+
+    client = graph_client.get_client(access_token)
+
+    def fetch(page_url, page_params=None):
+        response = client.get(page_url, params=page_params)
+        response.raise_for_status()
+        return response.json()
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = fetch(url, params)
+        while True:
+            next_link = page.get('@odata.nextLink')
+            # Copy the caller's context so the prefetch keeps its scheduling priority and metrics operation.
+            next_page = executor.submit(contextvars.copy_context().run, fetch, next_link) if executor and next_link else None
+            yield page
+
+            if not next_link:
+                return
+            page = next_page.result() if next_page else fetch(next_link)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def iter_user_membership_groups(user_upn:str, access_token, page_size:int = MAX_PAGE_SIZE, prefetch:bool = False,
+                                select:list = None):
+    """
+    Lazily iterates over all AAD groups the user is a direct member of.
+
+    Args:
+        user_upn (str): The User Principal Name (UPN) or user id.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        page_size (int, optional): Number of groups requested per page, up to 999. Defaults to 999.
+        prefetch (bool, optional): If True, the next page is requested while the current one is consumed. Defaults to False.
+        select (list, optional): Group properties to request, as Graph names. Defaults to displayName and id.
+
+    Yields:
+        Group: A dictionary containing the group displayName and id, or the selected properties.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to obtain groups fails. Raised while iterating."""
+
+    _check_page_size(page_size)
+    url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}/memberOf/microsoft.graph.group'
+    properties = models.select_properties(models.Group, select, GROUP_PROPERTIES)
+    params = {
+        '$select': ','.join(properties),
+        '$top': page_size
+    }
+
+    for page in iter_pages(url, access_token, params, prefetch):
+        for group in page['value']:
+            yield models.Group.from_graph(group, properties)
+
+
+def iter_groups(access_token, search:str = None, page_size:int = MAX_PAGE_SIZE, prefetch:bool = False,
+                select:list = None):
+    """
+    Lazily iterates over the AAD groups of the tenant.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        search (str, optional): Only groups whose display name matches this search term. Defaults to all groups.
+        page_size (int, optional): Number of groups requested per page, up to 999. Defaults to 999.
+        prefetch (bool, optional): If True, the next page is requested while the current one is consumed. Defaults to False.
+        select (list, optional): Group properties to request, as Graph names. Defaults to displayName and id.
+
+    Yields:
+        Group: A dictionary containing the group displayName and id, or the selected properties.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to obtain groups fails. Raised while iterating."""
+
+    _check_page_size(page_size)
+    url = f'{config.GRAPH_BASE_URL_GROUP}/'
+    properties = models.select_properties(models.Group, select, GROUP_PROPERTIES)
+    params = {
+        '$select': ','.join(properties),
+        '$top': page_size
+    }
+    if search is not None:
+        params['$count'] = 'true'
+        params['$search'] = f'"displayName:{search}"'
+
+    for page in iter_pages(url, access_token, params, prefetch):
+        for group in page['value']:
+            yield models.Group.from_graph(group, properties)
+
+
+def iter_group_members(group_id:str, access_token, page_size:int = MAX_PAGE_SIZE, prefetch:bool = False,
+                       select:list = None):
+    """
+    Lazily iterates over the users that are direct members of an AAD group.
+
+    Args:
+        group_id (str): The group id.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        page_size (int, optional): Number of members requested per page, up to 999. Defaults to 999.
+        prefetch (bool, optional): If True, the next page is requested while the current one is consumed. Defaults to False.
+        select (list, optional): User properties to request, as Graph names or User keys. Defaults to id and userPrincipalName.
+
+    Yields:
+        User: A dictionary containing the member id and upn, or the selected properties.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to obtain members fails. Raised while iterating."""
+
+    _check_page_size(page_size)
+    url = f'{config.GRAPH_BASE_URL_GROUP}/{group_id}/members/microsoft.graph.user'
+    properties = models.select_properties(models.User, select, MEMBER_PROPERTIES)
+    params = {
+        '$select': ','.join(properties),
+        '$top': page_size
+    }
+
+    for page in iter_pages(url, access_token, params, prefetch):
+        for member in page['value']:
+            yield models.User.from_graph(member, properties)
+
+
+def _resolve(access_token, kind:str, key, loader) -> dict:
+    # Serves user and group resolutions from the client's ResolutionCache, when it has one.
+    cache = getattr(access_token, 'resolution_cache', None)
+    if cache is None:
+        return loader()
+    return cache.resolve(kind, key, loader)
+
+
+def _invalidate_user(access_token, user_id:str):
+    # Membership changed: cached membership lookups of the user are stale.
+    cache = getattr(access_token, 'resolution_cache', None)
+    if cache is not None:
+        cache.invalidate_user(user_id)
+
+
 @decorators.handle_http_exceptions
 def get_group_by_name(group_name:str, access_token:str) -> dict :
     
@@ -30,7 +206,7 @@ def get_group_by_name(group_name:str, access_token:str) -> dict :
 
     Args:
         group_name (str): The group name to find. This could be a substring of the group name. 
-        access_token (str): The Graph API access token.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
 
     Returns:
         dict: A dictionary containings the group id and group name.
@@ -38,95 +214,89 @@ def get_group_by_name(group_name:str, access_token:str) -> dict :
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to obtain group fails."""
 
+    directory = getattr(access_token, 'group_directory', None)
+    if directory is not None:
+        return directory.get_group_by_name(group_name)
 
     url = f'{config.GRAPH_BASE_URL_GROUP}/'
 
     params = {
         '$count': 'true',
         '$search': f'"displayName:{group_name}"',
-        '$select': 'displayName,id'
+        '$select': 'displayName,id',
+        '$top': MAX_PAGE_SIZE
     }
 
-    header = get_http_header(access_token)
-
-    respone_group_info = requests.get(url,headers=header, params=params)
-    respone_group_info.raise_for_status()
-    groups_data = respone_group_info.json()
+    pages = iter_pages(url, access_token, params)
+    groups_data = next(pages)
 
     # status.code = 200. Exception decorator doesn't work here.
     if groups_data['@odata.count'] == 0:  
-        return {
-            'status_code':404,
-            'message':f'No AAD group that contains {group_name} found. Try another name.'
-        }
+        return models.OperationResult(
+            status_code=404,
+            message=f'No AAD group that contains {group_name} found. Try another name.'
+        )
     
     else:
         count_match_name = 0
         data = {}
-        for group in groups_data['value']:
-            if group_name in group['displayName']:
-                count_match_name = count_match_name + 1
-                data = {
-                    'status_code':respone_group_info.status_code,
-                    'group_id':group['id'],
-                    'group_name':group['displayName']
-                }
+        for page in itertools.chain([groups_data], pages):
+            for group in page['value']:
+                if group_name in group['displayName']:
+                    count_match_name = count_match_name + 1
+                    data = models.OperationResult(
+                        status_code=200,
+                        group_id=group['id'],
+                        group_name=group['displayName']
+                    )
         
         if count_match_name > 1:
-            return {
-                'status_code': respone_group_info.status_code,
-                'message':f'Too much AAD group that contains {group_name} found. Try another name.'
-            }
+            return models.OperationResult(
+                status_code=200,
+                message=f'Too much AAD group that contains {group_name} found. Try another name.'
+            )
         
 
         elif count_match_name == 1:
             return data
         else:
-            return {
-            'status_code': respone_group_info.status_code,
-            'message':f'No AAD group that contains {group_name} found. Try another name.'
-        }
+            return models.OperationResult(
+                status_code=200,
+                message=f'No AAD group that contains {group_name} found. Try another name.'
+            )
 
 
 @decorators.handle_http_exceptions
-def get_user_from_upn (user_upn:str, access_token:str ) -> dict:
+def get_user_from_upn (user_upn:str, access_token:str, select:list = None) -> dict:
 
     """
     Gets AAD user Id from User Principal Name (UPN).
 
     Args:
         user_upn (str): User principal name to find. 
-        access_token (str): Graph API access token.
+        access_token (str | TokenProvider | GraphClient): Graph API access token.
+        select (list, optional): User properties to request, as Graph names or User keys (e.g. 'upn', 'department').
+            Defaults to id, userPrincipalName and jobTitle.
 
     Returns:
-        dict: A dictionary containing status_code, id, job_title .
+        User: A dictionary containing status_code, id, upn, job_title, or the selected properties.
 
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to obtain the user id fails."""
 
 
     url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}' 
+    properties = models.select_properties(models.User, select, USER_PROPERTIES)
 
-    headers = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
 
-    response = requests.get(url, headers=headers)
+    response = client.get(url, params={'$select': ','.join(properties)})
 
     response.raise_for_status()
     if response.status_code != 200:
         return response
     
-    response_data = response.json()
-
-    user_id = response_data.get('id')
-    upn= response_data.get('userPrincipalName')
-    job = response_data.get('jobTitle')    
-
-    return {
-        'status_code': response.status_code,
-        'id': user_id,
-        'upn': upn,
-        'job_title':job
-    }
+    return models.User.from_graph(response.json(), properties, status_code=response.status_code)
 
 
 @decorators.handle_http_exceptions
@@ -134,9 +304,11 @@ def get_user_membership_groups(user_upn:str, access_token:str) -> dict:
     """
     Lists all AAD groups the user is a member of.
 
+    If access_token is a GraphClient with nested_groups, the groups are answered from it and include nested memberships.
+
     Args:
         user_upn (str): The User Principal Name (UPN).
-        access_token (str): The Graph API access token.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
 
     Returns:
         dict: A dictionary containing all group names and group ids which user is member of.
@@ -145,33 +317,37 @@ def get_user_membership_groups(user_upn:str, access_token:str) -> dict:
         requests.exceptions.HTTPError: If the HTTP request to obtain groups fails.            
     """    
 
-    url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}/memberOf/microsoft.graph.group?$count=true&$select=displayName,id'
-    header = get_http_header(access_token)
+    nested = getattr(access_token, 'nested_groups', None)
+    if nested is not None:
+        return nested.get_user_membership_groups(user_upn)
 
-    result = requests.get(url,headers=header)
-    result.raise_for_status()
-    groups_data = result.json()
+    url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}/memberOf/microsoft.graph.group?$count=true&$select=displayName,id&$top={MAX_PAGE_SIZE}'
+
+    pages = iter_pages(url, access_token)
+    groups_data = next(pages)
 
     if groups_data['@odata.count'] == 0:
-        return {
-            'status_code':404,
-            'message': f'No AAD groups found for user {user_upn}.'
-        }
+        return models.OperationResult(
+            status_code=404,
+            message=f'No AAD groups found for user {user_upn}.'
+        )
     
-    parsed_response = [{"displayName": group["displayName"], "id": group["id"]} for group in groups_data["value"]]
+    parsed_response = [models.Group.from_graph(group, GROUP_PROPERTIES)
+                       for page in itertools.chain([groups_data], pages) for group in page["value"]]
 
-    return {'status_code': result.status_code,
-            'groups': parsed_response}
+    return models.OperationResult(status_code=200, groups=parsed_response)
 
 @decorators.handle_http_exceptions
 def is_user_member_of(user_upn:str, group_name:str, access_token:str) -> bool:
     """
     Check if user is member of specific AAD group.
 
+    If access_token is a GraphClient with nested_groups, nested memberships count too, and the check is answered locally.
+
     Args:
         user_upn (str): The User Principal Name (UPN).
         group_name (str): The group name to search. This could be substring of the group name.
-        access_token (str): The Grah API access token.
+        access_token (str | TokenProvider | GraphClient): The Grah API access token.
 
     Returns:
         bool: A boolean value.
@@ -179,13 +355,75 @@ def is_user_member_of(user_upn:str, group_name:str, access_token:str) -> bool:
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to obtain the user group fails."""
     
-    response = get_user_membership_groups(user_upn, access_token)
+    nested = getattr(access_token, 'nested_groups', None)
+    if nested is not None:
+        return nested.is_user_member_of(user_upn, group_name)
 
-    for group in response['groups']:
+    for group in iter_user_membership_groups(user_upn, access_token):
         if group_name in group['displayName']:
             return True
     return False
 
+# Maximum number of group ids accepted by one checkMemberGroups request.
+MAX_CHECK_MEMBER_GROUPS = 20
+
+
+def direct_membership_filter_url(user:str, group_ids:list) -> str:
+    """
+    Builds the memberOf URL returning which of the given groups the user is a direct member of.
+
+    Args:
+        user (str): The User Principal Name (UPN) or user id.
+        group_ids (list): The group ids to check.
+
+    Returns:
+        str: The memberOf URL, which requires the ConsistencyLevel: eventual header."""
+
+    id_filter = ','.join(f"'{group_id}'" for group_id in group_ids)
+    return f'{config.GRAPH_BASE_URL_USER}/{user}/memberOf/microsoft.graph.group?$count=true&$select=id&$filter=id in ({id_filter})'
+
+
+@decorators.handle_http_exceptions
+def check_member_groups(user:str, group_ids:list, access_token:str, transitive:bool = True) -> dict:
+    """
+    Checks the user's membership of several groups server side, without downloading the user's groups.
+
+    Transitive checks use checkMemberGroups, one request per 20 groups. Direct checks filter the
+    user's memberOf collection by id.
+
+    Args:
+        user (str): The User Principal Name (UPN) or user id.
+        group_ids (list): The group ids to check.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        transitive (bool, optional): If True, memberships through nested groups count as well. Defaults to True.
+
+    Returns:
+        dict: A dictionary containing the status code and a groups dictionary mapping each group id to a boolean.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to check the membership fails."""
+
+    group_ids = list(group_ids)
+    client = graph_client.get_client(access_token)
+    member_ids = set()
+
+    for start in range(0, len(group_ids), MAX_CHECK_MEMBER_GROUPS):
+        chunk = group_ids[start:start + MAX_CHECK_MEMBER_GROUPS]
+
+        if transitive:
+            response = client.post(f'{config.GRAPH_BASE_URL_USER}/{user}/checkMemberGroups', json={'groupIds': chunk})
+            response.raise_for_status()
+            member_ids.update(response.json().get('value', []))
+        else:
+            for page in iter_pages(direct_membership_filter_url(user, chunk), client):
+                member_ids.update(group['id'] for group in page['value'])
+
+    return {
+        'status_code': 200,
+        'groups': {group_id: group_id in member_ids for group_id in group_ids}
+    }
+
+
 @decorators.handle_http_exceptions
 def get_user_group_by_name (user_id:str,group_name:str,access_token:str) -> dict: 
     
@@ -195,7 +433,7 @@ def get_user_group_by_name (user_id:str,group_name:str,access_token:str) -> dict
     Args:
         user_id (str): AAD user Id. 
         group_name (str): The group name to search. This could be substring of the group name.
-        access_token (str): The Grah API access token.
+        access_token (str | TokenProvider | GraphClient): The Grah API access token.
 
     Returns:
         dict: A dictionary containing status code, group id, group name .
@@ -203,6 +441,10 @@ def get_user_group_by_name (user_id:str,group_name:str,access_token:str) -> dict
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to obtain group fails."""
 
+    directory = getattr(access_token, 'group_directory', None)
+    if directory is not None:
+        return directory.get_user_group_by_name(user_id, group_name, access_token)
+
     url = f'{config.GRAPH_BASE_URL_USER}/{user_id}/memberOf/microsoft.graph.group'
 
     params = {
@@ -211,26 +453,26 @@ def get_user_group_by_name (user_id:str,group_name:str,access_token:str) -> dict
         '$select': 'displayName,id'
     }
 
-    header = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
 
-    result = requests.get(url,headers=header, params=params)
+    result = client.get(url, params=params)
     result.raise_for_status()
     groups_data = result.json()
 
     if groups_data['@odata.count'] == 0:
         
-        return {
-            'status_code':404,
-            'message':f'No AAD group that contains {group_name} found for the user. Try another name.'
-        }
+        return models.OperationResult(
+            status_code=404,
+            message=f'No AAD group that contains {group_name} found for the user. Try another name.'
+        )
 
     for group in groups_data['value']:
         if group_name in group['displayName']:
-            return {
-                'status_code':result.status_code,
-                'group_id':group['id'],
-                'group_name':group['displayName']
-            }
+            return models.OperationResult(
+                status_code=result.status_code,
+                group_id=group['id'],
+                group_name=group['displayName']
+            )
 
 
 @decorators.handle_http_exceptions    
@@ -242,7 +484,7 @@ def add_user_to_group(user_upn:str, group_name:str, access_token:str) -> dict:
     Args:
         user_upn (str): The User principal name to find.
         group_name (str): The group to find. This could be a substring of the group name.  
-        access_token (str): The Graph API access token.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
 
     Returns:
         dict: A dictionary containing the status code, id, job_title .
@@ -250,15 +492,15 @@ def add_user_to_group(user_upn:str, group_name:str, access_token:str) -> dict:
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to add user fails.    """
 
-    response_user_info = get_user_from_upn(user_upn, access_token)
+    response_user_info = _resolve(access_token, 'user', user_upn, lambda: get_user_from_upn(user_upn, access_token))
     if response_user_info.get('status_code') != 200:
         return response_user_info
 
     user_id = response_user_info.get('id')
 
  
-    response_user_group = get_group_by_name(group_name,access_token)
-    if response_user_group.get('status_code') != 200:
+    response_user_group = _resolve(access_token, 'group', group_name, lambda: get_group_by_name(group_name,access_token))
+    if response_user_group.get('status_code') != 200 or 'group_id' not in response_user_group:
         return response_user_group
 
     group_id = response_user_group.get('group_id')
@@ -270,14 +512,15 @@ def add_user_to_group(user_upn:str, group_name:str, access_token:str) -> dict:
         '@odata.id': f'{config.GRAPH_BASE_URL}/directoryObjects/{user_id}'
     }
 
-    headers = get_http_header(access_token)
-    response = requests.post(url, headers=headers, json=payload)
+    client = graph_client.get_client(access_token)
+    response = client.post(url, json=payload)
     response.raise_for_status()
+    _invalidate_user(access_token, user_id)
 
-    return {
-        'status_code':response.status_code,
-        'message': f'User {user_upn} added to AAD group {group_name} successfully.'
-    }
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User {user_upn} added to AAD group {group_name} successfully.'
+    )
 
 @decorators.handle_http_exceptions
 def remove_user_from_group(user_upn:str, group_name:str, access_token:str) -> dict:
@@ -288,7 +531,7 @@ def remove_user_from_group(user_upn:str, group_name:str, access_token:str) -> di
     Args:
         user_upn (str): The User principal name to find.
         group_name (str): The group to find. This could be a substring of the group name.  
-        access_token (str): The Graph API access token.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
 
     Returns:
         dict: A dictionary containing the status code and graph result  .
@@ -296,14 +539,15 @@ def remove_user_from_group(user_upn:str, group_name:str, access_token:str) -> di
     Raises:
         requests.exceptions.HTTPError: If the HTTP request to remove user fails."""
 
-    response_user_info = get_user_from_upn(user_upn, access_token)
+    response_user_info = _resolve(access_token, 'user', user_upn, lambda: get_user_from_upn(user_upn, access_token))
 
     if response_user_info.get('status_code') != 200:
         return response_user_info
     user_id = response_user_info.get('id')
 
    
-    response_user_group = get_user_group_by_name(user_id,group_name,access_token)
+    response_user_group = _resolve(access_token, 'user_group', (user_id, group_name),
+                                   lambda: get_user_group_by_name(user_id,group_name,access_token))
     #response_user_group = get_group_by_name(group_name,access_token)
     if response_user_group.get('status_code') != 200:
         return response_user_group
@@ -312,15 +556,16 @@ def remove_user_from_group(user_upn:str, group_name:str, access_token:str) -> di
     group_name = response_user_group.get('group_name')
 
     url = f'{config.GRAPH_BASE_URL_GROUP}/{group_id}/members/{user_id}/$ref'
-    headers = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
         
-    response = requests.delete(url, headers=headers)
+    response = client.delete(url)
     response.raise_for_status()
+    _invalidate_user(access_token, user_id)
 
-    return {
-        'status_code':response.status_code,
-        'message': f'User {user_upn} removed from AAD group {group_name} successfully.'
-    }
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User {user_upn} removed from AAD group {group_name} successfully.'
+    )
 
 
 @decorators.handle_http_exceptions
@@ -334,7 +579,7 @@ def user_reset_password(user_upn:str, new_password:str, access_token:str, force_
     Args:
         user_upn (str): The user's principal name (UPN).
         new_password (str): The new password to set for the user.
-        access_token (str): The access token for the Graph API.
+        access_token (str | TokenProvider | GraphClient): The access token for the Graph API.
         force_change_password_next_signin (bool, optional): If True, the user will be required to change the password at the next sign-in. Defaults to False.
 
     Returns:
@@ -346,7 +591,7 @@ def user_reset_password(user_upn:str, new_password:str, access_token:str, force_
 
     url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}'
 
-    headers = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
 
 
     payload = {
@@ -356,23 +601,24 @@ def user_reset_password(user_upn:str, new_password:str, access_token:str, force_
         }
     }
 
-    response = requests.patch(url, headers=headers, json=payload)
+    response = client.patch(url, json=payload)
     response.raise_for_status()
 
-    return {
-        'status_code':response.status_code,
-        'message': f'Success. User {user_upn} password has been changed.'
-    }
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'Success. User {user_upn} password has been changed.'
+    )
 
 
 @decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.CRITICAL)
 def user_revoke_sessions(user_upn:str, access_token: str):
     """
-    Revokes all active sessions for a specified user.
+    Revokes all active sessions for a specified user. Runs at CRITICAL priority unless the caller chose one.
 
     Args:
         user_upn (str): The user's principal name (UPN).
-        access_token (str): The access token for the Graph API.
+        access_token (str | TokenProvider | GraphClient): The access token for the Graph API.
 
     Returns:
         dict: A dictionary containing the status code and a message indicating that the user's sessions were revoked.
@@ -382,26 +628,26 @@ def user_revoke_sessions(user_upn:str, access_token: str):
     """
 
     url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}/revokeSignInSessions'
-    headers = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
 
-    response = requests.post(url, headers=headers)
+    response = client.post(url)
     response.raise_for_status()
 
-    return {
-        'status_code': response.status_code,
-        'message': f'User {user_upn} sessions have been revoked successfully.'
-    }
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User {user_upn} sessions have been revoked successfully.'
+    )
 
 @decorators.handle_http_exceptions
 def user_set_account_status(user_upn:str, enable_account:bool , access_token: str,) -> dict:
 
     """
-    Sets the user's account status (enabled or disabled).
+    Sets the user's account status (enabled or disabled). Disabling runs at CRITICAL priority unless the caller chose one.
 
     Args:
         user_upn (str): The user's principal name.
         enable_account (bool): True to enable the account, False to disable it.
-        access_token (str): The access token for the Graph API.
+        access_token (str | TokenProvider | GraphClient): The access token for the Graph API.
 
     Returns:
         dict: A dictionary containing the status code and the result of the operation.
@@ -411,19 +657,20 @@ def user_set_account_status(user_upn:str, enable_account:bool , access_token: st
     """
 
     url = f'{config.GRAPH_BASE_URL_USER}/{user_upn}'
-    headers = get_http_header(access_token)
+    client = graph_client.get_client(access_token)
 
     payload = {
         'accountEnabled':enable_account
     }
 
-    response = requests.patch(url, headers=headers, json=payload)
+    with scheduling.default_priority(None if enable_account else scheduling.CRITICAL):
+        response = client.patch(url, json=payload)
     response.raise_for_status()
 
     status_message = "enabled" if enable_account else "disabled"
 
-    return {
-        'status_code':response.status_code,
-        'message': f'User account {user_upn} has been {status_message} successfully.'
-    }
+    return models.OperationResult(
+        status_code=response.status_code,
+        message=f'User account {user_upn} has been {status_message} successfully.'
+    )
 
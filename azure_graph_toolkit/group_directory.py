@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+import requests
+from . import config
+from . import graph_utils
+from . import models
+
+DEFAULT_REFRESH_INTERVAL = 60
+
+# Queries shorter than an n-gram are answered by scanning every name.
+NGRAM_SIZE = 3
+
+
+def _ngrams(text:str) -> set:
+    text = text.lower()
+    return {text[start:start + NGRAM_SIZE] for start in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class GroupDirectory:
+    """
+    Local copy of every group's id and displayName with a trigram index, answering name lookups without $search.
+
+    The groups are loaded once from /groups/delta and kept up to date incrementally: a lookup made
+    more than refresh_interval seconds after the last refresh first applies the changes since then.
+    Matching is case-sensitive like the Python filter of graph_utils.get_group_by_name, and a
+    substring may start anywhere in the name, not only at a word boundary as with $search.
+
+    Pass the directory to a GraphClient as group_directory to have graph_utils.get_group_by_name
+    and graph_utils.get_user_group_by_name use it.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        refresh_interval (float, optional): Seconds after which a lookup first applies the changes since the last refresh.
+            Defaults to 60. None refreshes only when refresh() is called.
+    """
+
+    def __init__(self, access_token, refresh_interval:float = DEFAULT_REFRESH_INTERVAL):
+        self.access_token = access_token
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._keys = {}             # group id -> key
+        self._ids = []              # key -> group id, None once deleted
+        self._names = []            # key -> displayName
+        self._ngrams = {}           # trigram of the lower-case name -> set of keys
+        self._free = []             # keys of deleted groups, reused by new groups
+        self.delta_link = None
+        self.last_refresh = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Loading
+
+    def refresh(self) -> int:
+        """
+        Loads every group on the first call and applies the changes since the previous call afterwards.
+
+        Returns:
+            int: The number of group changes applied.
+
+        Raises:
+            requests.exceptions.HTTPError: If a delta request fails."""
+
+        with self._refresh_lock:
+            try:
+                return self._refresh()
+            except requests.exceptions.HTTPError as http_err:
+                # 410 Gone: the delta link expired and a full reload is required.
+                if http_err.response is None or http_err.response.status_code != 410:
+                    raise
+                logging.warning('Group delta link expired, reloading the group directory.')
+                with self._lock:
+                    self._reset()
+                return self._refresh()
+
+    def _refresh(self) -> int:
+        started = time.monotonic()
+        if self.delta_link is None:
+            url, params = f'{config.GRAPH_BASE_URL_GROUP}/delta', {'$select': 'id,displayName'}
+        else:
+            url, params = self.delta_link, None
+
+        count = 0
+        for page in graph_utils.iter_pages(url, self.access_token, params):
+            with self._lock:
+                for group in page.get('value', []):
+                    self._apply(group)
+                    count = count + 1
+            if '@odata.deltaLink' in page:
+                self.delta_link = page['@odata.deltaLink']
+
+        self.last_refresh = started
+        return count
+
+    def _apply(self, group:dict):
+        # Caller must hold self._lock.
+        group_id = group['id']
+        key = self._keys.get(group_id)
+
+        if '@removed' in group:
+            if key is not None:
+                self._unindex(key)
+                del self._keys[group_id]
+                self._ids[key] = None
+                self._free.append(key)
+            return
+
+        name = group.get('displayName')
+        if name is None:
+            return
+        if key is None:
+            if self._free:
+                key = self._free.pop()
+                self._ids[key], self._names[key] = group_id, name
+            else:
+                key = len(self._ids)
+                self._ids.append(group_id)
+                self._names.append(name)
+            self._keys[group_id] = key
+        elif self._names[key] == name:
+            return
+        else:
+            self._unindex(key)
+            self._names[key] = name
+
+        for ngram in _ngrams(name):
+            self._ngrams.setdefault(ngram, set()).add(key)
+
+    def _unindex(self, key:int):
+        for ngram in _ngrams(self._names[key]):
+            keys = self._ngrams.get(ngram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._ngrams[ngram]
+
+    def _ensure_fresh(self):
+        if self.last_refresh is None or (self.refresh_interval is not None
+                                         and time.monotonic() - self.last_refresh > self.refresh_interval):
+            self.refresh()
+
+    # Lookups
+
+    def find(self, name:str, match:str = 'substring') -> list:
+        """
+        Finds groups by name.
+
+        Args:
+            name (str): The name, prefix or substring to look for (case-sensitive).
+            match (str, optional): 'substring', 'prefix' or 'exact'. Defaults to 'substring'.
+
+        Returns:
+            list: Group mappings containing the displayName and id of each matching group.
+
+        Raises:
+            ValueError: If match is not one of the supported modes.
+            requests.exceptions.HTTPError: If the directory has to be refreshed and the delta request fails."""
+
+        if match == 'substring':
+            matches = lambda candidate: name in candidate
+        elif match == 'prefix':
+            matches = lambda candidate: candidate.startswith(name)
+        elif match == 'exact':
+            matches = lambda candidate: candidate == name
+        else:
+            raise ValueError(f"Unknown match mode {match}. Use 'substring', 'prefix' or 'exact'.")
+
+        self._ensure_fresh()
+
+        with self._lock:
+            if len(name) < NGRAM_SIZE:
+                candidates = self._keys.values()
+            else:
+                postings = []
+                for ngram in _ngrams(name):
+                    keys = self._ngrams.get(ngram)
+                    if not keys:
+                        return []
+                    postings.append(keys)
+                postings.sort(key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+
+            names, ids = self._names, self._ids
+            return [models.Group(display_name=names[key], id=ids[key]) for key in sorted(candidates) if matches(names[key])]
+
+    def get_group_by_name(self, group_name:str, match:str = 'substring') -> dict:
+        """
+        Gets group information by name. Same result format and ambiguity messages as graph_utils.get_group_by_name.
+
+        Args:
+            group_name (str): The group name to find. This could be a substring of the group name.
+            match (str, optional): 'substring', 'prefix' or 'exact'. Defaults to 'substring'.
+
+        Returns:
+            dict: A dictionary containings the group id and group name."""
+
+        groups = self.find(group_name, match)
+
+        if not groups:
+            return models.OperationResult(
+                status_code=404,
+                message=f'No AAD group that contains {group_name} found. Try another name.'
+            )
+
+        if len(groups) > 1:
+            return models.OperationResult(
+                status_code=200,
+                message=f'Too much AAD group that contains {group_name} found. Try another name.'
+            )
+
+        return models.OperationResult(
+            status_code=200,
+            group_id=groups[0]['id'],
+            group_name=groups[0]['displayName']
+        )
+
+    def get_user_group_by_name(self, user_id:str, group_name:str, access_token=None) -> dict:
+        """
+        Gets a specific group membership of a user. Same result format as graph_utils.get_user_group_by_name.
+
+        The user's groups are read with a plain paged memberOf request and matched locally.
+
+        Args:
+            user_id (str): AAD user Id.
+            group_name (str): The group name to search. This could be substring of the group name.
+            access_token (str | TokenProvider | GraphClient, optional): Token used to read the user's groups.
+                Defaults to the directory's token.
+
+        Returns:
+            dict: A dictionary containing status code, group id, group name.
+
+        Raises:
+            requests.exceptions.HTTPError: If the HTTP request to obtain the user's groups fails."""
+
+        for group in graph_utils.iter_user_membership_groups(user_id, access_token or self.access_token):
+            if group_name in group['displayName']:
+                return models.OperationResult(
+                    status_code=200,
+                    group_id=group['id'],
+                    group_name=group['displayName']
+                )
+
+        return models.OperationResult(
+            status_code=404,
+            message=f'No AAD group that contains {group_name} found for the user. Try another name.'
+        )
@@ -0,0 +1,141 @@
+import secrets
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from . import batch as graph_batch
+from . import graph_client
+from .utils import decorators
+from .utils import scheduling
+from .utils import throttling
+
+LOCKDOWN_STEPS = ('disable', 'revoke_sessions', 'reset_password')
+
+DEFAULT_MAX_WORKERS = 8
+
+PASSWORD_LENGTH = 24
+_PASSWORD_CLASSES = (string.ascii_lowercase, string.ascii_uppercase, string.digits, '!#$%&*+-=?@^_')
+
+
+def generate_password(length:int = PASSWORD_LENGTH) -> str:
+    """
+    Generates a random password containing lower and upper case letters, digits and symbols.
+
+    Args:
+        length (int, optional): Password length. Defaults to 24.
+
+    Returns:
+        str: The password."""
+
+    alphabet = ''.join(_PASSWORD_CLASSES)
+    characters = [secrets.choice(characters) for characters in _PASSWORD_CLASSES]
+    characters.extend(secrets.choice(alphabet) for _ in range(length - len(characters)))
+    secrets.SystemRandom().shuffle(characters)
+    return ''.join(characters)
+
+
+def _lockdown_chunk(client, upns:list, steps:tuple, passwords:dict, force_change_password_next_signin:bool, level:str) -> dict:
+    # Sends the steps of a few users in one $batch payload and returns their reports.
+    batch = graph_batch.GraphBatch(client)
+    request_steps = {}
+
+    for upn in upns:
+        for step in steps:
+            if step == 'disable':
+                request_id = batch.user_set_account_status(upn, False)
+            elif step == 'revoke_sessions':
+                request_id = batch.user_revoke_sessions(upn)
+            else:
+                request_id = batch.user_reset_password(upn, passwords[upn], force_change_password_next_signin)
+            request_steps[request_id] = (upn, step)
+
+    try:
+        with scheduling.priority(level):
+            results = batch.execute()
+    except requests.exceptions.HTTPError as http_err:
+        error = decorators.http_error_response(http_err.response)
+        results = {request_id: error for request_id in request_steps}
+    except throttling.TRANSIENT_ERRORS as err:
+        error = {'status_code': 503, 'message': f'Batch request failed: {err}'}
+        results = {request_id: error for request_id in request_steps}
+
+    reports = {upn: {'steps': {}} for upn in upns}
+    for request_id, (upn, step) in request_steps.items():
+        reports[upn]['steps'][step] = results.get(request_id, {'status_code': 500, 'message': 'No response for the step.'})
+    return reports
+
+
+@decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.CRITICAL)
+def lockdown_users(upns, access_token, steps=LOCKDOWN_STEPS, passwords:dict = None,
+                   force_change_password_next_signin:bool = True, max_workers:int = DEFAULT_MAX_WORKERS) -> dict:
+    """
+    Locks down compromised accounts: disables them, revokes their sessions and resets their passwords.
+
+    The steps of several users are packed into $batch payloads of 20 sub-requests, and up to
+    max_workers payloads are sent concurrently. The steps of one user are independent
+    sub-requests, so a failing step doesn't keep the others from running. Throttled sub-requests
+    are retried by GraphBatch. Runs at CRITICAL priority unless the caller chose one.
+
+    Args:
+        upns (iterable): User Principal Names (UPN) or user ids of the accounts to lock down.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        steps (tuple, optional): Steps to run among 'disable', 'revoke_sessions' and 'reset_password'. Defaults to all three.
+        passwords (dict, optional): New password per user. Users without one get a generated password,
+            returned in their report.
+        force_change_password_next_signin (bool, optional): Passed on to the password reset. Defaults to True.
+        max_workers (int, optional): Number of $batch requests sent concurrently. Defaults to 8.
+
+    Returns:
+        dict: A dictionary containing the status code, the number of users that succeeded and failed,
+            the elapsed wall-clock seconds and a users dictionary mapping each user to its report: ok,
+            the status code and message of each step and, if generated, the new password.
+
+    Raises:
+        ValueError: If a step is unknown."""
+
+    started = time.monotonic()
+    steps = tuple(steps)
+    unknown = [step for step in steps if step not in LOCKDOWN_STEPS]
+    if unknown or not steps:
+        raise ValueError(f'Unknown or missing steps {unknown}. Valid steps are {", ".join(LOCKDOWN_STEPS)}.')
+
+    client = graph_client.get_client(access_token)
+    upns = list(dict.fromkeys(upns))
+    passwords = dict(passwords or {})
+    generated = set()
+    if 'reset_password' in steps:
+        for upn in upns:
+            if not passwords.get(upn):
+                passwords[upn] = generate_password()
+                generated.add(upn)
+
+    # Keep the steps of one user in the same payload.
+    users_per_batch = graph_batch.MAX_BATCH_SIZE // len(steps)
+    chunks = [upns[start:start + users_per_batch] for start in range(0, len(upns), users_per_batch)]
+    level = scheduling.current_priority()
+
+    reports = {}
+    if chunks:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix='graph-lockdown') as executor:
+            futures = [executor.submit(_lockdown_chunk, client, chunk, steps, passwords, force_change_password_next_signin, level)
+                       for chunk in chunks]
+            for future in futures:
+                reports.update(future.result())
+
+    succeeded = 0
+    for upn in upns:
+        report = reports[upn]
+        report['ok'] = all(result.get('status_code') is not None and result['status_code'] < 400
+                           for result in report['steps'].values())
+        if upn in generated and (report['steps']['reset_password'].get('status_code') or 500) < 400:
+            report['password'] = passwords[upn]
+        succeeded = succeeded + report['ok']
+
+    return {
+        'status_code': 200,
+        'succeeded': succeeded,
+        'failed': len(upns) - succeeded,
+        'elapsed_seconds': time.monotonic() - started,
+        'users': reports
+    }
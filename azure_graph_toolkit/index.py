@@ -0,0 +1,384 @@
+"""
+Compact in-memory index of user to group memberships.
+
+User and group ids are interned to consecutive integer keys. Every group keeps a bitmap of its
+member keys (one bit per user) and every user an array of its group keys, so 200k users in 3k
+groups fit in tens of megabytes instead of gigabytes of dictionaries. Membership tests are two
+dictionary lookups and a bit test; set operations between groups run on whole bitmaps at once.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+
+_MAGIC = b'AGTMIDX1'
+_HEADER = struct.Struct('<8sIII')
+_SECTION = struct.Struct('<Q')
+
+
+def _bitmap_keys(bitmap) -> list:
+    keys = []
+    for byte_index, byte in enumerate(bitmap):
+        if byte:
+            base = byte_index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    keys.append(base + bit)
+    return keys
+
+
+def _little_endian(values:array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode:str, data:bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class MembershipIndex:
+    """
+    Membership index interning object ids to integer keys, with a bitmap per group and an array per user.
+
+    Users can be given by id or UPN and groups by id. Reads need no locking; writes from several
+    threads must be serialized by the caller.
+    """
+
+    def __init__(self):
+        self._user_keys = {}        # user id -> key
+        self._upn_keys = {}         # lower-case UPN -> key
+        self._user_ids = []
+        self._user_names = []
+        self._user_groups = []      # key -> array of group keys
+
+        self._group_keys = {}       # group id -> key
+        self._group_ids = []
+        self._group_names = []
+        self._group_members = []    # key -> bytearray bitmap of user keys
+
+    def __len__(self):
+        return sum(len(groups) for groups in self._user_groups)
+
+    # Interning
+
+    def intern_user(self, user_id:str, upn:str = None) -> int:
+        """Returns the key of a user, adding the user if it is new."""
+
+        key = self._user_keys.get(user_id)
+        if key is None:
+            key = self._user_keys[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._user_names.append('')
+            self._user_groups.append(array('I'))
+        if upn:
+            self._user_names[key] = upn
+            self._upn_keys[upn.lower()] = key
+        return key
+
+    def intern_group(self, group_id:str, display_name:str = None) -> int:
+        """Returns the key of a group, adding the group if it is new."""
+
+        key = self._group_keys.get(group_id)
+        if key is None:
+            key = self._group_keys[group_id] = len(self._group_ids)
+            self._group_ids.append(group_id)
+            self._group_names.append('')
+            self._group_members.append(bytearray())
+        if display_name:
+            self._group_names[key] = display_name
+        return key
+
+    def user_key(self, user:str) -> int:
+        """Returns the key of a user given by id or UPN, or None if the user is unknown."""
+
+        key = self._user_keys.get(user)
+        if key is None:
+            key = self._upn_keys.get(user.lower())
+        return key
+
+    def group_key(self, group_id:str) -> int:
+        """Returns the key of a group, or None if the group is unknown."""
+        return self._group_keys.get(group_id)
+
+    # Writes
+
+    def add(self, user_id:str, group_id:str, upn:str = None, display_name:str = None):
+        """
+        Records that the user is a member of the group.
+
+        Args:
+            user_id (str): The user id.
+            group_id (str): The group id.
+            upn (str, optional): The user's UPN, to look the user up by UPN.
+            display_name (str, optional): The group's display name."""
+
+        user = self.intern_user(user_id, upn)
+        group = self.intern_group(group_id, display_name)
+
+        bitmap = self._group_members[group]
+        byte_index = user >> 3
+        if byte_index >= len(bitmap):
+            bitmap.extend(bytes(byte_index + 1 - len(bitmap)))
+        mask = 1 << (user & 7)
+        if not bitmap[byte_index] & mask:
+            bitmap[byte_index] |= mask
+            self._user_groups[user].append(group)
+
+    def add_user_groups(self, user_id:str, groups:list, upn:str = None):
+        """
+        Records the memberships of a user from the group list returned by graph_utils.get_user_membership_groups.
+
+        Args:
+            user_id (str): The user id.
+            groups (list): Dictionaries with the 'id' and 'displayName' of each group.
+            upn (str, optional): The user's UPN."""
+
+        self.intern_user(user_id, upn)
+        for group in groups:
+            self.add(user_id, group['id'], display_name=group.get('displayName'))
+
+    def remove(self, user_id:str, group_id:str):
+        """Records that the user is no longer a member of the group. Unknown users and groups are ignored."""
+
+        user, group = self.user_key(user_id), self.group_key(group_id)
+        if user is None or group is None or not self.has_key(user, group):
+            return
+        self._group_members[group][user >> 3] &= ~(1 << (user & 7)) & 0xFF
+        self._user_groups[user].remove(group)
+
+    # Reads
+
+    def has_key(self, user_key:int, group_key:int) -> bool:
+        """Membership test on already interned keys, for hot loops."""
+
+        bitmap = self._group_members[group_key]
+        byte_index = user_key >> 3
+        return byte_index < len(bitmap) and bool(bitmap[byte_index] >> (user_key & 7) & 1)
+
+    def is_member(self, user:str, group_id:str) -> bool:
+        """
+        Checks if the user is a direct member of the group.
+
+        Args:
+            user (str): The user id or UPN.
+            group_id (str): The group id.
+
+        Returns:
+            bool: A boolean value."""
+
+        user_key = self._user_keys.get(user)
+        if user_key is None:
+            user_key = self._upn_keys.get(user.lower())
+        group_key = self._group_keys.get(group_id)
+        if user_key is None or group_key is None:
+            return False
+        bitmap = self._group_members[group_key]
+        byte_index = user_key >> 3
+        return byte_index < len(bitmap) and bool(bitmap[byte_index] >> (user_key & 7) & 1)
+
+    def groups_of(self, user:str) -> list:
+        """Returns the ids of the groups the user (id or UPN) is a member of."""
+
+        key = self.user_key(user)
+        if key is None:
+            return []
+        group_ids = self._group_ids
+        return [group_ids[group] for group in self._user_groups[key]]
+
+    def members_of(self, group_id:str) -> list:
+        """Returns the ids of the members of the group."""
+
+        key = self.group_key(group_id)
+        if key is None:
+            return []
+        return self._user_list(self._group_members[key])
+
+    def member_count(self, group_id:str) -> int:
+        """Returns the number of members of the group."""
+
+        key = self.group_key(group_id)
+        if key is None:
+            return 0
+        return bin(int.from_bytes(self._group_members[key], 'little')).count('1')
+
+    def get_user_membership_groups(self, user:str) -> dict:
+        """
+        Lists the groups of a user in the format of graph_utils.get_user_membership_groups.
+
+        Args:
+            user (str): The user id or UPN.
+
+        Returns:
+            dict: A dictionary containing all group names and group ids which user is member of."""
+
+        key = self.user_key(user)
+        if key is None or not self._user_groups[key]:
+            return {
+                'status_code':404,
+                'message': f'No AAD groups found for user {user}.'
+            }
+
+        return {'status_code': 200,
+                'groups': [{"displayName": self._group_names[group], "id": self._group_ids[group]}
+                           for group in self._user_groups[key]]}
+
+    # Set operations
+
+    def _bits(self, group_id:str) -> int:
+        key = self.group_key(group_id)
+        return 0 if key is None else int.from_bytes(self._group_members[key], 'little')
+
+    def _user_list(self, bitmap) -> list:
+        user_ids = self._user_ids
+        return [user_ids[key] for key in _bitmap_keys(bitmap)]
+
+    def _bits_to_users(self, bits:int) -> list:
+        return self._user_list(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+
+    def intersection(self, *group_ids) -> list:
+        """Returns the ids of the users that are members of every given group."""
+
+        bits = self._bits(group_ids[0]) if group_ids else 0
+        for group_id in group_ids[1:]:
+            bits &= self._bits(group_id)
+        return self._bits_to_users(bits)
+
+    def union(self, *group_ids) -> list:
+        """Returns the ids of the users that are members of any given group."""
+
+        bits = 0
+        for group_id in group_ids:
+            bits |= self._bits(group_id)
+        return self._bits_to_users(bits)
+
+    def difference(self, group_id:str, *other_group_ids) -> list:
+        """Returns the ids of the members of group_id that are not members of any of the other groups."""
+
+        bits = self._bits(group_id)
+        for other in other_group_ids:
+            bits &= ~self._bits(other)
+        return self._bits_to_users(bits)
+
+    # Construction from other sources
+
+    @classmethod
+    def from_mirror(cls, mirror) -> 'MembershipIndex':
+        """
+        Builds an index from a synced DirectoryMirror.
+
+        Args:
+            mirror (DirectoryMirror): The mirror to copy.
+
+        Returns:
+            MembershipIndex: The index."""
+
+        index = cls()
+        with mirror._lock:
+            for user_id, upn in mirror.users.items():
+                index.intern_user(user_id, upn)
+            for group_id, display_name in mirror.groups.items():
+                index.intern_group(group_id, display_name)
+            for user_id, group_ids in mirror.user_groups.items():
+                for group_id in group_ids:
+                    index.add(user_id, group_id)
+        return index
+
+    # Persistence
+
+    def save(self, path:str):
+        """
+        Writes the index to a compact binary file: id and name tables plus the per-user group arrays, zlib compressed.
+
+        Args:
+            path (str): The file path."""
+
+        offsets = array('I', [0])
+        group_keys = array('I')
+        for groups in self._user_groups:
+            group_keys.extend(groups)
+            offsets.append(len(group_keys))
+
+        sections = [
+            '\n'.join(self._user_ids).encode(),
+            '\n'.join(self._user_names).encode(),
+            '\n'.join(self._group_ids).encode(),
+            '\n'.join(self._group_names).encode(),
+            _little_endian(offsets),
+            _little_endian(group_keys)
+        ]
+        payload = b''.join(_SECTION.pack(len(section)) + section for section in sections)
+
+        with open(path, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, len(self._user_ids), len(self._group_ids), len(group_keys)))
+            file.write(zlib.compress(payload))
+
+    @classmethod
+    def load(cls, path:str) -> 'MembershipIndex':
+        """
+        Reads an index written by save().
+
+        Args:
+            path (str): The file path.
+
+        Returns:
+            MembershipIndex: The index.
+
+        Raises:
+            ValueError: If the file is not a membership index."""
+
+        with open(path, 'rb') as file:
+            header = file.read(_HEADER.size)
+            if len(header) != _HEADER.size or header[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f'{path} is not a membership index file.')
+            _, user_count, group_count, _ = _HEADER.unpack(header)
+            payload = zlib.decompress(file.read())
+
+        sections = []
+        position = 0
+        while position < len(payload):
+            (length,) = _SECTION.unpack_from(payload, position)
+            position = position + _SECTION.size
+            sections.append(payload[position:position + length])
+            position = position + length
+
+        def strings(data, count):
+            return data.decode().split('\n') if count else []
+
+        index = cls()
+        user_ids, user_names = strings(sections[0], user_count), strings(sections[1], user_count)
+        group_ids, group_names = strings(sections[2], group_count), strings(sections[3], group_count)
+        offsets = _from_little_endian('I', sections[4])
+        group_keys = _from_little_endian('I', sections[5])
+
+        for user_id, upn in zip(user_ids, user_names):
+            index.intern_user(user_id, upn)
+        for group_id, display_name in zip(group_ids, group_names):
+            index.intern_group(group_id, display_name)
+
+        bitmap_size = (user_count + 7) // 8
+        index._group_members = [bytearray(bitmap_size) for _ in range(group_count)]
+        for user in range(user_count):
+            groups = group_keys[offsets[user]:offsets[user + 1]]
+            index._user_groups[user] = groups
+            byte_index, mask = user >> 3, 1 << (user & 7)
+            for group in groups:
+                index._group_members[group][byte_index] |= mask
+        return index
+
+    def stats(self) -> dict:
+        """Returns the number of users, groups and memberships and the approximate bytes used by the membership structures."""
+
+        return {
+            'users': len(self._user_ids),
+            'groups': len(self._group_ids),
+            'memberships': len(self),
+            'membership_bytes': sum(len(bitmap) for bitmap in self._group_members)
+                                + sum(groups.itemsize * len(groups) for groups in self._user_groups)
+        }
@@ -0,0 +1,142 @@
+from . import graph_client
+from . import graph_utils
+from .batch import GraphBatch
+
+
+class MembershipChecker:
+    """
+    Answers membership questions for a fixed set of groups with server-side checks.
+
+    The target groups are resolved to ids once. Each user is then checked against all of them with
+    one checkMemberGroups request per 20 groups (or a filtered memberOf request for direct
+    membership), instead of downloading the user's whole group list. check_users() packs the
+    requests of many users into $batch calls.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        group_names (list, optional): Group names to resolve, with the same substring semantics as graph_utils.get_group_by_name.
+        group_ids (dict | list, optional): Already known group ids, either as a list or as a dictionary mapping a label to an id.
+        transitive (bool, optional): If True, memberships through nested groups count as well. Defaults to True.
+    """
+
+    def __init__(self, access_token, group_names:list = None, group_ids=None, transitive:bool = True):
+        self.client = graph_client.get_client(access_token)
+        self.transitive = transitive
+        self._group_names = list(group_names or [])
+
+        if isinstance(group_ids, dict):
+            self._group_ids = dict(group_ids)
+        else:
+            self._group_ids = {group_id: group_id for group_id in group_ids or []}
+        self._resolved = not self._group_names
+
+    @property
+    def group_ids(self) -> dict:
+        """
+        A dictionary mapping each group label (name or id) to its group id, resolving names on first use.
+
+        Raises:
+            ValueError: If a group name matches no group or several groups."""
+
+        if not self._resolved:
+            errors = []
+            for group_name in self._group_names:
+                result = graph_utils._resolve(self.client, 'group', group_name,
+                                              lambda: graph_utils.get_group_by_name(group_name, self.client))
+                if 'group_id' in result:
+                    self._group_ids[group_name] = result['group_id']
+                else:
+                    errors.append(result.get('message'))
+            if errors:
+                raise ValueError(' '.join(str(error) for error in errors))
+            self._resolved = True
+        return self._group_ids
+
+    def check(self, user:str) -> dict:
+        """
+        Checks the user's membership of every target group.
+
+        Args:
+            user (str): The User Principal Name (UPN) or user id.
+
+        Returns:
+            dict: A dictionary containing the status code and a groups dictionary mapping each group label to a boolean."""
+
+        group_ids = self.group_ids
+        result = graph_utils.check_member_groups(user, list(set(group_ids.values())), self.client, self.transitive)
+        if result.get('status_code') != 200:
+            return result
+
+        return {
+            'status_code': 200,
+            'groups': {label: result['groups'][group_id] for label, group_id in group_ids.items()}
+        }
+
+    def is_member(self, user:str, group:str) -> bool:
+        """
+        Checks the user's membership of a single target group.
+
+        Args:
+            user (str): The User Principal Name (UPN) or user id.
+            group (str): The group label, as passed in group_names or group_ids.
+
+        Returns:
+            bool | dict: A boolean value, or the error result (status code and message) if the check
+                failed, e.g. because it was throttled. A failed check is never reported as False.
+
+        Raises:
+            KeyError: If group is not one of the target groups."""
+
+        group_id = self.group_ids[group]
+        result = graph_utils.check_member_groups(user, [group_id], self.client, self.transitive)
+        if result.get('status_code') != 200:
+            return result
+        return bool(result['groups'].get(group_id))
+
+    def check_users(self, users) -> dict:
+        """
+        Checks the membership of many users against every target group with as few round-trips as possible.
+
+        Requests are sent through $batch, so 20 (user, group chunk) checks share one HTTP call.
+
+        Args:
+            users (iterable): User Principal Names (UPN) or user ids.
+
+        Returns:
+            dict: A dictionary mapping each user to the result check() would return for it."""
+
+        group_ids = self.group_ids
+        unique_ids = list(set(group_ids.values()))
+        chunks = [unique_ids[start:start + graph_utils.MAX_CHECK_MEMBER_GROUPS]
+                  for start in range(0, len(unique_ids), graph_utils.MAX_CHECK_MEMBER_GROUPS)]
+
+        users = list(users)
+        batch = GraphBatch(self.client)
+        for user_index, user in enumerate(users):
+            for chunk_index, chunk in enumerate(chunks):
+                request_id = f'{user_index}:{chunk_index}'
+                if self.transitive:
+                    batch.add('POST', f'/users/{user}/checkMemberGroups', body={'groupIds': chunk}, request_id=request_id)
+                else:
+                    batch.add('GET', graph_utils.direct_membership_filter_url(user, chunk),
+                              headers={'ConsistencyLevel': 'eventual'}, request_id=request_id)
+
+        responses = batch.execute()
+
+        results = {}
+        for user_index, user in enumerate(users):
+            member_ids = set()
+            error = None
+            for chunk_index in range(len(chunks)):
+                response = responses.get(f'{user_index}:{chunk_index}', {'status_code': None, 'message': 'No batch response.'})
+                if response.get('status_code') != 200:
+                    error = response
+                    break
+                body = response.get('body') or {}
+                member_ids.update(value if isinstance(value, str) else value['id'] for value in body.get('value', []))
+
+            results[user] = error or {
+                'status_code': 200,
+                'groups': {label: group_id in member_ids for label, group_id in group_ids.items()}
+            }
+        return results
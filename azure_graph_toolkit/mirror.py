@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+import requests
+from . import config
+from . import graph_utils
+
+DEFAULT_REFRESH_INTERVAL = 60
+DEFAULT_MAX_STALENESS = 300
+
+
+class DirectoryMirror:
+    """
+    In-memory copy of users, groups and group memberships kept up to date through delta queries.
+
+    sync() bootstraps the mirror from /users/delta and /groups/delta on the first call and applies
+    only the changes since the stored delta links afterwards. start() runs sync() every
+    refresh_interval seconds in a background thread.
+
+    Answers are served from memory while the last successful sync is at most max_staleness seconds
+    old, so the data a caller sees can lag the directory by up to max_staleness seconds. Once the
+    mirror is staler than that, lookups fall back to live Graph API calls (or raise, if fallback is
+    disabled). Memberships are direct memberships, as returned by memberOf.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        refresh_interval (float, optional): Seconds between background syncs. Defaults to 60.
+        max_staleness (float, optional): Maximum age in seconds of the data served from memory. Defaults to 300.
+        fallback (bool, optional): If True, stale lookups are answered with live Graph API calls. Defaults to True.
+    """
+
+    def __init__(self, access_token, refresh_interval:float = DEFAULT_REFRESH_INTERVAL,
+                 max_staleness:float = DEFAULT_MAX_STALENESS, fallback:bool = True):
+
+        self.access_token = access_token
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.fallback = fallback
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.users = {}             # user id -> userPrincipalName
+        self.user_ids = {}          # lower-case userPrincipalName -> user id
+        self.groups = {}            # group id -> displayName
+        self.user_groups = {}       # user id -> set of group ids
+        self.delta_links = {}       # 'users' / 'groups' -> @odata.deltaLink
+        self.last_sync = None
+
+    @property
+    def staleness(self) -> float:
+        """Seconds since the last successful sync, or None if the mirror was never synced."""
+        return None if self.last_sync is None else time.monotonic() - self.last_sync
+
+    @property
+    def is_stale(self) -> bool:
+        """True if the mirror was never synced or the last sync is older than max_staleness."""
+        staleness = self.staleness
+        return staleness is None or staleness > self.max_staleness
+
+    def sync(self) -> dict:
+        """
+        Bootstraps the mirror or applies the changes since the last sync.
+
+        Returns:
+            dict: A dictionary containing the number of user and group changes applied.
+
+        Raises:
+            requests.exceptions.HTTPError: If a delta request fails."""
+
+        with self._sync_lock:
+            try:
+                return self._sync_all()
+            except requests.exceptions.HTTPError as http_err:
+                # 410 Gone: the delta links expired and a full resync is required.
+                if http_err.response is None or http_err.response.status_code != 410:
+                    raise
+                logging.warning('Delta links expired, rebuilding the directory mirror.')
+                with self._lock:
+                    self._reset()
+                return self._sync_all()
+
+    def _sync_all(self) -> dict:
+        started = time.monotonic()
+        changes = {
+            'users': self._sync_collection('users', f'{config.GRAPH_BASE_URL_USER}/delta',
+                                           {'$select': 'id,userPrincipalName'}, self._apply_user),
+            'groups': self._sync_collection('groups', f'{config.GRAPH_BASE_URL_GROUP}/delta',
+                                            {'$select': 'id,displayName,members'}, self._apply_group)
+        }
+        self.last_sync = started
+        return changes
+
+    def start(self):
+        """
+        Starts syncing in a background thread every refresh_interval seconds."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='graph-directory-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background sync thread."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except requests.exceptions.RequestException as err:
+                logging.error('Directory mirror sync failed: %s', err)
+            self._stop.wait(self.refresh_interval)
+
+    def _sync_collection(self, name:str, url:str, params:dict, apply) -> int:
+        delta_link = self.delta_links.get(name)
+        if delta_link is not None:
+            url, params = delta_link, None
+
+        count = 0
+        for page in graph_utils.iter_pages(url, self.access_token, params):
+            with self._lock:
+                for item in page.get('value', []):
+                    apply(item)
+                    count = count + 1
+            if '@odata.deltaLink' in page:
+                self.delta_links[name] = page['@odata.deltaLink']
+        return count
+
+    def _apply_user(self, user:dict):
+        # Caller must hold self._lock.
+        user_id = user['id']
+        old_upn = self.users.get(user_id)
+
+        if '@removed' in user:
+            self.users.pop(user_id, None)
+            self.user_groups.pop(user_id, None)
+            if old_upn is not None:
+                self.user_ids.pop(old_upn.lower(), None)
+            return
+
+        upn = user.get('userPrincipalName')
+        if upn is None:
+            return
+        if old_upn is not None and old_upn.lower() != upn.lower():
+            self.user_ids.pop(old_upn.lower(), None)
+        self.users[user_id] = upn
+        self.user_ids[upn.lower()] = user_id
+
+    def _apply_group(self, group:dict):
+        # Caller must hold self._lock.
+        group_id = group['id']
+
+        if '@removed' in group:
+            self.groups.pop(group_id, None)
+            for group_ids in self.user_groups.values():
+                group_ids.discard(group_id)
+            return
+
+        if 'displayName' in group:
+            self.groups[group_id] = group['displayName']
+
+        for member in group.get('members@delta', []):
+            if '@removed' in member:
+                self.user_groups.get(member['id'], set()).discard(group_id)
+            else:
+                self.user_groups.setdefault(member['id'], set()).add(group_id)
+
+    def _user_group_ids(self, user_upn:str) -> set:
+        with self._lock:
+            user_id = self.user_ids.get(user_upn.lower(), user_upn)
+            if user_id not in self.users:
+                return None
+            return set(self.user_groups.get(user_id, ()))
+
+    def is_user_member_of(self, user_upn:str, group_name:str) -> bool:
+        """
+        Check if user is member of specific AAD group. Same semantics as graph_utils.is_user_member_of.
+
+        Args:
+            user_upn (str): The User Principal Name (UPN) or user id.
+            group_name (str): The group name to search. This could be substring of the group name.
+
+        Returns:
+            bool: A boolean value.
+
+        Raises:
+            RuntimeError: If the mirror is stale and fallback is disabled."""
+
+        if self._use_live():
+            return graph_utils.is_user_member_of(user_upn, group_name, self.access_token)
+
+        group_ids = self._user_group_ids(user_upn)
+        if not group_ids:
+            return False
+        groups = self.groups
+        return any(group_name in groups.get(group_id, '') for group_id in group_ids)
+
+    def get_user_membership_groups(self, user_upn:str) -> dict:
+        """
+        Lists all AAD groups the user is a member of. Same result as graph_utils.get_user_membership_groups.
+
+        Args:
+            user_upn (str): The User Principal Name (UPN) or user id.
+
+        Returns:
+            dict: A dictionary containing all group names and group ids which user is member of.
+
+        Raises:
+            RuntimeError: If the mirror is stale and fallback is disabled."""
+
+        if self._use_live():
+            return graph_utils.get_user_membership_groups(user_upn, self.access_token)
+
+        group_ids = self._user_group_ids(user_upn)
+        groups = [{"displayName": self.groups[group_id], "id": group_id}
+                  for group_id in group_ids or () if group_id in self.groups]
+
+        if not groups:
+            return {
+                'status_code':404,
+                'message': f'No AAD groups found for user {user_upn}.'
+            }
+
+        return {'status_code': 200,
+                'groups': groups}
+
+    def _use_live(self) -> bool:
+        if not self.is_stale:
+            return False
+        if not self.fallback:
+            raise RuntimeError(f'Directory mirror is stale (last sync {self.staleness} seconds ago).')
+        return True
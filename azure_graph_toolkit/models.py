@@ -0,0 +1,142 @@
+"""
+Result models.
+
+User, Group and OperationResult are dictionaries with the same keys the operations always
+returned, so result['id'], result.get('message'), json.dumps(result) and result == {...} keep
+working, plus attribute access to their fields (user.upn, result.groups). Only the fields that
+were selected are present. The empty __slots__ only keep a second per-object __dict__ away: an
+instance takes as much memory as a plain dict with the same keys, so the models save no memory
+over the dictionaries returned before. Use select to keep fewer fields per object.
+"""
+
+
+def _field(key:str) -> property:
+
+    def getter(self):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def setter(self, value):
+        self[key] = value
+
+    return property(getter, setter)
+
+
+class _Model(dict):
+    """
+    Dictionary whose _fields, (key, attribute, Graph property) triples, can also be read and set as
+    attributes. Selected Graph properties without a field are kept under their Graph name."""
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._by_attribute = {attribute: key for key, attribute, _ in cls._fields}
+        cls._by_property = {graph_property: key for key, _, graph_property in cls._fields if graph_property}
+        for key, attribute, _ in cls._fields:
+            setattr(cls, attribute, _field(key))
+
+    def __init__(self, **values):
+        by_attribute = self._by_attribute
+        super().__init__((by_attribute.get(attribute, attribute), value) for attribute, value in values.items())
+
+    @classmethod
+    def from_graph(cls, data:dict, properties:tuple, **values):
+        """
+        Builds a model from a Graph API object, parsing only the selected properties.
+
+        Args:
+            data (dict): The Graph API object.
+            properties (tuple): The selected Graph property names. Properties missing from data are set to None.
+            **values: Additional attributes, e.g. status_code.
+
+        Returns:
+            The model."""
+
+        model = cls(**values)
+        by_property = cls._by_property
+        for graph_property in properties:
+            model[by_property.get(graph_property, graph_property)] = data.get(graph_property)
+        return model
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict.__repr__(self)})'
+
+
+class User(_Model):
+    """
+    Azure AD user. Keys: status_code (single lookups only), id, upn, job_title, display_name, mail,
+    account_enabled, department, plus any other selected property under its Graph name."""
+
+    __slots__ = ()
+    _fields = (
+        ('status_code', 'status_code', None),
+        ('id', 'id', 'id'),
+        ('upn', 'upn', 'userPrincipalName'),
+        ('job_title', 'job_title', 'jobTitle'),
+        ('display_name', 'display_name', 'displayName'),
+        ('mail', 'mail', 'mail'),
+        ('account_enabled', 'account_enabled', 'accountEnabled'),
+        ('department', 'department', 'department'),
+    )
+
+
+class Group(_Model):
+    """
+    Azure AD group. Keys: displayName, id, description, mail, securityEnabled, mailEnabled, plus any
+    other selected property under its Graph name."""
+
+    __slots__ = ()
+    _fields = (
+        ('displayName', 'display_name', 'displayName'),
+        ('id', 'id', 'id'),
+        ('description', 'description', 'description'),
+        ('mail', 'mail', 'mail'),
+        ('securityEnabled', 'security_enabled', 'securityEnabled'),
+        ('mailEnabled', 'mail_enabled', 'mailEnabled'),
+    )
+
+
+class OperationResult(_Model):
+    """
+    Outcome of an operation. Keys: status_code, and message, group_id, group_name or groups depending on the operation."""
+
+    __slots__ = ()
+    _fields = (
+        ('status_code', 'status_code', None),
+        ('message', 'message', None),
+        ('group_id', 'group_id', None),
+        ('group_name', 'group_name', None),
+        ('groups', 'groups', None),
+    )
+
+
+def select_properties(model, fields, default:tuple) -> tuple:
+    """
+    Returns the Graph properties to $select for a projection.
+
+    Args:
+        model (type): User or Group.
+        fields (list | str): Graph property names or model keys (e.g. 'upn', 'job_title'), or None for the default.
+        default (tuple): The Graph properties selected when fields is None.
+
+    Returns:
+        tuple: The Graph property names, always including id."""
+
+    if fields is None:
+        return default
+    if isinstance(fields, str):
+        fields = fields.split(',')
+
+    by_key = {key: graph_property for key, _, graph_property in model._fields if graph_property}
+    properties = []
+    for field in fields:
+        graph_property = by_key.get(field.strip(), field.strip())
+        if graph_property not in properties:
+            properties.append(graph_property)
+    if 'id' not in properties:
+        properties.append('id')
+    return tuple(properties)
@@ -0,0 +1,492 @@
+"""
+Effective (transitive) group memberships computed locally.
+
+memberOf only returns direct memberships, and transitiveMemberOf costs a request per user.
+NestedGroups loads the group-in-group edges and the direct user memberships once, from
+/groups/delta, and answers effective memberships from memory:
+
+    nested = NestedGroups(client)
+    nested.sync()
+    nested.effective_groups('mario.rossi@domain.com')
+    nested.effective_members(group_id)
+
+The closure of a group (the groups it is nested in, or the groups nested in it) is computed on
+first use, one strongly connected component at a time, so nesting cycles are handled and the
+groups of a cycle share one closure. Closures are memoized and kept up to date incrementally: an
+added edge extends the memoized closures it affects, a removed edge drops them, to be recomputed on
+next use. Later sync() calls apply only the changes since the stored delta link.
+"""
+
+import logging
+import threading
+import requests
+from . import config
+from . import graph_utils
+from . import models
+from .utils.stats import Counters
+
+GROUP_TYPE = '#microsoft.graph.group'
+USER_TYPE = '#microsoft.graph.user'
+
+
+class NestedGroups:
+    """
+    Group nesting graph with memoized transitive closures, and the direct members of every group.
+
+    Groups and users are interned to integer keys. Users are given by id, or by UPN once known
+    (from a DirectoryMirror, or resolved through the Graph API when an access token is set). All
+    methods are thread-safe.
+
+    Args:
+        access_token (str | TokenProvider | GraphClient, optional): The Graph API access token, for sync()
+            and UPN lookups. Defaults to None.
+    """
+
+    def __init__(self, access_token=None):
+        self.access_token = access_token
+        self.stats = Counters('closures_computed', 'closures_extended', 'closures_dropped')
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._group_keys = {}       # group id -> key
+        self._group_ids = []
+        self._group_names = []
+        self._parents = []          # key -> set of keys of the groups it is a direct member of
+        self._children = []         # key -> set of keys of its direct member groups
+        self._group_users = []      # key -> set of user keys of its direct members
+        self._user_keys = {}        # user id -> key
+        self._upn_keys = {}         # lower-case UPN -> key
+        self._user_ids = []
+        self._user_groups = []      # user key -> set of group keys
+        self._up = {}               # key -> frozenset of the key and every group it is nested in
+        self._down = {}             # key -> frozenset of the key and every group nested in it
+        self.delta_link = None
+
+    def __len__(self):
+        return len(self._group_keys)
+
+    # Writes
+
+    def add_group(self, group_id:str, display_name:str = None):
+        """Adds a group, or updates its display name."""
+
+        with self._lock:
+            self._intern_group(group_id, display_name)
+
+    def add_nested_group(self, group_id:str, member_group_id:str):
+        """
+        Records that member_group_id is a direct member of group_id.
+
+        Args:
+            group_id (str): The id of the containing group.
+            member_group_id (str): The id of the nested group."""
+
+        with self._lock:
+            self._add_edge(self._intern_group(member_group_id), self._intern_group(group_id))
+
+    def remove_nested_group(self, group_id:str, member_group_id:str):
+        """Records that member_group_id is no longer a member of group_id. Unknown groups are ignored."""
+
+        with self._lock:
+            child, parent = self._group_keys.get(member_group_id), self._group_keys.get(group_id)
+            if child is not None and parent is not None:
+                self._remove_edge(child, parent)
+
+    def add_user(self, group_id:str, user_id:str, upn:str = None):
+        """
+        Records that the user is a direct member of the group.
+
+        Args:
+            group_id (str): The group id.
+            user_id (str): The user id.
+            upn (str, optional): The user's UPN, to look the user up by UPN."""
+
+        with self._lock:
+            group, user = self._intern_group(group_id), self._intern_user(user_id, upn)
+            self._group_users[group].add(user)
+            self._user_groups[user].add(group)
+
+    def remove_user(self, group_id:str, user_id:str):
+        """Records that the user is no longer a direct member of the group. Unknown users and groups are ignored."""
+
+        with self._lock:
+            group, user = self._group_keys.get(group_id), self._user_keys.get(user_id)
+            if group is not None and user is not None:
+                self._group_users[group].discard(user)
+                self._user_groups[user].discard(group)
+
+    def remove_group(self, group_id:str):
+        """Removes a group with its nesting edges and memberships. Unknown groups are ignored."""
+
+        with self._lock:
+            key = self._group_keys.get(group_id)
+            if key is None:
+                return
+            for parent in list(self._parents[key]):
+                self._remove_edge(key, parent)
+            for child in list(self._children[key]):
+                self._remove_edge(child, key)
+            for user in self._group_users[key]:
+                self._user_groups[user].discard(key)
+            self._group_users[key] = set()
+            self._up.pop(key, None)
+            self._down.pop(key, None)
+            # The key stays allocated, without edges or members.
+            del self._group_keys[group_id]
+
+    # Reads
+
+    def ancestors(self, group_id:str) -> list:
+        """Returns the ids of the groups group_id is nested in, directly or transitively."""
+
+        with self._lock:
+            key = self._group_keys.get(group_id)
+            if key is None:
+                return []
+            return self._to_group_ids(self._closure(key, self._parents, self._up), exclude=key)
+
+    def descendants(self, group_id:str) -> list:
+        """Returns the ids of the groups nested in group_id, directly or transitively."""
+
+        with self._lock:
+            key = self._group_keys.get(group_id)
+            if key is None:
+                return []
+            return self._to_group_ids(self._closure(key, self._children, self._down), exclude=key)
+
+    def effective_groups(self, user:str) -> list:
+        """
+        Returns the ids of the groups the user is a member of, directly or through nested groups.
+
+        Args:
+            user (str): The user id or UPN.
+
+        Returns:
+            list: The group ids, or an empty list if the user is unknown."""
+
+        user_key = self._user_key(user)
+        with self._lock:
+            return self._to_group_ids(self._effective_group_keys(user_key))
+
+    def effective_members(self, group_id:str) -> list:
+        """
+        Returns the ids of the users that are members of the group, directly or through nested groups.
+
+        Args:
+            group_id (str): The group id.
+
+        Returns:
+            list: The user ids, or an empty list if the group is unknown."""
+
+        with self._lock:
+            key = self._group_keys.get(group_id)
+            if key is None:
+                return []
+            users = set()
+            for group in self._closure(key, self._children, self._down):
+                users |= self._group_users[group]
+            user_ids = self._user_ids
+            return [user_ids[user] for user in users]
+
+    def is_effective_member(self, user:str, group_id:str) -> bool:
+        """Checks if the user (id or UPN) is a member of the group, directly or through nested groups."""
+
+        user_key = self._user_key(user)
+        with self._lock:
+            key = self._group_keys.get(group_id)
+            if user_key is None or key is None:
+                return False
+            return any(key in self._closure(group, self._parents, self._up) for group in self._user_groups[user_key])
+
+    def get_user_membership_groups(self, user:str) -> dict:
+        """
+        Lists the effective groups of a user in the format of graph_utils.get_user_membership_groups.
+
+        Args:
+            user (str): The user id or UPN.
+
+        Returns:
+            dict: A dictionary containing the names and ids of the groups the user is a member of, including nested ones."""
+
+        user_key = self._user_key(user)
+        with self._lock:
+            # Names are read with the keys: a concurrent sync() may remove the groups afterwards.
+            names, group_ids = self._group_names, self._group_ids
+            groups = [models.Group(display_name=names[key], id=group_ids[key]) for key in self._effective_group_keys(user_key)]
+
+        if not groups:
+            return models.OperationResult(
+                status_code=404,
+                message=f'No AAD groups found for user {user}.'
+            )
+        return models.OperationResult(status_code=200, groups=groups)
+
+    def is_user_member_of(self, user:str, group_name:str) -> bool:
+        """
+        Check if user is member of specific AAD group, directly or through nested groups. Same semantics as graph_utils.is_user_member_of.
+
+        Args:
+            user (str): The user id or UPN.
+            group_name (str): The group name to search. This could be substring of the group name.
+
+        Returns:
+            bool: A boolean value."""
+
+        user_key = self._user_key(user)
+        with self._lock:
+            names = self._group_names
+            return any(group_name in names[key] for key in self._effective_group_keys(user_key))
+
+    # Loading
+
+    def sync(self) -> dict:
+        """
+        Loads the groups, nesting edges and direct user memberships from /groups/delta on the first call,
+        and applies only the changes since the last call afterwards.
+
+        Returns:
+            dict: A dictionary containing the number of group changes applied.
+
+        Raises:
+            ValueError: If no access token was given.
+            requests.exceptions.HTTPError: If a delta request fails."""
+
+        if self.access_token is None:
+            raise ValueError('sync() requires an access token.')
+        try:
+            return {'groups': self._sync()}
+        except requests.exceptions.HTTPError as http_err:
+            # 410 Gone: the delta link expired and a full resync is required.
+            if http_err.response is None or http_err.response.status_code != 410:
+                raise
+            logging.warning('Delta link expired, reloading the nested groups.')
+            with self._lock:
+                self._reset()
+            return {'groups': self._sync()}
+
+    def _sync(self) -> int:
+        if self.delta_link is not None:
+            url, params = self.delta_link, None
+        else:
+            url, params = f'{config.GRAPH_BASE_URL_GROUP}/delta', {'$select': 'id,displayName,members'}
+
+        count = 0
+        for page in graph_utils.iter_pages(url, self.access_token, params):
+            for group in page.get('value', []):
+                self.apply_group_delta(group)
+                count = count + 1
+            if '@odata.deltaLink' in page:
+                self.delta_link = page['@odata.deltaLink']
+        return count
+
+    def apply_group_delta(self, group:dict):
+        """
+        Applies one group object of a /groups/delta response: its removal, display name and members@delta changes.
+
+        Args:
+            group (dict): The group object."""
+
+        group_id = group['id']
+        if '@removed' in group:
+            self.remove_group(group_id)
+            return
+
+        self.add_group(group_id, group.get('displayName'))
+        for member in group.get('members@delta', []):
+            member_type = member.get('@odata.type')
+            removed = '@removed' in member
+            if member_type == GROUP_TYPE:
+                if removed:
+                    self.remove_nested_group(group_id, member['id'])
+                else:
+                    self.add_nested_group(group_id, member['id'])
+            elif member_type in (USER_TYPE, None):
+                if removed:
+                    self.remove_user(group_id, member['id'])
+                else:
+                    self.add_user(group_id, member['id'], member.get('userPrincipalName'))
+
+    @classmethod
+    def from_mirror(cls, mirror, access_token=None) -> 'NestedGroups':
+        """
+        Builds the engine from a synced DirectoryMirror. Members of a group that are groups of the mirror become nesting edges.
+
+        Args:
+            mirror (DirectoryMirror): The mirror to copy.
+            access_token (str | TokenProvider | GraphClient, optional): Defaults to the mirror's access token.
+
+        Returns:
+            NestedGroups: The engine."""
+
+        nested = cls(access_token or mirror.access_token)
+        with mirror._lock:
+            for group_id, display_name in mirror.groups.items():
+                nested.add_group(group_id, display_name)
+            for member_id, group_ids in mirror.user_groups.items():
+                for group_id in group_ids:
+                    if member_id in mirror.groups:
+                        nested.add_nested_group(group_id, member_id)
+                    else:
+                        nested.add_user(group_id, member_id, mirror.users.get(member_id))
+        return nested
+
+    def snapshot(self) -> dict:
+        """
+        Returns the size of the graph and the closure counters.
+
+        Returns:
+            dict: groups, nesting edges, users, memoized closures and the closures computed, extended and dropped."""
+
+        with self._lock:
+            snapshot = self.stats.snapshot()
+            snapshot['groups'] = len(self._group_keys)
+            snapshot['edges'] = sum(len(parents) for parents in self._parents)
+            snapshot['users'] = len(self._user_keys)
+            snapshot['memoized'] = len(self._up) + len(self._down)
+            return snapshot
+
+    # Internals
+
+    def _intern_group(self, group_id:str, display_name:str = None) -> int:
+        # Caller must hold self._lock.
+        key = self._group_keys.get(group_id)
+        if key is None:
+            key = self._group_keys[group_id] = len(self._group_ids)
+            self._group_ids.append(group_id)
+            self._group_names.append('')
+            self._parents.append(set())
+            self._children.append(set())
+            self._group_users.append(set())
+        if display_name:
+            self._group_names[key] = display_name
+        return key
+
+    def _intern_user(self, user_id:str, upn:str = None) -> int:
+        # Caller must hold self._lock.
+        key = self._user_keys.get(user_id)
+        if key is None:
+            key = self._user_keys[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._user_groups.append(set())
+        if upn:
+            self._upn_keys[upn.lower()] = key
+        return key
+
+    def _user_key(self, user:str) -> int:
+        key = self._user_keys.get(user)
+        if key is None:
+            key = self._upn_keys.get(user.lower())
+        if key is None and '@' in user and self.access_token is not None:
+            # Unknown UPN: look its id up once and remember it.
+            result = graph_utils.get_user_from_upn(user, self.access_token, select=['id'])
+            with self._lock:
+                key = self._user_keys.get(result.get('id'))
+                if key is not None:
+                    self._upn_keys[user.lower()] = key
+        return key
+
+    def _effective_group_keys(self, user_key:int) -> set:
+        # Caller must hold self._lock.
+        groups = set()
+        if user_key is None or user_key >= len(self._user_groups):
+            # Unknown, or resolved before a reload emptied the graph.
+            return groups
+        for group in self._user_groups[user_key]:
+            if group not in groups:
+                groups |= self._closure(group, self._parents, self._up)
+        return groups
+
+    def _to_group_ids(self, keys, exclude:int = None) -> list:
+        group_ids = self._group_ids
+        return [group_ids[key] for key in keys if key != exclude]
+
+    def _closure(self, start:int, edges:list, memo:dict) -> frozenset:
+        # Caller must hold self._lock. Returns start and every group reachable from it through edges
+        # (parents or children), memoizing the closure of every group visited. Iterative Tarjan: the
+        # components are completed successors first, so their closures are unions of memoized ones.
+        closure = memo.get(start)
+        if closure is not None:
+            return closure
+
+        index = {start: 0}
+        low = {start: 0}
+        stack = [start]
+        on_stack = {start}
+        work = [(start, iter(edges[start]))]
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor in memo:
+                    continue
+                if successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(edges[successor])))
+                    break
+                if successor in on_stack:
+                    low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    low[caller] = min(low[caller], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    closure = set(component)
+                    for member in component:
+                        for successor in edges[member]:
+                            if successor not in closure:
+                                closure |= memo[successor]
+                    closure = frozenset(closure)
+                    for member in component:
+                        memo[member] = closure
+                    self.stats.add('closures_computed', len(component))
+        return memo[start]
+
+    def _add_edge(self, child:int, parent:int):
+        # Caller must hold self._lock. A group that reaches child now also reaches everything parent
+        # reaches, and a group that reaches parent downwards everything child reaches, so the
+        # affected memoized closures are extended instead of recomputed.
+        if parent in self._parents[child]:
+            return
+
+        updates = []
+        for memo, edges, through, source in ((self._up, self._parents, child, parent), (self._down, self._children, parent, child)):
+            if any(through in closure for closure in memo.values()):
+                # Computed before the edge exists, and before listing the affected closures, since it may memoize more of them.
+                added = self._closure(source, edges, memo)
+                updates.append((memo, [key for key, closure in memo.items() if through in closure], added))
+
+        self._parents[child].add(parent)
+        self._children[parent].add(child)
+        for memo, affected, added in updates:
+            extended = {}
+            for key in affected:
+                closure = memo[key]
+                # Groups sharing a closure keep sharing the extended one.
+                if id(closure) not in extended:
+                    extended[id(closure)] = (closure, closure | added)
+                memo[key] = extended[id(closure)][1]
+            self.stats.add('closures_extended', len(affected))
+
+    def _remove_edge(self, child:int, parent:int):
+        # Caller must hold self._lock. Only closures through the edge can shrink: drop them.
+        if parent not in self._parents[child]:
+            return
+
+        self._parents[child].discard(parent)
+        self._children[parent].discard(child)
+        dropped = 0
+        for memo, through in ((self._up, child), (self._down, parent)):
+            for key in [key for key, closure in memo.items() if through in closure]:
+                del memo[key]
+                dropped = dropped + 1
+        self.stats.add('closures_dropped', dropped)
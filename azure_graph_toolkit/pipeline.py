@@ -0,0 +1,268 @@
+"""
+Streaming bulk account actions (disable, enable, revoke sessions, reset password) with checkpoint/resume.
+
+UPNs are streamed from a CSV, JSONL or plain text file, processed by a bounded pool of workers
+sharing one pooled GraphClient, and every finished user is appended to a JSONL journal. Running
+the same input with the same journal again skips the users already journaled, so a crashed job
+resumes where it stopped:
+
+    python -m azure_graph_toolkit.pipeline leavers.csv --actions disable,revoke_sessions --journal leavers.journal.jsonl
+
+Memory stays constant for any input size: at most max_workers * 2 users are in flight, and
+resuming keeps only a watermark plus the journaled positions above it.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from . import graph_client
+from . import graph_utils
+from .graph_auth import TokenProvider
+from .utils import scheduling
+
+DEFAULT_MAX_WORKERS = 8
+
+ACTIONS = ('disable', 'enable', 'revoke_sessions', 'reset_password')
+
+_UPN_FIELDS = ('upn', 'userPrincipalName', 'user_principal_name', 'user')
+
+
+def _row_upn(row) -> str:
+    if isinstance(row, str):
+        return row.strip()
+    for field in _UPN_FIELDS:
+        if row.get(field):
+            return row[field].strip()
+    return None
+
+
+def read_rows(source):
+    """
+    Streams input rows from a file or an iterable.
+
+    Files ending in .csv are read as CSV with a header row, .jsonl/.ndjson/.json as one JSON object
+    (or string) per line, anything else as one UPN per line. Blank lines are skipped.
+
+    Args:
+        source (str | iterable): The input file path, or an iterable of UPNs or row dictionaries.
+
+    Yields:
+        tuple: The input position (starting at 0) and the row, a UPN string or a dictionary."""
+
+    if not isinstance(source, str):
+        yield from enumerate(source)
+        return
+
+    extension = os.path.splitext(source)[1].lower()
+    with open(source, newline='', encoding='utf-8') as file:
+        if extension == '.csv':
+            rows = csv.DictReader(file)
+        elif extension in ('.jsonl', '.ndjson', '.json'):
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = (line.strip() for line in file if line.strip())
+        yield from enumerate(rows)
+
+
+class Journal:
+    """
+    Append-only JSONL record of processed input rows.
+
+    Each line holds the input position ('seq'), the UPN, whether every action succeeded ('ok') and
+    the result of each action. Passwords are never written.
+
+    Args:
+        path (str): The journal file path. Created if missing.
+        fsync (bool, optional): If True, every line is flushed to disk before the user counts as done. Defaults to False.
+    """
+
+    def __init__(self, path:str, fsync:bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.watermark, self._done_above = self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self) -> tuple:
+        # Positions below the watermark are all done; gaps above it are at most the in-flight window wide.
+        watermark = 0
+        done_above = set()
+        if not os.path.exists(self.path):
+            return watermark, done_above
+
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    seq = json.loads(line)['seq']
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by a crash.
+                    continue
+                if seq >= watermark:
+                    done_above.add(seq)
+                while watermark in done_above:
+                    done_above.discard(watermark)
+                    watermark = watermark + 1
+        return watermark, done_above
+
+    def is_done(self, seq:int) -> bool:
+        return seq < self.watermark or seq in self._done_above
+
+    def write(self, entry:dict):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _run_actions(client, seq:int, row, actions:list, force_change_password_next_signin:bool, priority:str) -> dict:
+    upn = _row_upn(row)
+    results = {}
+
+    with scheduling.priority(priority):
+        for action in actions:
+            if not upn:
+                results[action] = {'status_code': 400, 'message': f'No UPN in input row {seq}.'}
+            elif action == 'disable':
+                results[action] = graph_utils.user_set_account_status(upn, False, client)
+            elif action == 'enable':
+                results[action] = graph_utils.user_set_account_status(upn, True, client)
+            elif action == 'revoke_sessions':
+                results[action] = graph_utils.user_revoke_sessions(upn, client)
+            elif action == 'reset_password':
+                password = row.get('password') if isinstance(row, dict) else None
+                if not password:
+                    results[action] = {'status_code': 400, 'message': f'No password given for user {upn}.'}
+                else:
+                    results[action] = graph_utils.user_reset_password(upn, password, client, force_change_password_next_signin)
+
+    return {
+        'seq': seq,
+        'upn': upn,
+        'ok': all(result.get('status_code') is not None and result['status_code'] < 400 for result in results.values()),
+        'results': results,
+        'finished_at': time.time()
+    }
+
+
+def run_account_actions(source, actions:list, access_token, journal_path:str, max_workers:int = DEFAULT_MAX_WORKERS,
+                        force_change_password_next_signin:bool = False, fsync:bool = False, progress=None,
+                        priority:str = scheduling.BULK) -> dict:
+    """
+    Runs account actions for every user of the input with bounded parallelism, journaling each finished user.
+
+    The actions of one user run in the given order. Users already in the journal are skipped, so
+    calling this again with the same input and journal after a crash resumes the job. If an
+    action raises (e.g. the network is down after all retries), no new users are started, the
+    users in flight are finished and journaled, and the exception is raised.
+
+    Args:
+        source (str | iterable): The input file (CSV, JSONL or one UPN per line) or an iterable of UPNs or row dictionaries.
+            Rows are matched to the journal by position, so the input must not change between runs.
+        actions (list): Actions to run, among 'disable', 'enable', 'revoke_sessions' and 'reset_password'.
+            reset_password takes the new password from the row's 'password' field.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        journal_path (str): The JSONL journal file, created or appended to.
+        max_workers (int, optional): Number of users processed concurrently. Defaults to 8.
+        force_change_password_next_signin (bool, optional): Passed on to user_reset_password. Defaults to False.
+        fsync (bool, optional): If True, journal lines are synced to disk one by one. Defaults to False.
+        progress (callable, optional): Called with each journal entry once it is written.
+        priority (str, optional): Scheduling priority of the requests, see utils.scheduling. Defaults to BULK, so a
+            large job doesn't delay incident actions; pass CRITICAL for an incident response job.
+
+    Returns:
+        dict: A dictionary with the number of users processed, skipped (already journaled), succeeded and failed.
+
+    Raises:
+        ValueError: If an action or the priority is unknown."""
+
+    actions = list(actions)
+    unknown = [action for action in actions if action not in ACTIONS]
+    if unknown or not actions:
+        raise ValueError(f'Unknown or missing actions {unknown}. Valid actions are {", ".join(ACTIONS)}.')
+    if priority not in scheduling.PRIORITIES:
+        raise ValueError(f'Unknown priority {priority}. Use one of {", ".join(scheduling.PRIORITIES)}.')
+
+    client = graph_client.get_client(access_token)
+    journal = Journal(journal_path, fsync)
+    summary = {'processed': 0, 'skipped': 0, 'succeeded': 0, 'failed': 0}
+    window = max_workers * 2
+    error = None
+
+    def finish(futures):
+        nonlocal error
+        for future in futures:
+            try:
+                entry = future.result()
+            except Exception as err:
+                error = error or err
+                continue
+            journal.write(entry)
+            summary['processed'] = summary['processed'] + 1
+            summary['succeeded' if entry['ok'] else 'failed'] += 1
+            if progress is not None:
+                progress(entry)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='graph-pipeline') as executor:
+            in_flight = set()
+            try:
+                for seq, row in read_rows(source):
+                    if journal.is_done(seq):
+                        summary['skipped'] = summary['skipped'] + 1
+                        continue
+
+                    in_flight.add(executor.submit(_run_actions, client, seq, row, actions, force_change_password_next_signin,
+                                                  priority))
+                    if len(in_flight) >= window:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        finish(done)
+                    if error is not None:
+                        break
+            finally:
+                # Journal the users already in flight, also when reading the input fails.
+                finish(wait(in_flight).done)
+    finally:
+        journal.close()
+
+    if error is not None:
+        raise error
+
+    return summary
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description='Run account actions for many users, resumable through a journal.')
+    parser.add_argument('input', help='CSV (with a upn column), JSONL, or text file with one UPN per line.')
+    parser.add_argument('--actions', required=True, help=f'Comma separated actions: {", ".join(ACTIONS)}.')
+    parser.add_argument('--journal', required=True, help='JSONL journal; rerun with the same journal to resume.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument('--force-change-password', action='store_true')
+    parser.add_argument('--fsync', action='store_true', help='Sync every journal line to disk.')
+    parser.add_argument('--priority', choices=scheduling.PRIORITIES, default=scheduling.BULK)
+    parser.add_argument('--tenant-id', default=os.environ.get('AZURE_TENANT_ID'))
+    parser.add_argument('--client-id', default=os.environ.get('AZURE_CLIENT_ID'))
+    parser.add_argument('--client-secret', default=os.environ.get('AZURE_CLIENT_SECRET'))
+    args = parser.parse_args(argv)
+
+    if not (args.tenant_id and args.client_id and args.client_secret):
+        parser.error('Credentials are required: --tenant-id/--client-id/--client-secret or AZURE_TENANT_ID/AZURE_CLIENT_ID/AZURE_CLIENT_SECRET.')
+
+    def progress(entry):
+        if not entry['ok']:
+            logging.error('%s: %s', entry['upn'], json.dumps(entry['results']))
+
+    with graph_client.GraphClient(TokenProvider(args.tenant_id, args.client_id, args.client_secret)) as client:
+        summary = run_account_actions(args.input, args.actions.split(','), client, args.journal, args.workers,
+                                      args.force_change_password, args.fsync, progress, args.priority)
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,123 @@
+from . import bulk
+from . import graph_client
+from . import graph_utils
+from .utils import decorators
+from .utils import scheduling
+
+
+@decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.BULK)
+def plan_group_membership(group_name:str, desired_users, access_token, group_id:str = None) -> dict:
+    """
+    Computes the adds and removes that make the direct user members of a group equal to the desired users.
+
+    The current members are read page by page (999 per request) with their UPNs, so desired users
+    that already are members are matched locally; only the users to add are resolved, in $batch
+    requests of 20.
+
+    Args:
+        group_name (str): The group to find. This could be a substring of the group name. Ignored if group_id is given.
+        desired_users (iterable): User Principal Names (UPN) or user ids that should be the group's user members.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        group_id (str, optional): The group id, to skip the group lookup.
+
+    Returns:
+        dict: A dictionary containing the status code, the group id and name, the users to add and the
+            members to remove (each mapped to its user id), the number of unchanged members and the
+            desired users that could not be resolved, mapped to their error.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to resolve the group or to list its members fails."""
+
+    client = graph_client.get_client(access_token)
+
+    group = bulk._resolve_group(group_name, group_id, client)
+    if group.get('status_code') != 200 or 'group_id' not in group:
+        return group
+    group_id, group_name = group['group_id'], group['group_name']
+
+    desired = list(dict.fromkeys(desired_users))
+    desired_ids = {user for user in desired if bulk.is_object_id(user)}
+    desired_upns = {user.lower(): user for user in desired if not bulk.is_object_id(user)}
+
+    to_remove = {}
+    unchanged = 0
+    matched = set()
+    for member in graph_utils.iter_group_members(group_id, client):
+        upn = (member.get('upn') or '').lower()
+        if member['id'] in desired_ids:
+            matched.add(member['id'])
+        elif upn in desired_upns:
+            matched.add(desired_upns[upn])
+        else:
+            to_remove[member.get('upn') or member['id']] = member['id']
+            continue
+        unchanged = unchanged + 1
+
+    missing = [user for user in desired if user not in matched]
+    to_add, unresolved = bulk.resolve_user_ids(missing, client)
+
+    # A desired UPN that resolves to a member listed under another UPN (e.g. renamed mid-run) is not re-added.
+    member_ids = set(to_remove.values())
+    for user, user_id in list(to_add.items()):
+        if user_id in member_ids:
+            del to_add[user]
+            to_remove = {member: member_id for member, member_id in to_remove.items() if member_id != user_id}
+            unchanged = unchanged + 1
+
+    return {
+        'status_code': 200,
+        'group_id': group_id,
+        'group_name': group_name,
+        'to_add': to_add,
+        'to_remove': to_remove,
+        'unchanged': unchanged,
+        'unresolved': unresolved
+    }
+
+
+@decorators.handle_http_exceptions
+@scheduling.default_priority(scheduling.BULK)
+def reconcile_group_membership(group_name:str, desired_users, access_token, group_id:str = None,
+                               dry_run:bool = False, remove_extra_members:bool = True) -> dict:
+    """
+    Makes the direct user members of a group equal to the desired users with the fewest writes.
+
+    Computes the plan with plan_group_membership, then adds the missing users with members@odata.bind
+    (20 per request) and removes the extra members through $batch (20 per request). Nothing is written
+    for users whose membership is already right. Group members that are not users (e.g. nested groups)
+    are left alone.
+
+    Args:
+        group_name (str): The group to find. This could be a substring of the group name. Ignored if group_id is given.
+        desired_users (iterable): User Principal Names (UPN) or user ids that should be the group's user members.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        group_id (str, optional): The group id, to skip the group lookup.
+        dry_run (bool, optional): If True, only the plan is returned and nothing is written. Defaults to False.
+        remove_extra_members (bool, optional): If False, members that are not desired are kept. Defaults to True.
+
+    Returns:
+        dict: The plan (see plan_group_membership) with, unless dry_run is set, a results dictionary
+            mapping each added or removed user to a dictionary containing its status code and message.
+
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request to resolve the group or to list its members fails."""
+
+    client = graph_client.get_client(access_token)
+
+    plan = plan_group_membership(group_name, desired_users, client, group_id)
+    if plan.get('status_code') != 200 or 'group_id' not in plan:
+        return plan
+    if not remove_extra_members:
+        plan['to_remove'] = {}
+    if dry_run:
+        return plan
+
+    results = bulk._add_members(plan['group_id'], plan['group_name'], plan['to_add'], client)
+    results.update(bulk._remove_members(plan['group_id'], plan['group_name'], plan['to_remove'], client))
+
+    if client.resolution_cache is not None:
+        client.resolution_cache.invalidate_users(list(plan['to_add'].values()) + list(plan['to_remove'].values()))
+
+    plan['results'] = results
+    return plan
@@ -0,0 +1,380 @@
+"""
+Record and replay of Graph API traffic.
+
+RecordingTransport wraps the transport of a GraphClient and appends every request/response pair
+and its timing to a JSON Lines file, with secrets and tokens redacted. ReplayTransport serves the
+recorded responses back, at the original speed or scaled, so a production run can be reproduced
+without touching the tenant:
+
+    client = GraphClient(token, transport=RecordingTransport('run.jsonl'))
+    graph_utils.add_user_to_group('mario.rossi@domain.com', 'block-usb-group', client)
+
+    client = GraphClient('replay', transport=ReplayTransport('run.jsonl'))
+    graph_utils.add_user_to_group('mario.rossi@domain.com', 'block-usb-group', client)
+
+generate_load replays the recorded call mix at several times its original concurrency through the
+whole client stack, to find the toolkit's throughput ceiling:
+
+    python -m azure_graph_toolkit.recording run.jsonl --multipliers 1 2 4 8 16
+"""
+
+import argparse
+import collections
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import requests
+from . import graph_client
+from . import transport as graph_transport
+from .utils import coalescing, metrics, scheduling, throttling
+from .utils.stats import Counters
+
+REDACTED = '***'
+
+# Keys whose string values are never written to a recording.
+SECRET_KEYS = re.compile(r'password|secret|access_token|refresh_token|id_token|assertion|authorization|^code$', re.IGNORECASE)
+
+# Response headers kept in a recording.
+RECORDED_HEADERS = ('Content-Type', 'Retry-After', 'Location')
+
+DEFAULT_MULTIPLIERS = (1, 2, 4, 8, 16)
+
+
+def redact(value):
+    """
+    Replaces the string values of secret keys (passwords, client secrets, tokens) with '***'.
+
+    Args:
+        value: A decoded JSON value or form dictionary.
+
+    Returns:
+        A redacted copy of value."""
+
+    if isinstance(value, dict):
+        return {key: REDACTED if isinstance(item, str) and SECRET_KEYS.search(str(key)) else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _redact_url(url:str) -> str:
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(key, REDACTED if SECRET_KEYS.search(key) else item) for key, item in parse_qsl(parts.query, keep_blank_values=True)]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def _decode(content:bytes):
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', 'replace')
+
+
+def _open(path:str, mode:str):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_records(path:str) -> list:
+    """
+    Reads a recording.
+
+    Args:
+        path (str): The recording file. Files ending in .gz are read as gzip.
+
+    Returns:
+        list: The records in file order. Each one is a dictionary with ts (wall-clock start time),
+            s (session), l (lane: the thread that sent it), op (the operation, when metrics are
+            enabled), m (method), u (URL), b (request body), st (status), h (response headers),
+            r (response body) and d (duration in seconds)."""
+
+    with _open(path, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+_ORIGIN = re.compile(r'^https?://[^/]+')
+
+
+def _without_origins(value):
+    # Drops scheme and host from URLs in a body, e.g. the @odata.id of members/$ref.
+    if isinstance(value, dict):
+        return {key: _without_origins(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_without_origins(item) for item in value]
+    if isinstance(value, str):
+        return _ORIGIN.sub('', value)
+    return value
+
+
+def _body_digest(body) -> str:
+    # Digest of the redacted body: a replayed password reset matches whatever the new password is.
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    encoded = json.dumps(_without_origins(redact(body)), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def _request_key(method:str, url:str, body=None) -> tuple:
+    # Host independent, so a recording made against a tenant can be replayed against any base URL.
+    # Requests with a body (POST $batch, checkMemberGroups, PATCH) are told apart by its digest.
+    parts = urlsplit(url)
+    return method, parts.path, tuple(sorted(parse_qsl(parts.query, keep_blank_values=True))), _body_digest(body)
+
+
+class RecordingTransport:
+    """
+    Sends requests through another transport and appends each request/response pair to a recording.
+
+    Every request is written as one compact JSON line as soon as its response arrives, so an
+    interrupted run keeps what it recorded, and several runs can be appended to the same file.
+    Request headers aren't recorded, and string values under secret keys (passwords, client
+    secrets, tokens) in request bodies, response bodies and query strings are redacted. The calling
+    operation is recorded too when metrics are enabled (see metrics.enable).
+
+    Args:
+        path (str): The recording file, appended to. Files ending in .gz are gzip compressed.
+        transport (RequestsTransport | HTTP2Transport, optional): Sends the requests. Defaults to a
+            RequestsTransport over a new pooled session, closed with this transport.
+    """
+
+    def __init__(self, path:str, transport=None):
+        self.path = path
+        self._owns_transport = transport is None
+        self.transport = transport or graph_transport.RequestsTransport(graph_client.create_session())
+        self.session_id = uuid.uuid4().hex[:8]
+        self.stats = Counters('recorded')
+
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._file = _open(path, 'a')
+
+    def request(self, method:str, url:str, headers:dict = None, **kwargs) -> requests.Response:
+        lane = self._lane()
+        started = time.time()
+        clock = time.monotonic()
+        response = self.transport.request(method, url, headers=headers, **kwargs)
+        duration = time.monotonic() - clock
+
+        body = kwargs.get('json', kwargs.get('data'))
+        record = {
+            'ts': round(started, 6),
+            's': self.session_id,
+            'l': lane,
+            'op': metrics.current_operation() or None,
+            'm': method,
+            'u': _redact_url(requests.Request(method, url, params=kwargs.get('params')).prepare().url),
+            'b': redact(body) if body is not None else None,
+            'st': response.status_code,
+            'h': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'r': redact(_decode(response.content)),
+            'd': round(duration, 6)
+        }
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+        self.stats.add('recorded')
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self._owns_transport:
+            self.transport.close()
+
+    def _lane(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            lane = self._lanes.get(ident)
+            if lane is None:
+                lane = self._lanes[ident] = len(self._lanes)
+            return lane
+
+
+class ReplayTransport:
+    """
+    Answers requests with the responses of a recording instead of sending them.
+
+    A request is matched on its method, path, query string and redacted body, whatever the host,
+    so every $batch or checkMemberGroups call gets the response recorded for its body. Requests matching
+    several records get their responses in recorded order, starting over once all were served, so
+    a throttled call followed by its successful retry replays the same way. The response is
+    returned after the recorded duration divided by speed. Requests without a record get a 404
+    Graph API error.
+
+    Args:
+        records (str | list): A recording file, or records from read_records.
+        speed (float, optional): Replay speed: 1 for the original timing, 2 for twice as fast.
+            None answers immediately. Defaults to 1.
+    """
+
+    def __init__(self, records, speed:float = 1.0):
+        if isinstance(records, str):
+            records = read_records(records)
+        if speed is not None and speed <= 0:
+            raise ValueError(f'speed must be positive or None, got {speed}.')
+
+        self.speed = speed
+        self.stats = Counters('served', 'unmatched')
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(list)
+        self._next = collections.Counter()
+        for record in records:
+            self._responses[_request_key(record['m'], record['u'], record.get('b'))].append(record)
+
+    def request(self, method:str, url:str, headers:dict = None, params=None, **kwargs) -> requests.Response:
+        url = requests.Request(method, url, params=params).prepare().url
+        key = _request_key(method, url, kwargs.get('json', kwargs.get('data')))
+        with self._lock:
+            recorded = self._responses.get(key)
+            if recorded:
+                record = recorded[self._next[key] % len(recorded)]
+                self._next[key] += 1
+
+        if not recorded:
+            self.stats.add('unmatched')
+            return self._response(url, 404, {}, {'error': {'code': 'notRecorded', 'message': f'No recorded response for {method} {url}.'}})
+
+        if self.speed is not None and record['d']:
+            time.sleep(record['d'] / self.speed)
+        self.stats.add('served')
+        return self._response(url, record['st'], record['h'], record['r'])
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _response(url:str, status:int, headers:dict, body) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        response.headers.update(headers)
+        if isinstance(body, str):
+            response._content = body.encode()
+        else:
+            response._content = json.dumps(body).encode() if body is not None else b''
+        return response
+
+
+def _lanes(records:list) -> list:
+    # The requests of each recorded thread, in the order it sent them.
+    lanes = collections.OrderedDict()
+    for record in sorted(records, key=lambda record: record['ts']):
+        lanes.setdefault((record['s'], record['l']), []).append(record)
+    return list(lanes.values())
+
+
+def _percentile(ordered:list, percentile:float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def generate_load(records, multipliers=DEFAULT_MULTIPLIERS, speed:float = 1.0, client_options:dict = None) -> dict:
+    """
+    Replays the recorded call mix at several times its original concurrency and measures the throughput.
+
+    Each recorded thread is a lane whose requests are sent back to back, in order, through a
+    GraphClient (retries, scheduler, rate limiter) over a ReplayTransport. A run at multiplier N
+    replays N copies of every lane at once. The throughput ceiling is reached when raising the
+    concurrency no longer raises the requests per second. Request coalescing is disabled, so the
+    copies don't merge into one call.
+
+    Args:
+        records (str | list): A recording file, or records from read_records.
+        multipliers (tuple, optional): Concurrency multipliers to run. Defaults to (1, 2, 4, 8, 16).
+        speed (float, optional): Replay speed of the recorded response times, None for instant responses. Defaults to 1.
+        client_options (dict, optional): Extra GraphClient arguments, e.g. a hedging policy.
+
+    Returns:
+        dict: runs, one dictionary per multiplier with multiplier, concurrency, requests, errors
+            (unmatched requests and exceptions), seconds, requests_per_second and p50/p99 latency
+            in seconds; ceiling, the run with the highest throughput; and mix, the number of
+            recorded requests per operation (or endpoint, for requests recorded without metrics)."""
+
+    if isinstance(records, str):
+        records = read_records(records)
+    lanes = _lanes(records)
+    mix = collections.Counter(record.get('op') or f"{record['m']} {metrics.endpoint_template(record['u'])}" for record in records)
+
+    runs = []
+    for multiplier in multipliers:
+        transport = ReplayTransport(records, speed)
+        options = dict(client_options or {})
+        options.setdefault('coalescer', coalescing.RequestCoalescer(enabled=False))
+        options.setdefault('rate_limiter', throttling.AdaptiveRateLimiter())
+        options.setdefault('retry_policy', throttling.RetryPolicy())
+        options.setdefault('scheduler', scheduling.PriorityScheduler())
+        client = graph_client.GraphClient('replay-token', transport=transport, **options)
+
+        latencies = []
+        failures = Counters('errors')
+
+        def replay(lane:list):
+            for record in lane:
+                started = time.monotonic()
+                try:
+                    client.request(record['m'], record['u'], json=record['b'])
+                except Exception:
+                    failures.add('errors')
+                latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        copies = [lane for lane in lanes for _ in range(multiplier)]
+        with ThreadPoolExecutor(max_workers=max(1, len(copies)), thread_name_prefix='graph-load') as executor:
+            list(executor.map(replay, copies))
+        seconds = time.monotonic() - started
+        client.close()
+
+        latencies.sort()
+        runs.append({
+            'multiplier': multiplier,
+            'concurrency': len(copies),
+            'requests': len(latencies),
+            'errors': failures.snapshot()['errors'] + transport.stats.snapshot()['unmatched'],
+            'seconds': seconds,
+            'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+            'p50': _percentile(latencies, 50),
+            'p99': _percentile(latencies, 99)
+        })
+
+    return {
+        'runs': runs,
+        'ceiling': max(runs, key=lambda run: run['requests_per_second']) if runs else None,
+        'mix': dict(mix)
+    }
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description='Replay a Graph API recording at increasing concurrency to find the throughput ceiling.')
+    parser.add_argument('recording')
+    parser.add_argument('--multipliers', type=int, nargs='+', default=list(DEFAULT_MULTIPLIERS))
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed of the recorded response times, 0 for instant responses.')
+    args = parser.parse_args(argv)
+
+    report = generate_load(args.recording, args.multipliers, args.speed or None)
+    print(f'{"multiplier":>10}{"concurrency":>12}{"req/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for run in report['runs']:
+        print(f'{run["multiplier"]:>10}{run["concurrency"]:>12}{run["requests_per_second"]:>10.0f}'
+              f'{run["p50"] * 1000:>9.1f}{run["p99"] * 1000:>9.1f}{run["errors"]:>8}')
+    if report['ceiling'] is not None:
+        print(f'Throughput ceiling: {report["ceiling"]["requests_per_second"]:.0f} req/s '
+              f'at {report["ceiling"]["concurrency"]} concurrent lanes.')
+
+
+if __name__ == '__main__':
+    main()
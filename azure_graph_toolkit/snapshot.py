@@ -0,0 +1,493 @@
+"""
+Columnar, memory-mapped snapshots of a tenant's directory.
+
+export_snapshot() streams the users, the groups and their user memberships from the Graph API into
+one file of fixed-width columns: every string property is an offsets array plus a UTF-8 blob,
+every boolean a bitmap, and the memberships are stored twice, by group and by user, as sorted
+key arrays. TenantSnapshot maps the file into memory without parsing it, so loading takes
+milliseconds whatever the tenant size, and queries run over whole columns:
+
+    export_snapshot('tenant.snap', client)
+    with TenantSnapshot.load('tenant.snap') as snapshot:
+        snapshot.disabled_privileged_members()
+"""
+
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from . import config
+from . import graph_utils
+from . import models
+
+_MAGIC = b'AGTSNAP1'
+_HEADER = struct.Struct('<8sIIQdI')     # magic, users, groups, memberships, export time, sections
+_SECTION = struct.Struct('<48sQQ')      # name, offset, length
+_ALIGNMENT = 8
+
+USER_STRING_COLUMNS = ('id', 'userPrincipalName', 'displayName', 'department', 'jobTitle')
+USER_FLAG_COLUMNS = ('accountEnabled',)
+GROUP_STRING_COLUMNS = ('id', 'displayName')
+GROUP_FLAG_COLUMNS = ('securityEnabled', 'isAssignableToRole')
+
+USER_TYPE = '#microsoft.graph.user'
+
+# Set bit positions of every byte value.
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def _set_bits(bits:int) -> list:
+    keys = []
+    for byte_index, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        if byte:
+            base = byte_index << 3
+            keys.extend(base + bit for bit in _BYTE_BITS[byte])
+    return keys
+
+
+def _little_endian(values:array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _StringColumn:
+    # Streams strings to a spool file, keeping only their end offsets in memory.
+
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.spool = tempfile.TemporaryFile()
+
+    def append(self, value:str):
+        data = (value or '').encode()
+        self.spool.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+
+class _FlagColumn:
+
+    def __init__(self):
+        self.bitmap = bytearray()
+        self.count = 0
+
+    def append(self, value:bool):
+        if self.count % 8 == 0:
+            self.bitmap.append(0)
+        if value:
+            self.bitmap[-1] |= 1 << (self.count % 8)
+        self.count = self.count + 1
+
+
+def _compressed_rows(edge_rows:array, edge_columns:array, row_count:int) -> tuple:
+    # Counting sort of (row, column) edges into (offsets, columns), keeping the edge order within a row.
+    offsets = array('Q', bytes(8 * (row_count + 1)))
+    for row in edge_rows:
+        offsets[row + 1] += 1
+    for row in range(row_count):
+        offsets[row + 1] += offsets[row]
+    positions = array('Q', offsets[:-1])
+    columns = array('I', bytes(4 * len(edge_columns)))
+    for row, column in zip(edge_rows, edge_columns):
+        columns[positions[row]] = column
+        positions[row] += 1
+    return offsets, columns
+
+
+def _transpose(offsets:array, columns:array, column_count:int) -> tuple:
+    # Rows visited in key order, so every transposed row lists its columns in ascending order.
+    rows = array('I')
+    for row in range(len(offsets) - 1):
+        rows.extend([row] * (offsets[row + 1] - offsets[row]))
+    return _compressed_rows(columns, rows, column_count)
+
+
+def export_snapshot(path:str, access_token, page_size:int = graph_utils.MAX_PAGE_SIZE) -> dict:
+    """
+    Streams the tenant's users, groups and user memberships into a columnar snapshot file.
+
+    Users are paged from /users and groups with their members from /groups/delta. Each page is
+    appended to the columns as it arrives, so memory holds the columns' offsets and the id to key
+    table, not the directory objects. The file is written next to path and renamed when complete.
+
+    Args:
+        path (str): The snapshot file.
+        access_token (str | TokenProvider | GraphClient): The Graph API access token.
+        page_size (int, optional): Objects requested per page, up to 999. Defaults to 999.
+
+    Returns:
+        dict: A dictionary containing the number of users, groups and memberships, the file size in bytes and the elapsed seconds.
+
+    Raises:
+        requests.exceptions.HTTPError: If a request fails."""
+
+    started = time.monotonic()
+    user_strings = {name: _StringColumn() for name in USER_STRING_COLUMNS}
+    user_flags = {name: _FlagColumn() for name in USER_FLAG_COLUMNS}
+    group_strings = {name: _StringColumn() for name in GROUP_STRING_COLUMNS}
+    group_flags = {name: _FlagColumn() for name in GROUP_FLAG_COLUMNS}
+    user_keys = {}
+    upns = []
+    group_keys = {}
+    edge_groups, edge_users = array('I'), array('I')
+
+    params = {'$select': ','.join(USER_STRING_COLUMNS + USER_FLAG_COLUMNS), '$top': page_size}
+    for page in graph_utils.iter_pages(config.GRAPH_BASE_URL_USER, access_token, params, prefetch=True):
+        for user in page['value']:
+            if user['id'] in user_keys:
+                continue
+            user_keys[user['id']] = len(user_keys)
+            upns.append((user.get('userPrincipalName') or '').encode().lower())
+            for name, column in user_strings.items():
+                column.append(user.get(name))
+            for name, column in user_flags.items():
+                column.append(user.get(name))
+
+    params = {'$select': ','.join(GROUP_STRING_COLUMNS + GROUP_FLAG_COLUMNS) + ',members'}
+    for page in graph_utils.iter_pages(f'{config.GRAPH_BASE_URL_GROUP}/delta', access_token, params, prefetch=True):
+        for group in page['value']:
+            if '@removed' in group:
+                continue
+            key = group_keys.get(group['id'])
+            if key is None:
+                # Large groups come back in several objects: only the first one carries the properties.
+                key = group_keys[group['id']] = len(group_keys)
+                for name, column in group_strings.items():
+                    column.append(group.get(name))
+                for name, column in group_flags.items():
+                    column.append(group.get(name))
+            for member in group.get('members@delta', []):
+                user = user_keys.get(member['id'])
+                if user is not None and member.get('@odata.type', USER_TYPE) == USER_TYPE and '@removed' not in member:
+                    edge_groups.append(key)
+                    edge_users.append(user)
+
+    group_offsets, group_members = _compressed_rows(edge_groups, edge_users, len(group_keys))
+    user_offsets, user_groups = _transpose(group_offsets, group_members, len(user_keys))
+    group_offsets, group_members = _transpose(user_offsets, user_groups, len(group_keys))
+    del edge_groups, edge_users
+
+    sections = []
+    for prefix, columns in (('user', user_strings), ('group', group_strings)):
+        for name, column in columns.items():
+            sections.append((f'{prefix}.{name}.offsets', _little_endian(column.offsets)))
+            sections.append((f'{prefix}.{name}', column.spool))
+    for prefix, columns in (('user', user_flags), ('group', group_flags)):
+        for name, column in columns.items():
+            sections.append((f'{prefix}.{name}', bytes(column.bitmap)))
+
+    user_ids = sorted(user_keys, key=lambda user_id: user_id.encode())
+    sections.append(('user.id.order', _little_endian(array('I', [user_keys[user_id] for user_id in user_ids]))))
+    del user_ids
+    sections.append(('user.upn.order', _little_endian(array('I', sorted(range(len(upns)), key=upns.__getitem__)))))
+    group_ids = sorted(group_keys, key=lambda group_id: group_id.encode())
+    sections.append(('group.id.order', _little_endian(array('I', [group_keys[group_id] for group_id in group_ids]))))
+    sections.append(('group.members.offsets', _little_endian(group_offsets)))
+    sections.append(('group.members', _little_endian(group_members)))
+    sections.append(('user.groups.offsets', _little_endian(user_offsets)))
+    sections.append(('user.groups', _little_endian(user_groups)))
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        position = _HEADER.size + _SECTION.size * len(sections)
+        table = []
+        for name, data in sections:
+            position = -(-position // _ALIGNMENT) * _ALIGNMENT
+            length = data.tell() if hasattr(data, 'tell') else len(data)
+            table.append(_SECTION.pack(name.encode(), position, length))
+            position = position + length
+
+        file.write(_HEADER.pack(_MAGIC, len(user_keys), len(group_keys), len(group_members), time.time(), len(sections)))
+        file.write(b''.join(table))
+        for name, data in sections:
+            file.write(bytes(-file.tell() % _ALIGNMENT))
+            if hasattr(data, 'seek'):
+                data.seek(0)
+                shutil.copyfileobj(data, file)
+                data.close()
+            else:
+                file.write(data)
+        size = file.tell()
+    os.replace(temporary, path)
+
+    return {
+        'status_code': 200,
+        'users': len(user_keys),
+        'groups': len(group_keys),
+        'memberships': len(group_members),
+        'bytes': size,
+        'seconds': time.monotonic() - started
+    }
+
+
+class TenantSnapshot:
+    """
+    Read-only view over a snapshot file written by export_snapshot, mapped into memory.
+
+    Users and groups are addressed by integer keys, their position in the snapshot. Columns are
+    read straight from the mapped file: nothing is parsed on load, and the operating system pages
+    in only what queries touch. Boolean columns and member sets are combined as bitmaps with one
+    key per bit, e.g. disabled_mask() & members_mask(groups).
+
+    Args:
+        path (str): The snapshot file.
+
+    Raises:
+        ValueError: If the file is not a snapshot.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'{path} is not a tenant snapshot file.') from None
+        self._views = []
+
+        header = self._map[:_HEADER.size]
+        if len(header) != _HEADER.size or header[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a tenant snapshot file.')
+        _, self.user_count, self.group_count, self.membership_count, self.exported_at, section_count = _HEADER.unpack(header)
+
+        self._sections = {}
+        for index in range(section_count):
+            name, offset, length = _SECTION.unpack_from(self._map, _HEADER.size + index * _SECTION.size)
+            self._sections[name.rstrip(b'\0').decode()] = (offset, length)
+
+        self._user_strings = {name: self._strings(f'user.{name}') for name in USER_STRING_COLUMNS}
+        self._group_strings = {name: self._strings(f'group.{name}') for name in GROUP_STRING_COLUMNS}
+        self._flag_columns = {f'user.{name}': self._view(f'user.{name}') for name in USER_FLAG_COLUMNS}
+        self._flag_columns.update({f'group.{name}': self._view(f'group.{name}') for name in GROUP_FLAG_COLUMNS})
+        self._account_enabled = self._flag_columns['user.accountEnabled']
+        self._security_enabled = self._flag_columns['group.securityEnabled']
+        self._user_id_order = self._column('user.id.order', 'I')
+        self._user_upn_order = self._column('user.upn.order', 'I')
+        self._group_id_order = self._column('group.id.order', 'I')
+        self._group_member_offsets = self._column('group.members.offsets', 'Q')
+        self._group_members = self._column('group.members', 'I')
+        self._user_group_offsets = self._column('user.groups.offsets', 'Q')
+        self._user_groups = self._column('user.groups', 'I')
+
+    @classmethod
+    def load(cls, path:str) -> 'TenantSnapshot':
+        """
+        Maps a snapshot file into memory.
+
+        Args:
+            path (str): The snapshot file.
+
+        Returns:
+            TenantSnapshot: The snapshot. Close it, or use it as a context manager, to unmap the file.
+
+        Raises:
+            ValueError: If the file is not a snapshot."""
+
+        return cls(path)
+
+    def close(self):
+        """Unmaps the file. Values read from the snapshot remain valid."""
+
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Columns
+
+    def _view(self, name:str) -> memoryview:
+        offset, length = self._sections[name]
+        view = memoryview(self._map)[offset:offset + length]
+        self._views.append(view)
+        return view
+
+    def _column(self, name:str, typecode:str):
+        view = self._view(name)
+        if sys.byteorder == 'little':
+            column = view.cast('B').cast(typecode)
+            self._views.append(column)
+            return column
+        values = array(typecode)
+        values.frombytes(view)
+        values.byteswap()
+        return values
+
+    def _strings(self, name:str) -> tuple:
+        return self._column(f'{name}.offsets', 'Q'), self._view(name)
+
+    @staticmethod
+    def _string(column:tuple, key:int) -> str:
+        offsets, data = column
+        return str(data[offsets[key]:offsets[key + 1]], 'utf-8')
+
+    def _flags(self, name:str, count:int) -> int:
+        return int.from_bytes(self._flag_columns[name], 'little') & ((1 << count) - 1)
+
+    # Lookups
+
+    def _search(self, order, column:tuple, value:bytes, lower:bool = False) -> int:
+        offsets, data = column
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            key = order[middle]
+            candidate = data[offsets[key]:offsets[key + 1]].tobytes()
+            if lower:
+                candidate = candidate.lower()
+            if candidate < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order):
+            key = order[low]
+            candidate = data[offsets[key]:offsets[key + 1]].tobytes()
+            if (candidate.lower() if lower else candidate) == value:
+                return key
+        return None
+
+    def user_key(self, user:str) -> int:
+        """Returns the key of a user given by id or UPN, or None if the user isn't in the snapshot."""
+
+        key = self._search(self._user_id_order, self._user_strings['id'], user.encode())
+        if key is None:
+            key = self._search(self._user_upn_order, self._user_strings['userPrincipalName'], user.encode().lower(), lower=True)
+        return key
+
+    def group_key(self, group_id:str) -> int:
+        """Returns the key of a group, or None if the group isn't in the snapshot."""
+        return self._search(self._group_id_order, self._group_strings['id'], group_id.encode())
+
+    def find_groups(self, group_name:str) -> list:
+        """
+        Returns the keys of the groups whose display name contains group_name, case-insensitively.
+
+        The whole display name column is searched at once, without decoding the names."""
+
+        needle = group_name.encode().lower()
+        if not needle:
+            return list(range(self.group_count))
+
+        offsets, data = self._group_strings['displayName']
+        names = data.tobytes().lower()
+        keys = []
+        position = names.find(needle)
+        while position != -1:
+            key = bisect.bisect_right(offsets, position) - 1
+            if position + len(needle) <= offsets[key + 1]:
+                keys.append(key)
+                # Continue after this name: one match per group.
+                position = names.find(needle, offsets[key + 1])
+            else:
+                position = names.find(needle, position + 1)
+        return keys
+
+    def user(self, key:int) -> models.User:
+        """Returns the user with the given key."""
+
+        strings = self._user_strings
+        return models.User(
+            id=self._string(strings['id'], key),
+            upn=self._string(strings['userPrincipalName'], key),
+            display_name=self._string(strings['displayName'], key),
+            department=self._string(strings['department'], key) or None,
+            job_title=self._string(strings['jobTitle'], key) or None,
+            account_enabled=bool(self._account_enabled[key >> 3] >> (key & 7) & 1)
+        )
+
+    def group(self, key:int) -> models.Group:
+        """Returns the group with the given key."""
+
+        return models.Group(
+            display_name=self._string(self._group_strings['displayName'], key),
+            id=self._string(self._group_strings['id'], key),
+            security_enabled=bool(self._security_enabled[key >> 3] >> (key & 7) & 1)
+        )
+
+    # Memberships
+
+    def members_of(self, group_key:int) -> list:
+        """Returns the keys of the direct user members of a group, in ascending order."""
+
+        offsets = self._group_member_offsets
+        return self._group_members[offsets[group_key]:offsets[group_key + 1]].tolist()
+
+    def groups_of(self, user_key:int) -> list:
+        """Returns the keys of the groups a user is a direct member of, in ascending order."""
+
+        offsets = self._user_group_offsets
+        return self._user_groups[offsets[user_key]:offsets[user_key + 1]].tolist()
+
+    def is_member(self, user_key:int, group_key:int) -> bool:
+        """Checks if a user is a direct member of a group, by binary search in the group's sorted members."""
+
+        offsets = self._group_member_offsets
+        start, end = offsets[group_key], offsets[group_key + 1]
+        position = bisect.bisect_left(self._group_members, user_key, start, end)
+        return position < end and self._group_members[position] == user_key
+
+    # Bitmap queries
+
+    def enabled_mask(self) -> int:
+        """Returns the bitmap of the users with an enabled account."""
+        return self._flags('user.accountEnabled', self.user_count)
+
+    def disabled_mask(self) -> int:
+        """Returns the bitmap of the users with a disabled account."""
+        return ~self.enabled_mask() & ((1 << self.user_count) - 1)
+
+    def privileged_groups(self) -> list:
+        """Returns the keys of the role-assignable groups (isAssignableToRole)."""
+        return _set_bits(self._flags('group.isAssignableToRole', self.group_count))
+
+    def members_mask(self, group_keys) -> int:
+        """Returns the bitmap of the users that are direct members of any of the given groups."""
+
+        bitmap = bytearray((self.user_count + 7) // 8)
+        offsets, members = self._group_member_offsets, self._group_members
+        for group_key in group_keys:
+            for user_key in members[offsets[group_key]:offsets[group_key + 1]]:
+                bitmap[user_key >> 3] |= 1 << (user_key & 7)
+        return int.from_bytes(bitmap, 'little')
+
+    def users(self, mask:int) -> list:
+        """Returns the users of a bitmap, in key order."""
+        return [self.user(key) for key in _set_bits(mask)]
+
+    def disabled_privileged_members(self, group_keys=None) -> list:
+        """
+        Returns the disabled users that are still direct members of privileged groups.
+
+        Args:
+            group_keys (list, optional): Keys of the privileged groups. Defaults to the role-assignable groups.
+
+        Returns:
+            list: The users, in key order."""
+
+        if group_keys is None:
+            group_keys = self.privileged_groups()
+        return self.users(self.disabled_mask() & self.members_mask(group_keys))
+
+    def stats(self) -> dict:
+        """Returns the number of users, groups and memberships, the file size and the export time (epoch seconds)."""
+
+        return {
+            'users': self.user_count,
+            'groups': self.group_count,
+            'memberships': self.membership_count,
+            'bytes': len(self._map),
+            'exported_at': self.exported_at
+        }
@@ -0,0 +1,385 @@
+"""
+HTTP transports of GraphClient.
+
+A transport sends one request and returns a requests.Response, so everything above it (retries,
+error handling, result parsing) works the same whatever protocol is used:
+
+    RequestsTransport   requests session, HTTP/1.1, one request per connection at a time (default)
+    HTTP2Transport      HTTP/2, many concurrent requests multiplexed over a few connections
+
+    client = GraphClient(token, transport=HTTP2Transport())
+
+Any object with request(method, url, headers=None, **kwargs) and close() can be passed as transport.
+"""
+
+import socket
+import ssl
+import threading
+from http.client import responses
+from urllib.parse import urlsplit
+import requests
+import urllib3
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .utils.stats import Counters
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+DEFAULT_HTTP2_MAX_CONNECTIONS = 4
+
+_READ_SIZE = 65536
+
+
+class RequestsTransport:
+    """
+    Sends requests through a requests session with a keep-alive connection pool.
+
+    Args:
+        session (requests.Session): The session to send requests with.
+    """
+
+    def __init__(self, session:requests.Session):
+        self.session = session
+
+    def request(self, method:str, url:str, headers:dict = None, **kwargs) -> requests.Response:
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class HTTP2Transport:
+    """
+    Sends requests over HTTP/2, multiplexing concurrent requests over a few connections per host.
+
+    A connection carries as many concurrent requests as the server allows streams (100 for the Graph
+    API); another connection is opened only when every connection to the host is at its stream limit,
+    up to max_connections. HTTP/2 is negotiated through TLS (ALPN). Hosts that don't offer it, and
+    cleartext http:// URLs without prior_knowledge, are served over HTTP/1.1 by a requests session.
+
+    Args:
+        max_connections (int, optional): Maximum HTTP/2 connections per host. Defaults to 4.
+        prior_knowledge (bool, optional): If True, http:// URLs are sent over cleartext HTTP/2 without negotiation,
+            e.g. to GraphEmulator(http2=True). Defaults to False.
+        verify (bool, optional): If False, TLS certificates are not verified. Defaults to True.
+        connect_timeout (float, optional): Timeout in seconds for opening a connection. Defaults to 30.
+
+    Raises:
+        ImportError: If the h2 package is not installed.
+    """
+
+    def __init__(self, max_connections:int = DEFAULT_HTTP2_MAX_CONNECTIONS, prior_knowledge:bool = False,
+                 verify:bool = True, connect_timeout:float = 30):
+
+        if h2 is None:
+            raise ImportError('HTTP2Transport requires h2. Install it with: pip install azure-graph-toolkit[http2]')
+
+        self.max_connections = max_connections
+        self.prior_knowledge = prior_knowledge
+        self.verify = verify
+        self.connect_timeout = connect_timeout
+        self.stats = Counters('connections', 'requests', 'http1_requests')
+
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._http1_origins = set()
+        self._fallback = None
+
+    def request(self, method:str, url:str, headers:dict = None, timeout:float = None, **kwargs) -> requests.Response:
+        """
+        Sends a request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The request URL.
+            headers (dict, optional): The request headers.
+            timeout (float, optional): Seconds to wait for the response. Defaults to None (no timeout).
+            **kwargs: params, json or data, as for requests.
+
+        Returns:
+            requests.Response: The response; its http_version attribute is 'HTTP/2' or 'HTTP/1.1'.
+
+        Raises:
+            requests.exceptions.ConnectionError: If the connection fails or is closed before the response.
+            requests.exceptions.Timeout: If the response doesn't arrive within timeout."""
+
+        prepared = requests.Request(method, url, headers=headers, **kwargs).prepare()
+        parts = urlsplit(prepared.url)
+        origin = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+        if origin in self._http1_origins or (parts.scheme == 'http' and not self.prior_knowledge):
+            return self._request_http1(method, url, headers, timeout, **kwargs)
+
+        try:
+            connection = self._connection(origin)
+        except _NotHttp2:
+            self._http1_origins.add(origin)
+            return self._request_http1(method, url, headers, timeout, **kwargs)
+
+        self.stats.add('requests')
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        body = prepared.body.encode() if isinstance(prepared.body, str) else prepared.body
+        response = connection.request(method, parts.netloc, path, prepared.headers, body, timeout)
+        response.url = prepared.url
+        return response
+
+    def close(self):
+        """Closes every connection."""
+
+        with self._lock:
+            connections = [connection for pool in self._pools.values() for connection in pool]
+            self._pools = {}
+        for connection in connections:
+            connection.close()
+        if self._fallback is not None:
+            self._fallback.close()
+
+    def _connection(self, origin:tuple):
+        with self._lock:
+            pool = self._pools.setdefault(origin, [])
+            pool[:] = [connection for connection in pool if connection.usable]
+            available = [connection for connection in pool if connection.has_free_stream()]
+            if available or len(pool) >= self.max_connections:
+                # Least loaded connection; it queues the request if it has no free stream.
+                return min(available or pool, key=lambda connection: connection.open_streams)
+
+            connection = _Http2Connection(origin, self.verify, self.connect_timeout)
+            pool.append(connection)
+
+        try:
+            connection.connect()
+        except BaseException:
+            with self._lock:
+                pool.remove(connection)
+            raise
+        self.stats.add('connections')
+        return connection
+
+    def _request_http1(self, method:str, url:str, headers:dict, timeout:float, **kwargs) -> requests.Response:
+        with self._lock:
+            if self._fallback is None:
+                self._fallback = RequestsTransport(requests.Session())
+        self.stats.add('http1_requests')
+        response = self._fallback.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        response.http_version = 'HTTP/1.1'
+        return response
+
+
+class _NotHttp2(Exception):
+    """The server didn't select HTTP/2 during the TLS handshake."""
+
+
+class _Stream:
+    __slots__ = ('done', 'status', 'headers', 'body', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.status = None
+        self.headers = None
+        self.body = bytearray()
+        self.error = None
+
+
+class _Http2Connection:
+    """
+    One HTTP/2 connection shared by many threads. Requests are written under a lock; a reader thread
+    routes the response frames to the waiting streams."""
+
+    def __init__(self, origin:tuple, verify:bool, connect_timeout:float):
+        self.origin = origin
+        self.verify = verify
+        self.connect_timeout = connect_timeout
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True, header_encoding='utf-8'))
+        # Guards the connection state; waited on for free streams and flow control windows.
+        self.condition = threading.Condition()
+        self.streams = {}
+        self.sock = None
+        self.closed = False
+        self.connecting = True
+        self.reader = None
+
+    @property
+    def usable(self) -> bool:
+        return not self.closed
+
+    @property
+    def open_streams(self) -> int:
+        return len(self.streams)
+
+    def has_free_stream(self) -> bool:
+        return self.connecting or self.open_streams < self.connection.remote_settings.max_concurrent_streams
+
+    def connect(self):
+        scheme, host, port = self.origin
+        try:
+            sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+            if scheme == 'https':
+                context = ssl.create_default_context()
+                if not self.verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                context.set_alpn_protocols(['h2', 'http/1.1'])
+                sock = context.wrap_socket(sock, server_hostname=host)
+                if sock.selected_alpn_protocol() != 'h2':
+                    sock.close()
+                    raise _NotHttp2()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(None)
+        except OSError as err:
+            with self.condition:
+                self._fail_streams(f'Cannot connect to {host}:{port}.')
+            # Raised like requests does, so RetryPolicy knows the request was never sent.
+            raise requests.exceptions.ConnectionError(
+                urllib3.exceptions.NewConnectionError(None, f'Cannot connect to {host}:{port}: {err}')) from err
+        except _NotHttp2:
+            with self.condition:
+                self._fail_streams(f'{host}:{port} does not support HTTP/2.')
+            raise
+
+        with self.condition:
+            self.sock = sock
+            self.connection.initiate_connection()
+            self._flush()
+            self.connecting = False
+            self.condition.notify_all()
+        self.reader = threading.Thread(target=self._read, name=f'graph-http2-{host}', daemon=True)
+        self.reader.start()
+
+    def request(self, method:str, authority:str, path:str, headers, body:bytes, timeout:float) -> requests.Response:
+        request_headers = [(':method', method), (':authority', authority), (':scheme', self.origin[0]), (':path', path)]
+        request_headers.extend((name.lower(), str(value)) for name, value in headers.items()
+                               if name.lower() not in ('host', 'connection', 'keep-alive', 'transfer-encoding'))
+        stream = _Stream()
+
+        with self.condition:
+            while not self.closed and (self.connecting or
+                                       self.open_streams >= self.connection.remote_settings.max_concurrent_streams):
+                self.condition.wait()
+            self._check_open()
+
+            stream_id = self.connection.get_next_available_stream_id()
+            self.streams[stream_id] = stream
+            self.connection.send_headers(stream_id, request_headers, end_stream=not body)
+            self._flush()
+
+            offset = 0
+            while body and offset < len(body) and not self.closed:
+                window = min(self.connection.local_flow_control_window(stream_id), self.connection.max_outbound_frame_size)
+                if window <= 0:
+                    self.condition.wait()
+                    self._check_open()
+                    continue
+                chunk = body[offset:offset + window]
+                offset = offset + len(chunk)
+                self.connection.send_data(stream_id, chunk, end_stream=offset >= len(body))
+                self._flush()
+
+        if not stream.done.wait(timeout):
+            with self.condition:
+                if self.streams.pop(stream_id, None) is not None and not self.closed:
+                    self.connection.reset_stream(stream_id)
+                    self._flush()
+                self.condition.notify_all()
+            raise requests.exceptions.Timeout(f'No response within {timeout} seconds.')
+
+        if stream.error is not None:
+            raise requests.exceptions.ConnectionError(stream.error)
+
+        response = requests.Response()
+        response.status_code = stream.status
+        response.headers = CaseInsensitiveDict(stream.headers)
+        response._content = bytes(stream.body)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = responses.get(stream.status, '')
+        # Not a requests attribute: the protocol used, as on httpx responses.
+        response.http_version = 'HTTP/2'
+        return response
+
+    def close(self):
+        with self.condition:
+            if not self.closed and self.sock is not None:
+                try:
+                    self.connection.close_connection()
+                    self._flush()
+                except h2.exceptions.ProtocolError:
+                    pass
+            self._fail_streams('Connection closed.')
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        if self.reader is not None and self.reader is not threading.current_thread():
+            self.reader.join()
+
+    def _check_open(self):
+        # Caller must hold self.condition.
+        if self.closed:
+            raise requests.exceptions.ConnectionError(f'HTTP/2 connection to {self.origin[1]} closed.')
+
+    def _read(self):
+        try:
+            while True:
+                data = self.sock.recv(_READ_SIZE)
+                if not data:
+                    break
+                with self.condition:
+                    for event in self.connection.receive_data(data):
+                        self._on_event(event)
+                    self._flush()
+                    self.condition.notify_all()
+                    if self.closed:
+                        break
+        except (OSError, h2.exceptions.ProtocolError):
+            pass
+        with self.condition:
+            self._fail_streams('Server disconnected.')
+
+    def _on_event(self, event):
+        # Caller must hold self.condition.
+        stream = self.streams.get(getattr(event, 'stream_id', None))
+
+        if isinstance(event, h2.events.ResponseReceived) and stream is not None:
+            stream.status = int(dict(event.headers)[':status'])
+            stream.headers = [(name, value) for name, value in event.headers if not name.startswith(':')]
+        elif isinstance(event, h2.events.DataReceived):
+            if stream is not None:
+                stream.body.extend(event.data)
+            self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded) and stream is not None:
+            del self.streams[event.stream_id]
+            stream.done.set()
+        elif isinstance(event, h2.events.StreamReset) and stream is not None:
+            del self.streams[event.stream_id]
+            stream.error = f'Stream reset by the server (error code {event.error_code}).'
+            stream.done.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            # GOAWAY: streams above last_stream_id were not processed and can be retried.
+            self._fail_streams(f'Server closed the connection (error code {event.error_code}).')
+
+    def _fail_streams(self, message:str):
+        # Caller must hold self.condition.
+        self.closed = True
+        for stream in self.streams.values():
+            stream.error = message
+            stream.done.set()
+        self.streams = {}
+        self.condition.notify_all()
+
+    def _flush(self):
+        # Caller must hold self.condition.
+        data = self.connection.data_to_send()
+        if data:
+            try:
+                self.sock.sendall(data)
+            except OSError as err:
+                self._fail_streams(f'Connection lost: {err}')
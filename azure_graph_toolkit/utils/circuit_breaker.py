@@ -0,0 +1,211 @@
+"""
+Per-endpoint circuit breaker.
+
+When an endpoint (e.g. /users/{id}) keeps failing, a CircuitBreaker stops sending it requests for
+a while: calls fail fast with a 503 response, or get the last good response from a fallback
+cache, instead of each waiting for its own timeout and retries:
+
+    breaker = circuit_breaker.CircuitBreaker(failure_rate=0.5, fallback_cache=TTLCache(ttl=600))
+    client = GraphClient(token, circuit_breaker=breaker)
+"""
+
+import json
+import math
+import threading
+import time
+import requests
+from . import metrics
+from .stats import Counters
+from .throttling import TRANSIENT_ERRORS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Server failures. 429 is throttling, handled by the rate limiter, and doesn't trip the breaker.
+FAILURE_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+
+class _Circuit:
+    __slots__ = ('state', 'opened_at', 'window_started', 'requests', 'failures', 'probing')
+
+    def __init__(self, now:float):
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.window_started = now
+        self.requests = 0
+        self.failures = 0
+        self.probing = False
+
+
+def open_circuit_response(url:str, endpoint:str, retry_after:float) -> requests.Response:
+    """
+    Builds the 503 response returned for a request rejected by an open circuit, with a Graph API error body.
+
+    Args:
+        url (str): The request URL.
+        endpoint (str): The endpoint template.
+        retry_after (float): Seconds until the circuit lets a request through again.
+
+    Returns:
+        requests.Response: The response."""
+
+    response = requests.Response()
+    response.status_code = 503
+    response.reason = 'Service Unavailable'
+    response.url = url
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps({'error': {
+        'code': 'circuitOpen',
+        'message': f'Requests to {endpoint} are suspended after repeated failures. Retry in {math.ceil(retry_after)} seconds.'
+    }}).encode()
+    return response
+
+
+class CircuitBreaker:
+    """
+    Suspends the requests to an endpoint whose recent error rate crossed a threshold.
+
+    Each endpoint has its own circuit. A closed circuit counts the requests and failures (5xx
+    responses left after retries, connection errors and timeouts) of the current window; once at
+    least min_requests were sent and failure_rate of them failed, it opens. An open circuit rejects
+    every request for open_seconds, then lets one probe request through: the circuit closes if it
+    succeeds and opens again if it fails.
+
+    A rejected GET request gets the last successful response to the same request from
+    fallback_cache, if one is given and still holds it, otherwise a 503 response with a Retry-After
+    header, which the operations report like any other Graph API error.
+
+    Args:
+        failure_rate (float, optional): Ratio of failed requests that opens the circuit. Defaults to 0.5.
+        min_requests (int, optional): Requests needed in the window before the circuit can open. Defaults to 20.
+        window (float, optional): Seconds over which requests and failures are counted. Defaults to 30.
+        open_seconds (float, optional): Seconds an open circuit rejects requests before probing. Defaults to 30.
+        fallback_cache (TTLCache, optional): Keeps successful GET responses to serve while the circuit is open.
+            Defaults to None (fail fast).
+    """
+
+    def __init__(self, failure_rate:float = 0.5, min_requests:int = 20, window:float = 30.0, open_seconds:float = 30.0,
+                 fallback_cache=None):
+
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.fallback_cache = fallback_cache
+        self.stats = Counters('requests', 'failures', 'opened', 'closed', 'rejected', 'served_from_cache', 'probes')
+
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def state(self, endpoint:str) -> str:
+        """Returns the state of an endpoint's circuit: CLOSED, OPEN or HALF_OPEN."""
+
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            return circuit.state if circuit is not None else CLOSED
+
+    def call(self, method:str, url:str, send, cache_key=None):
+        """
+        Calls send() unless the endpoint's circuit is open, and records the outcome.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The request URL.
+            send (callable): Sends the request, retries included, and returns the response.
+            cache_key (optional): Key of the request in fallback_cache, see coalescing.request_key. None disables the fallback.
+
+        Returns:
+            requests.Response: The response, the cached response, or a 503 response if the circuit is open."""
+
+        endpoint = metrics.endpoint_template(url)
+        admitted, retry_after = self._admit(endpoint)
+        if not admitted:
+            self.stats.add('rejected')
+            if self.fallback_cache is not None and cache_key is not None:
+                cached = self.fallback_cache.get(cache_key)
+                if cached is not None:
+                    self.stats.add('served_from_cache')
+                    return cached
+            return open_circuit_response(url, endpoint, retry_after)
+
+        self.stats.add('requests')
+        try:
+            response = send()
+        except TRANSIENT_ERRORS:
+            self._record(endpoint, failed=True)
+            raise
+        except BaseException:
+            self._record(endpoint, failed=False)
+            raise
+
+        self._record(endpoint, failed=response.status_code in FAILURE_STATUS_CODES)
+        if self.fallback_cache is not None and cache_key is not None and method == 'GET' and response.status_code < 400:
+            self.fallback_cache.set(cache_key, response)
+        return response
+
+    def snapshot(self) -> dict:
+        """
+        Returns the breaker counters and the state of every circuit that isn't closed.
+
+        Returns:
+            dict: requests (sent), failures, opened, closed, rejected (failed fast or served from
+                cache), served_from_cache, probes and open_circuits (endpoint to state)."""
+
+        snapshot = self.stats.snapshot()
+        with self._lock:
+            snapshot['open_circuits'] = {endpoint: circuit.state for endpoint, circuit in self._circuits.items()
+                                         if circuit.state != CLOSED}
+        return snapshot
+
+    def _admit(self, endpoint:str) -> tuple:
+        # Returns (admitted, seconds until the circuit lets a request through).
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                circuit = self._circuits[endpoint] = _Circuit(now)
+
+            if circuit.state == CLOSED:
+                return True, 0.0
+
+            remaining = circuit.opened_at + self.open_seconds - now
+            if circuit.state == OPEN and remaining <= 0:
+                circuit.state = HALF_OPEN
+            if circuit.state == HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                self.stats.add('probes')
+                return True, 0.0
+            return False, max(remaining, 1.0)
+
+    def _record(self, endpoint:str, failed:bool):
+        now = time.monotonic()
+        if failed:
+            self.stats.add('failures')
+        with self._lock:
+            circuit = self._circuits[endpoint]
+
+            if circuit.state == HALF_OPEN:
+                circuit.probing = False
+                if failed:
+                    circuit.state = OPEN
+                    circuit.opened_at = now
+                else:
+                    circuit.state = CLOSED
+                    circuit.window_started, circuit.requests, circuit.failures = now, 0, 0
+                    self.stats.add('closed')
+                return
+
+            if circuit.state == OPEN:
+                # Sent before the circuit opened.
+                return
+
+            if now - circuit.window_started > self.window:
+                circuit.window_started, circuit.requests, circuit.failures = now, 0, 0
+            circuit.requests = circuit.requests + 1
+            circuit.failures = circuit.failures + failed
+            if circuit.requests >= self.min_requests and circuit.failures >= self.failure_rate * circuit.requests:
+                circuit.state = OPEN
+                circuit.opened_at = now
+                self.stats.add('opened')
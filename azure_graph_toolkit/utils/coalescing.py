@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from . import metrics
+from .stats import Counters
+
+
+def request_key(method:str, url:str, token:str, params=None, headers:dict = None):
+    """
+    Returns the key identifying identical requests, or None if the request must not be coalesced.
+
+    Only GET requests are coalesced. The access token is part of the key, so callers with
+    different credentials never share a response."""
+
+    if method != 'GET':
+        return None
+    try:
+        params_key = tuple(sorted(params.items())) if isinstance(params, dict) else params
+        headers_key = tuple(sorted(headers.items())) if headers else None
+        key = (url, params_key, headers_key, token)
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """
+    Single-flight execution of identical concurrent reads.
+
+    The first caller with a given key sends the request; callers arriving with the same key while it
+    is in flight wait for it and get the same response (or exception). Nothing is cached: once the
+    request completes, the next caller sends a new one.
+
+    Args:
+        enabled (bool, optional): If False, every call runs on its own. Defaults to True.
+    """
+
+    def __init__(self, enabled:bool = True):
+        self.enabled = enabled
+        self.stats = Counters('executed', 'coalesced')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def call(self, key, func):
+        """
+        Runs func, or waits for the in-flight call with the same key and returns its result.
+
+        Args:
+            key: Hashable key of the request, see request_key. None runs func on its own.
+            func (callable): Sends the request and returns the response.
+
+        Returns:
+            The response of func, shared by every caller of the same flight."""
+
+        if key is None or not self.enabled:
+            return func()
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        if not leader:
+            self.stats.add('coalesced')
+            recorder = metrics.get_recorder()
+            if recorder is not None:
+                recorder.record_coalesced(metrics.current_operation(), 'GET', key[0])
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.stats.add('executed')
+        try:
+            call.result = func()
+            # Read the body once here, so the followers never read the shared response concurrently.
+            getattr(call.result, 'content', None)
+            return call.result
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+
+class AsyncRequestCoalescer:
+    """
+    Single-flight execution of identical concurrent reads for coroutines, see RequestCoalescer.
+
+    The shared request runs as its own task, so cancelling one of the waiting callers does not
+    cancel the request for the others. Use one coalescer per event loop.
+
+    Args:
+        enabled (bool, optional): If False, every call runs on its own. Defaults to True.
+    """
+
+    def __init__(self, enabled:bool = True):
+        self.enabled = enabled
+        self.stats = Counters('executed', 'coalesced')
+        self._in_flight = {}
+
+    async def call(self, key, func):
+        """
+        Awaits the coroutine function func, or the in-flight call with the same key, and returns its result.
+
+        Args:
+            key: Hashable key of the request, see request_key. None runs func on its own.
+            func (callable): Coroutine function sending the request and returning the response.
+
+        Returns:
+            The response of func, shared by every caller of the same flight."""
+
+        if key is None or not self.enabled:
+            return await func()
+
+        task = self._in_flight.get(key)
+        if task is None or task.done():
+            self.stats.add('executed')
+            task = self._in_flight[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._in_flight.pop(key) if self._in_flight.get(key) is done else None)
+        else:
+            self.stats.add('coalesced')
+            recorder = metrics.get_recorder()
+            if recorder is not None:
+                recorder.record_coalesced(metrics.current_operation(), 'GET', key[0])
+
+        return await asyncio.shield(task)
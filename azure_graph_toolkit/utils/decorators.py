@@ -1,6 +1,14 @@
 import requests
 from functools import wraps
 import logging
+from . import metrics
+from . import throttling
+
+try:
+    import httpx
+    HTTP_ERRORS = (requests.exceptions.HTTPError, httpx.HTTPStatusError)
+except ImportError:
+    HTTP_ERRORS = (requests.exceptions.HTTPError,)
 
 logging.basicConfig(level=logging.ERROR)
 
@@ -12,28 +20,101 @@ def handle_http_exceptions(func):
     """
     Decorator to handle HTTP exceptions in all functions.
 
+    Calls are also reported to the metrics recorder as an operation named after the function, when instrumentation is enabled.
+
     Args:
         function (func): The function to handle HTTP exceptions. 
 
     Returns:
         dict: A dictionary containings status code and error raised."""
     
-    @wraps(func)
-    def wrapper(*args, **kwargs):
+    def handle(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         
         except requests.exceptions.HTTPError as http_err:
+            return http_error_response(http_err.response)
+            #raise GraphHTTPError(error_response) from None
 
-            response_json = http_err.response.json()
-            message = response_json.get('error', {}).get('message')
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = metrics.get_recorder()
+        if recorder is None:
+            return handle(*args, **kwargs)
+        return recorder.observe_operation(func.__name__, handle, *args, **kwargs)
 
-            error_response = {
-            "status_code": http_err.response.status_code,
-            "message": message
-            }
-            
-            return error_response
-            #raise GraphHTTPError(error_response) from None
+    return wrapper
+
+
+def handle_async_http_exceptions(func):
+    """
+    Decorator to handle HTTP exceptions in coroutine functions.
+
+    Args:
+        function (func): The coroutine function to handle HTTP exceptions. 
+
+    Returns:
+        dict: A dictionary containings status code and error raised."""
+
+    async def handle(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+
+        except HTTP_ERRORS as http_err:
+            return http_error_response(http_err.response)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        recorder = metrics.get_recorder()
+        if recorder is None:
+            return await handle(*args, **kwargs)
+        return await recorder.aobserve_operation(func.__name__, handle, *args, **kwargs)
+
+    return wrapper
+
+
+def http_error_response(response) -> dict:
+    """
+    Builds the error dictionary returned for a failed Graph API response.
+
+    Args:
+        response (requests.Response | httpx.Response): The failed HTTP response.
+
+    Returns:
+        dict: A dictionary containings status code and Graph API error message."""
+
+    response_json = response.json()
+    message = response_json.get('error', {}).get('message')
+
+    error_response = {
+    "status_code": response.status_code,
+    "message": message
+    }
+
+    return error_response
+
+
+def retry_on_throttling(retry_policy:throttling.RetryPolicy = None, rate_limiter:throttling.AdaptiveRateLimiter = None,
+                        idempotent:bool = True):
+    """
+    Decorator to retry a function that sends a single Graph API request when it is throttled or fails transiently.
+
+    Args:
+        retry_policy (RetryPolicy, optional): Retry budget and backoff settings. Defaults to RetryPolicy().
+        rate_limiter (AdaptiveRateLimiter, optional): Limiter slowing down every function sharing it once throttling starts.
+        idempotent (bool, optional): False if the request must not be applied twice, e.g. a POST. Defaults to True.
+
+    Returns:
+        function: The decorated function, returning the last HTTP response."""
+
+    policy = retry_policy or throttling.RetryPolicy()
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return policy.call(lambda: func(*args, **kwargs), rate_limiter, idempotent)
+
+        wrapper.retry_policy = policy
+        return wrapper
 
-    return wrapper
\ No newline at end of file
+    return decorator
@@ -0,0 +1,189 @@
+"""
+Hedged reads.
+
+A HedgingPolicy sends a second copy of a slow idempotent request once the first one has taken
+longer than most requests to the same endpoint, and returns whichever answers first, so one slow
+Graph front-end doesn't set the tail latency:
+
+    client = GraphClient(token, hedging=hedging.HedgingPolicy(percentile=95))
+
+Hedging is opt-in and only applies to GET requests.
+"""
+
+import collections
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from . import metrics
+from .stats import Counters
+from .throttling import RETRYABLE_STATUS_CODES
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_INITIAL_DELAY = 1.0
+DEFAULT_MAX_WORKERS = 32
+
+HEDGED_METHODS = frozenset({'GET'})
+
+
+def _usable(future) -> bool:
+    # A response the caller can take: no exception and not a status the retry policy would retry.
+    return future.exception() is None and future.result().status_code not in RETRYABLE_STATUS_CODES
+
+
+def _discard(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class HedgingPolicy:
+    """
+    Sends a backup request when a GET hasn't answered within the hedging delay and takes the first usable response.
+
+    The delay is the given percentile of the latencies recently observed on the endpoint (e.g.
+    /users/{id}), so only the slowest requests are hedged, or a fixed delay. The request that loses
+    the race runs to completion in the background and its response is dropped. Hedges are limited
+    to budget times the number of requests, so a slow service doesn't get twice the load.
+
+    The first request is sent from a thread of its own, so hedging doesn't limit how many GETs a
+    client runs at once, and its latency is measured from the moment it is sent. Only the hedges go
+    through a pool of max_workers threads, each holding a scheduler slot while it runs.
+
+    Args:
+        delay (float, optional): Fixed hedging delay in seconds. Defaults to None (percentile of recent latencies).
+        percentile (float, optional): Latency percentile used as delay. Defaults to 95.
+        initial_delay (float, optional): Delay used until min_samples latencies of the endpoint are known. Defaults to 1.
+        min_samples (int, optional): Latencies needed before the percentile is used. Defaults to 20.
+        window (int, optional): Recent latencies kept per endpoint. Defaults to 500.
+        budget (float, optional): Maximum ratio of hedges to requests. Defaults to 0.1.
+        max_workers (int, optional): Threads sending the hedges. Defaults to 32.
+    """
+
+    def __init__(self, delay:float = None, percentile:float = DEFAULT_PERCENTILE, initial_delay:float = DEFAULT_INITIAL_DELAY,
+                 min_samples:int = 20, window:int = 500, budget:float = 0.1, max_workers:int = DEFAULT_MAX_WORKERS):
+
+        if not 0 < percentile <= 100:
+            raise ValueError(f'percentile must be in (0, 100], got {percentile}.')
+
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.budget = budget
+        self.stats = Counters('requests', 'hedged', 'hedge_wins', 'over_budget')
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='graph-hedge')
+
+    def delay(self, endpoint:str) -> float:
+        """
+        Returns the hedging delay of an endpoint.
+
+        Args:
+            endpoint (str): The endpoint template, see metrics.endpoint_template.
+
+        Returns:
+            float: Seconds to wait for the first request before sending the hedge."""
+
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None or len(latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def call(self, method:str, url:str, send):
+        """
+        Calls send(), and calls it once more if the first call is slower than the endpoint's hedging delay.
+
+        Args:
+            method (str): The HTTP method. Only GET requests are hedged.
+            url (str): The request URL.
+            send (callable): Sends one request attempt and returns the response.
+
+        Returns:
+            requests.Response: The first usable response, or the first request's outcome if neither copy succeeded."""
+
+        if method not in HEDGED_METHODS:
+            return send()
+
+        endpoint = metrics.endpoint_template(url)
+        self.stats.add('requests')
+        primary = self._start(send, endpoint)
+        if wait([primary], timeout=self.delay(endpoint)).done:
+            return primary.result()
+
+        snapshot = self.stats.snapshot()
+        if snapshot['hedged'] >= self.budget * snapshot['requests']:
+            self.stats.add('over_budget')
+            return primary.result()
+
+        self.stats.add('hedged')
+        hedge = self._submit(send)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if _usable(future)), None)
+            if winner is not None:
+                if winner is hedge:
+                    self.stats.add('hedge_wins')
+                for loser in (primary, hedge):
+                    if loser is not winner and not loser.cancel():
+                        loser.add_done_callback(_discard)
+                return winner.result()
+
+        return primary.result()
+
+    def snapshot(self) -> dict:
+        """
+        Returns the hedging counters and the current delay per endpoint.
+
+        Returns:
+            dict: requests (hedgeable requests), hedged (backup requests sent), hedge_wins (backups
+                that answered first), over_budget (hedges skipped by the budget) and delays."""
+
+        snapshot = self.stats.snapshot()
+        with self._lock:
+            endpoints = list(self._latencies)
+        snapshot['delays'] = {endpoint: self.delay(endpoint) for endpoint in endpoints}
+        return snapshot
+
+    def close(self):
+        """Stops the worker threads once the requests in flight are done."""
+        self._executor.shutdown(wait=False)
+
+    def _start(self, send, endpoint:str) -> Future:
+        # Sends the first request right away on a new thread and records its latency.
+        future = Future()
+        context = contextvars.copy_context()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            started = time.monotonic()
+            try:
+                response = context.run(send)
+            except BaseException as err:
+                self._observe(endpoint, time.monotonic() - started)
+                future.set_exception(err)
+            else:
+                self._observe(endpoint, time.monotonic() - started)
+                future.set_result(response)
+
+        threading.Thread(target=run, name='graph-hedge-primary', daemon=True).start()
+        return future
+
+    def _submit(self, send):
+        # Each copy runs in its own copy of the caller's context (priority, metrics operation).
+        return self._executor.submit(contextvars.copy_context().run, send)
+
+    def _observe(self, endpoint:str, latency:float):
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                latencies = self._latencies[endpoint] = collections.deque(maxlen=self.window)
+            latencies.append(latency)
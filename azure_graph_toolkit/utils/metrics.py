@@ -0,0 +1,384 @@
+"""
+Per-operation and per-endpoint instrumentation of Graph API calls.
+
+Instrumentation is off by default and then costs one global lookup per call. enable() installs a
+MetricsRecorder that every decorated graph_utils / aio / bulk operation and every GraphClient /
+AsyncGraphClient request reports to:
+
+    recorder = metrics.enable()
+    graph_utils.add_user_to_group('mario.rossi@domain.com', 'block-usb-group', client)
+    print(recorder.to_prometheus())
+
+Operations called from inside another operation (e.g. get_user_from_upn inside add_user_to_group)
+are recorded with the outer operation as their parent, so composite calls report the time spent
+in each sub-call. HTTP requests are recorded under the innermost running operation.
+"""
+
+import bisect
+import contextvars
+import re
+import threading
+import time
+from collections.abc import Mapping
+from urllib.parse import urlsplit
+from .. import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_recorder = None
+_current_operation = contextvars.ContextVar('graph_operation', default='')
+
+_ID_SEGMENT = re.compile(r'^([0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}|[^@]+@[^@]+|\d+)$')
+
+
+def enable(recorder=None):
+    """
+    Turns instrumentation on.
+
+    Args:
+        recorder (MetricsRecorder, optional): The recorder to report to. Defaults to a new MetricsRecorder().
+
+    Returns:
+        MetricsRecorder: The installed recorder."""
+
+    global _recorder
+    _recorder = recorder or MetricsRecorder()
+    return _recorder
+
+
+def disable():
+    """Turns instrumentation off."""
+
+    global _recorder
+    _recorder = None
+
+
+def get_recorder():
+    """Returns the installed MetricsRecorder, or None if instrumentation is off."""
+    return _recorder
+
+
+def current_operation() -> str:
+    """Returns the name of the innermost running operation, or an empty string."""
+    return _current_operation.get()
+
+
+def endpoint_template(url:str) -> str:
+    """
+    Reduces a request URL to its endpoint, relative to the Graph API base URL and with ids, UPNs and numbers replaced by {id}.
+
+    Args:
+        url (str): The request URL.
+
+    Returns:
+        str: The endpoint, e.g. /users/{id}/memberOf/microsoft.graph.group."""
+
+    path = urlsplit(url).path
+    base_path = urlsplit(config.GRAPH_BASE_URL).path
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    segments = ['{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.strip('/').split('/')]
+    return '/' + '/'.join(segments)
+
+
+def _size(value) -> int:
+    return len(value) if isinstance(value, (bytes, str)) else 0
+
+
+def _status(result) -> str:
+    if isinstance(result, Mapping) and 'status_code' in result:
+        return str(result['status_code'])
+    return 'ok'
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed bucket bounds."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds:tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+    def cumulative(self) -> list:
+        """Returns (upper bound, cumulative count) pairs, ending with ('+Inf', count)."""
+
+        pairs = []
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total = total + count
+            pairs.append((bound, total))
+        return pairs
+
+
+class MetricsRecorder:
+    """
+    Aggregates operation and request metrics and exports them in Prometheus text format or through a callback.
+
+    Recorded per operation (and parent operation): a latency histogram and call counts by result
+    status. Recorded per operation, endpoint and method: a latency histogram of every HTTP attempt,
+    attempt counts by status code, retries, and bytes sent and received.
+
+    Args:
+        buckets (tuple, optional): Histogram bucket upper bounds in seconds. Defaults to DEFAULT_BUCKETS.
+        callback (callable, optional): Called with an event dictionary for every recorded operation and HTTP attempt.
+        aggregate (bool, optional): If False, only the callback is fed and nothing is kept in memory. Defaults to True.
+    """
+
+    def __init__(self, buckets:tuple = DEFAULT_BUCKETS, callback=None, aggregate:bool = True):
+        self.buckets = tuple(buckets)
+        self.callback = callback
+        self.aggregate = aggregate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops everything recorded so far."""
+
+        with self._lock:
+            self._operation_latency = {}    # (operation, parent) -> Histogram
+            self._operation_calls = {}      # (operation, parent, status) -> count
+            self._request_latency = {}      # (operation, endpoint, method) -> Histogram
+            self._request_calls = {}        # (operation, endpoint, method, status) -> count
+            self._retries = {}              # (operation, endpoint, method) -> count
+            self._bytes_sent = {}           # (operation, endpoint, method) -> bytes
+            self._bytes_received = {}       # (operation, endpoint, method) -> bytes
+            self._coalesced = {}            # (operation, endpoint, method) -> count
+
+    # Recording
+
+    def record_operation(self, operation:str, parent:str, duration:float, status:str):
+        if self.aggregate:
+            with self._lock:
+                self._observe(self._operation_latency, (operation, parent), duration)
+                self._count(self._operation_calls, (operation, parent, status))
+        if self.callback is not None:
+            self.callback({'type': 'operation', 'operation': operation, 'parent': parent,
+                           'duration': duration, 'status': status})
+
+    def record_request(self, operation:str, method:str, url:str, duration:float, status:str,
+                       bytes_sent:int = 0, bytes_received:int = 0, retry:bool = False):
+        endpoint = endpoint_template(url)
+        key = (operation, endpoint, method)
+        if self.aggregate:
+            with self._lock:
+                self._observe(self._request_latency, key, duration)
+                self._count(self._request_calls, key + (status,))
+                self._count(self._bytes_sent, key, bytes_sent)
+                self._count(self._bytes_received, key, bytes_received)
+                if retry:
+                    self._count(self._retries, key)
+        if self.callback is not None:
+            self.callback({'type': 'request', 'operation': operation, 'endpoint': endpoint, 'method': method,
+                           'duration': duration, 'status': status, 'bytes_sent': bytes_sent,
+                           'bytes_received': bytes_received, 'retry': retry})
+
+    def record_coalesced(self, operation:str, method:str, url:str):
+        endpoint = endpoint_template(url)
+        if self.aggregate:
+            with self._lock:
+                self._count(self._coalesced, (operation, endpoint, method))
+        if self.callback is not None:
+            self.callback({'type': 'coalesced', 'operation': operation, 'endpoint': endpoint, 'method': method})
+
+    def _observe(self, histograms:dict, key:tuple, value:float):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def _count(self, counters:dict, key:tuple, value:int = 1):
+        counters[key] = counters.get(key, 0) + value
+
+    # Hooks used by the decorators and the clients
+
+    def observe_operation(self, operation:str, func, *args, **kwargs):
+        """Runs func as the named operation and records its latency and result status."""
+
+        parent = _current_operation.get()
+        token = _current_operation.set(operation)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = func(*args, **kwargs)
+            status = _status(result)
+            return result
+        finally:
+            _current_operation.reset(token)
+            self.record_operation(operation, parent, time.perf_counter() - started, status)
+
+    async def aobserve_operation(self, operation:str, func, *args, **kwargs):
+        """Awaits the coroutine function func as the named operation and records its latency and result status."""
+
+        parent = _current_operation.get()
+        token = _current_operation.set(operation)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = await func(*args, **kwargs)
+            status = _status(result)
+            return result
+        finally:
+            _current_operation.reset(token)
+            self.record_operation(operation, parent, time.perf_counter() - started, status)
+
+    def wrap_send(self, method:str, url:str, send):
+        """
+        Wraps the function sending one HTTP attempt so that every attempt is recorded. Attempts after the first are counted as retries."""
+
+        operation = _current_operation.get()
+        attempts = [0]
+
+        def instrumented_send():
+            attempts[0] = attempts[0] + 1
+            started = time.perf_counter()
+            status = 'error'
+            response = None
+            try:
+                response = send()
+                status = str(response.status_code)
+                return response
+            finally:
+                self._record_attempt(operation, method, url, started, status, response, attempts[0] > 1)
+
+        return instrumented_send
+
+    def wrap_asend(self, method:str, url:str, send):
+        """Coroutine counterpart of wrap_send."""
+
+        operation = _current_operation.get()
+        attempts = [0]
+
+        async def instrumented_send():
+            attempts[0] = attempts[0] + 1
+            started = time.perf_counter()
+            status = 'error'
+            response = None
+            try:
+                response = await send()
+                status = str(response.status_code)
+                return response
+            finally:
+                self._record_attempt(operation, method, url, started, status, response, attempts[0] > 1)
+
+        return instrumented_send
+
+    def _record_attempt(self, operation:str, method:str, url:str, started:float, status:str, response, retry:bool):
+        duration = time.perf_counter() - started
+        bytes_sent = bytes_received = 0
+        if response is not None:
+            request = getattr(response, 'request', None)
+            body = getattr(request, 'body', None)
+            if body is None and request is not None and not hasattr(request, 'body'):
+                body = getattr(request, 'content', None)
+            bytes_sent = _size(body)
+            bytes_received = _size(getattr(response, 'content', None))
+        self.record_request(operation, method, url, duration, status, bytes_sent, bytes_received, retry)
+
+    # Export
+
+    def snapshot(self) -> dict:
+        """
+        Returns the aggregated metrics.
+
+        Returns:
+            dict: A dictionary with 'operations', 'requests' and 'coalesced' lists, one entry per label set."""
+
+        with self._lock:
+            operations = []
+            for (operation, parent), histogram in self._operation_latency.items():
+                operations.append({
+                    'operation': operation,
+                    'parent': parent,
+                    'count': histogram.count,
+                    'seconds': histogram.sum,
+                    'statuses': {status: count for (name, outer, status), count in self._operation_calls.items()
+                                 if (name, outer) == (operation, parent)}
+                })
+
+            requests_ = []
+            for key, histogram in self._request_latency.items():
+                operation, endpoint, method = key
+                requests_.append({
+                    'operation': operation,
+                    'endpoint': endpoint,
+                    'method': method,
+                    'count': histogram.count,
+                    'seconds': histogram.sum,
+                    'statuses': {labels[3]: count for labels, count in self._request_calls.items() if labels[:3] == key},
+                    'retries': self._retries.get(key, 0),
+                    'bytes_sent': self._bytes_sent.get(key, 0),
+                    'bytes_received': self._bytes_received.get(key, 0)
+                })
+
+            coalesced = [{'operation': operation, 'endpoint': endpoint, 'method': method, 'count': count}
+                         for (operation, endpoint, method), count in self._coalesced.items()]
+
+        return {'operations': operations, 'requests': requests_, 'coalesced': coalesced}
+
+    def to_prometheus(self, prefix:str = 'graph') -> str:
+        """
+        Renders the aggregated metrics in the Prometheus text exposition format.
+
+        Args:
+            prefix (str, optional): Metric name prefix. Defaults to 'graph'.
+
+        Returns:
+            str: The metrics text."""
+
+        operation_labels = ('operation', 'parent')
+        request_labels = ('operation', 'endpoint', 'method')
+
+        with self._lock:
+            lines = []
+            _histogram_lines(lines, f'{prefix}_operation_duration_seconds', 'Duration of toolkit operations.',
+                             operation_labels, self._operation_latency)
+            _counter_lines(lines, f'{prefix}_operations_total', 'Toolkit operations by result status.',
+                           operation_labels + ('status',), self._operation_calls)
+            _histogram_lines(lines, f'{prefix}_request_duration_seconds', 'Duration of Graph API HTTP attempts.',
+                             request_labels, self._request_latency)
+            _counter_lines(lines, f'{prefix}_requests_total', 'Graph API HTTP attempts by status code.',
+                           request_labels + ('status',), self._request_calls)
+            _counter_lines(lines, f'{prefix}_request_retries_total', 'Graph API HTTP attempts that were retries.',
+                           request_labels, self._retries)
+            _counter_lines(lines, f'{prefix}_request_bytes_sent_total', 'Request body bytes sent to the Graph API.',
+                           request_labels, self._bytes_sent)
+            _counter_lines(lines, f'{prefix}_response_bytes_received_total', 'Response body bytes received from the Graph API.',
+                           request_labels, self._bytes_received)
+            _counter_lines(lines, f'{prefix}_requests_coalesced_total', 'Reads served by an identical in-flight request.',
+                           request_labels, self._coalesced)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names:tuple, values:tuple) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _histogram_lines(lines:list, name:str, help_text:str, label_names:tuple, histograms:dict):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for values, histogram in sorted(histograms.items()):
+        labels = _labels(label_names, values)
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _counter_lines(lines:list, name:str, help_text:str, label_names:tuple, counters:dict):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for values, count in sorted(counters.items()):
+        lines.append(f'{name}{{{_labels(label_names, values)}}} {count}')
@@ -0,0 +1,267 @@
+"""
+Priority scheduling of Graph API requests.
+
+A PriorityScheduler caps the number of requests in flight and hands free slots to the most urgent
+queued request first, so an incident action does not wait behind thousands of queued bulk writes:
+
+    scheduler = graph_client.DEFAULT_SCHEDULER
+    scheduler.configure(max_concurrency=16, reservations={scheduling.CRITICAL: 2})
+
+Every request runs at the priority of its calling context. user_revoke_sessions and disabling an
+account default to CRITICAL, the bulk, reconcile and pipeline operations to BULK, everything else
+to NORMAL. Wrap calls in priority() to choose explicitly:
+
+    with scheduling.priority(scheduling.CRITICAL):
+        graph_utils.remove_user_from_group('mario.rossi@domain.com', 'vpn-users', client)
+"""
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+BULK = 'bulk'
+
+# Most urgent first.
+PRIORITIES = (CRITICAL, NORMAL, BULK)
+
+_current_priority = contextvars.ContextVar('graph_priority', default=None)
+
+
+def current_priority() -> str:
+    """Returns the priority of the calling context, NORMAL if none was set."""
+    return _current_priority.get() or NORMAL
+
+
+def _check_priority(level:str):
+    if level not in PRIORITIES:
+        raise ValueError(f'Unknown priority {level}. Use one of {", ".join(PRIORITIES)}.')
+
+
+@contextlib.contextmanager
+def priority(level:str):
+    """
+    Runs the requests sent inside the block at the given priority, overriding the defaults of the operations called.
+
+    Args:
+        level (str): CRITICAL, NORMAL or BULK.
+
+    Raises:
+        ValueError: If level is unknown."""
+
+    _check_priority(level)
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextlib.contextmanager
+def default_priority(level:str):
+    """
+    Like priority(), but only if the caller hasn't chosen a priority. Also usable as a decorator.
+
+    Args:
+        level (str): CRITICAL, NORMAL or BULK. None leaves the priority unchanged."""
+
+    if level is None or _current_priority.get() is not None:
+        yield
+        return
+
+    with priority(level):
+        yield
+
+
+class _Waiter:
+    __slots__ = ('level', 'granted', 'queued_at')
+
+    def __init__(self, level:str):
+        self.level = level
+        self.granted = threading.Event()
+        self.queued_at = time.monotonic()
+
+
+class _UnpacedLimiter:
+    # Honors Retry-After blocks of the wrapped limiter without waiting for its token bucket.
+
+    def __init__(self, rate_limiter):
+        self._rate_limiter = rate_limiter
+
+    def reserve(self) -> float:
+        return self._rate_limiter.reserve(paced=False)
+
+    def on_throttle(self, retry_after:float = None):
+        self._rate_limiter.on_throttle(retry_after)
+
+    def on_success(self):
+        self._rate_limiter.on_success()
+
+
+class PriorityScheduler:
+    """
+    Admits requests by priority within a concurrency limit.
+
+    Each attempt of a request (retries included) takes one of max_concurrency slots while it is
+    sent; backoff and Retry-After waits hold no slot. When no slot is free, requests queue per
+    priority and a released slot goes to the oldest request of the most urgent non-empty queue, so
+    queued low-priority work is overtaken by anything more urgent. reservations[level] slots are
+    kept free for that priority: the other priorities leave them unused even when they have work
+    queued.
+
+    A request whose priority has a latency budget and that has been queued for that long is admitted
+    above max_concurrency, which bounds its queueing time even if every slot is busy with long calls.
+    Requests at an unpaced priority don't wait for the client-side rate limiter's token bucket,
+    only for the Retry-After blocks it reports.
+
+    Args:
+        max_concurrency (int, optional): Maximum requests in flight. Defaults to None (no limit, requests never queue).
+        reservations (dict, optional): Slots kept for a priority, e.g. {CRITICAL: 2}. Defaults to none.
+        latency_budgets (dict, optional): Maximum queueing time in seconds per priority. Defaults to 1 second for CRITICAL.
+        unpaced (tuple, optional): Priorities that skip the rate limiter's pacing. Defaults to (CRITICAL,).
+    """
+
+    def __init__(self, max_concurrency:int = None, reservations:dict = None, latency_budgets:dict = None,
+                 unpaced:tuple = (CRITICAL,)):
+
+        self._lock = threading.Lock()
+        self._queues = {level: collections.deque() for level in PRIORITIES}
+        self._in_flight = dict.fromkeys(PRIORITIES, 0)
+        self._stats = {name: dict.fromkeys(PRIORITIES, 0) for name in ('admitted', 'queued', 'overtook', 'over_limit')}
+        self._waited = dict.fromkeys(PRIORITIES, 0.0)
+        self._max_wait = dict.fromkeys(PRIORITIES, 0.0)
+        self.unpaced = frozenset(unpaced)
+        self.configure(max_concurrency, reservations, {CRITICAL: 1.0} if latency_budgets is None else latency_budgets)
+
+    def configure(self, max_concurrency:int = None, reservations:dict = None, latency_budgets:dict = None):
+        """
+        Changes the limits. Queued requests are admitted right away if the new limits allow it.
+
+        Args:
+            max_concurrency (int, optional): Maximum requests in flight, None for no limit.
+            reservations (dict, optional): Slots kept for a priority. Defaults to none.
+            latency_budgets (dict, optional): Maximum queueing time in seconds per priority. Defaults to the current budgets.
+
+        Raises:
+            ValueError: If a priority is unknown or the reservations exceed max_concurrency."""
+
+        reservations = dict(reservations or {})
+        for level in list(reservations) + list(latency_budgets or {}):
+            _check_priority(level)
+        if max_concurrency is not None and sum(reservations.values()) >= max_concurrency:
+            raise ValueError(f'Reservations ({sum(reservations.values())}) must leave at least one of the '
+                             f'{max_concurrency} slots unreserved.')
+
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self.reservations = reservations
+            if latency_budgets is not None:
+                self.latency_budgets = dict(latency_budgets)
+            self._dispatch()
+
+    def run(self, level:str, send):
+        """
+        Calls send() once a slot is granted to the priority.
+
+        Args:
+            level (str): CRITICAL, NORMAL or BULK.
+            send (callable): Sends one request attempt.
+
+        Returns:
+            The result of send()."""
+
+        self.acquire(level)
+        try:
+            return send()
+        finally:
+            self.release(level)
+
+    def acquire(self, level:str):
+        """Waits for a slot for a request of the given priority. Pair every call with release()."""
+
+        with self._lock:
+            if not any(self._queues[queued] for queued in PRIORITIES[:PRIORITIES.index(level) + 1]) \
+                    and self._admissible(level):
+                self._grant(level, 0.0)
+                return
+            waiter = _Waiter(level)
+            self._queues[level].append(waiter)
+            self._stats['queued'][level] += 1
+
+        budget = self.latency_budgets.get(level)
+        if waiter.granted.wait(budget):
+            return
+
+        with self._lock:
+            if waiter.granted.is_set():
+                return
+            # Latency budget spent: admit above the limit.
+            self._queues[level].remove(waiter)
+            self._stats['over_limit'][level] += 1
+            self._grant(level, time.monotonic() - waiter.queued_at)
+
+    def release(self, level:str):
+        """Frees the slot of a finished request attempt."""
+
+        with self._lock:
+            self._in_flight[level] -= 1
+            self._dispatch()
+
+    def pace(self, level:str, rate_limiter):
+        """Returns the rate limiter requests of the given priority should take their tokens from."""
+
+        if rate_limiter is None or level not in self.unpaced:
+            return rate_limiter
+        return _UnpacedLimiter(rate_limiter)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the scheduler counters.
+
+        Returns:
+            dict: Per priority dictionaries of requests in flight, queued now, admitted, queued at
+                least once, overtook (admitted while lower-priority requests were queued),
+                over_limit (admitted above max_concurrency after their latency budget), and the total
+                and maximum queueing time in seconds."""
+
+        with self._lock:
+            snapshot = {name: dict(values) for name, values in self._stats.items()}
+            snapshot['in_flight'] = dict(self._in_flight)
+            snapshot['waiting'] = {level: len(queue) for level, queue in self._queues.items()}
+            snapshot['wait_seconds'] = dict(self._waited)
+            snapshot['max_wait_seconds'] = dict(self._max_wait)
+            return snapshot
+
+    def _admissible(self, level:str) -> bool:
+        # Caller must hold self._lock.
+        if self.max_concurrency is None:
+            return True
+        kept = sum(max(0, reserved - self._in_flight[other])
+                   for other, reserved in self.reservations.items() if other != level)
+        return sum(self._in_flight.values()) + kept < self.max_concurrency
+
+    def _grant(self, level:str, waited:float):
+        # Caller must hold self._lock.
+        self._in_flight[level] += 1
+        self._stats['admitted'][level] += 1
+        self._waited[level] += waited
+        self._max_wait[level] = max(self._max_wait[level], waited)
+        lower = PRIORITIES[PRIORITIES.index(level) + 1:]
+        if any(self._queues[other] for other in lower):
+            self._stats['overtook'][level] += 1
+
+    def _dispatch(self):
+        # Caller must hold self._lock. Hands free slots to queued requests, most urgent first.
+        now = time.monotonic()
+        for level in PRIORITIES:
+            queue = self._queues[level]
+            while queue and self._admissible(level):
+                waiter = queue.popleft()
+                self._grant(level, now - waiter.queued_at)
+                waiter.granted.set()
+            if queue:
+                # Less urgent requests don't overtake this one.
+                return
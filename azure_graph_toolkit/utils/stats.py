@@ -0,0 +1,21 @@
+import threading
+
+
+class Counters:
+    """Thread-safe named counters exposed through snapshot()."""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def add(self, name:str, value=1):
+        with self._lock:
+            self._values[name] = self._values[name] + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = dict.fromkeys(self._values, 0)
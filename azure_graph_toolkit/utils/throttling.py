@@ -0,0 +1,344 @@
+import asyncio
+import collections
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+import urllib3
+from .stats import Counters
+
+try:
+    import httpx
+    TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, httpx.TransportError)
+    CONNECT_ERRORS = (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)
+except ImportError:
+    TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    CONNECT_ERRORS = (requests.exceptions.ConnectTimeout,)
+
+# Statuses the Graph API returns for throttling and transient service failures.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+THROTTLING_STATUS_CODES = frozenset({429, 503})
+
+# Methods that can be sent twice with the same effect. Other requests (e.g. POST members/$ref, PATCH)
+# may have been applied when a timeout or 5xx response comes back, so they are only retried when
+# the Graph API certainly didn't process them: 429 responses and connection failures.
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+def is_connect_error(err:Exception) -> bool:
+    """
+    Checks if a transport error happened while opening the connection, before the request was sent.
+
+    Args:
+        err (Exception): The error raised by the transport.
+
+    Returns:
+        bool: True for connection refused, name resolution failures and connect timeouts."""
+
+    if isinstance(err, CONNECT_ERRORS):
+        return True
+    if not isinstance(err, requests.exceptions.ConnectionError):
+        return False
+    reason = err.args[0] if err.args else None
+    reason = getattr(reason, 'reason', reason)       # urllib3 MaxRetryError
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def parse_retry_after(value) -> float:
+    """
+    Parses a Retry-After header value.
+
+    Args:
+        value (str): Header value, either a number of seconds or an HTTP date.
+
+    Returns:
+        float: Seconds to wait, or None if the value is missing or invalid."""
+
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket rate limiter that starts slowing requests down once the Graph API throttles.
+
+    The limiter lets requests through unthrottled (or at max_rate, if set) until a throttling
+    response is reported. It then blocks every caller until the Retry-After delay has passed,
+    cuts the allowed rate to decrease_factor times the recently observed rate, and increases it
+    again by increase_step requests per second for every second of successful requests.
+    Once the rate is back above the rate observed before throttling, the limit is lifted.
+
+    Args:
+        max_rate (float, optional): Upper bound in requests per second. Defaults to None (unlimited).
+        min_rate (float, optional): Lower bound of the rate while throttled. Defaults to 1.
+        decrease_factor (float, optional): Factor applied to the rate on every throttling response. Defaults to 0.5.
+        increase_step (float, optional): Requests per second added for each second of successful requests. Defaults to 1.
+        burst (float, optional): Bucket capacity in requests. Defaults to one second worth of requests.
+    """
+
+    def __init__(self, max_rate:float = None, min_rate:float = 1.0, decrease_factor:float = 0.5,
+                 increase_step:float = 1.0, burst:float = None):
+
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._rate = max_rate
+        self._recover_rate = None
+        self._tokens = burst or max_rate or 0.0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._rate_changed = self._updated
+        self._recent = collections.deque(maxlen=100)
+        self.stats = Counters('throttle_events', 'delayed_requests', 'delay_seconds')
+
+    @property
+    def rate(self) -> float:
+        """The current allowed rate in requests per second, or None when unlimited."""
+        return self._rate
+
+    def reserve(self, paced:bool = True) -> float:
+        """
+        Takes a token for one request.
+
+        Args:
+            paced (bool, optional): If False, no token is taken and only a Retry-After block delays the request.
+                Used for urgent requests that must not queue behind the bucket. Defaults to True.
+
+        Returns:
+            float: Seconds the caller has to wait before sending the request."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            delay = max(0.0, self._blocked_until - now)
+
+            if self._rate is not None and paced:
+                capacity = self.burst or self._rate
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                self._tokens = self._tokens - 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self._rate)
+
+        if delay > 0:
+            self.stats.add('delayed_requests')
+            self.stats.add('delay_seconds', delay)
+        return delay
+
+    def on_throttle(self, retry_after:float = None):
+        """
+        Reports a throttling response and lowers the allowed rate.
+
+        Args:
+            retry_after (float, optional): The Retry-After delay returned with the response."""
+
+        with self._lock:
+            now = time.monotonic()
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+            current = self._rate if self._rate is not None else self._observed_rate(now)
+            if self._recover_rate is None:
+                self._recover_rate = current
+            self._rate = max(self.min_rate, current * self.decrease_factor)
+            self._rate_changed = max(now, self._blocked_until)
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = now
+        self.stats.add('throttle_events')
+        logging.warning('Graph API throttling: request rate lowered to %.1f/s.', self._rate)
+
+    def on_success(self):
+        """
+        Reports a successful response, slowly raising the allowed rate back."""
+
+        if self._recover_rate is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if self._rate is None or now < self._blocked_until:
+                return
+            self._rate = self._rate + self.increase_step * (now - self._rate_changed)
+            self._rate_changed = now
+            if self._rate >= self._recover_rate:
+                self._rate = self.max_rate
+                self._recover_rate = None
+                self._tokens = self.burst or self.max_rate or 0.0
+
+    def _observed_rate(self, now:float) -> float:
+        if len(self._recent) < 2 or now <= self._recent[0]:
+            return self.min_rate / self.decrease_factor
+        return len(self._recent) / (now - self._recent[0])
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(tenant_id:str = None) -> AdaptiveRateLimiter:
+    """
+    Returns the rate limiter shared by every client of a tenant.
+
+    Args:
+        tenant_id (str, optional): The tenant ID. Clients authenticated with a raw token share the None entry.
+
+    Returns:
+        AdaptiveRateLimiter: The tenant rate limiter."""
+
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(tenant_id)
+        if limiter is None:
+            limiter = _rate_limiters[tenant_id] = AdaptiveRateLimiter()
+        return limiter
+
+
+class RetryPolicy:
+    """
+    Retries throttled and transient Graph API requests.
+
+    429 and 503 responses are retried after their Retry-After delay. Other transient 5xx responses
+    and connection errors are retried with exponential backoff and full jitter. Every outcome is
+    reported to the rate limiter passed to call(), so throttling slows down all its users.
+
+    Requests that are not idempotent (see IDEMPOTENT_METHODS) are only retried on 429 responses and
+    connection failures, as the others may come back after the request was applied.
+
+    Args:
+        max_retries (int, optional): Maximum number of retries for one request. Defaults to 4.
+        backoff_base (float, optional): Backoff in seconds before the first retry. Defaults to 0.5.
+        backoff_max (float, optional): Maximum backoff in seconds. Defaults to 30.
+        max_retry_after (float, optional): Cap for Retry-After delays, in seconds. Defaults to 120.
+        retry_statuses (frozenset, optional): Response statuses to retry. Defaults to 429, 500, 502, 503 and 504.
+        retry_connection_errors (bool, optional): If True, connection errors and timeouts are retried. Defaults to True.
+    """
+
+    def __init__(self, max_retries:int = 4, backoff_base:float = 0.5, backoff_max:float = 30.0,
+                 max_retry_after:float = 120.0, retry_statuses:frozenset = RETRYABLE_STATUS_CODES,
+                 retry_connection_errors:bool = True):
+
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_connection_errors = retry_connection_errors
+        self.stats = Counters('requests', 'retries', 'throttled', 'server_errors', 'connection_errors', 'gave_up', 'not_retried')
+
+    def backoff(self, attempt:int) -> float:
+        """Returns a jittered exponential backoff delay for the given retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, send, rate_limiter:AdaptiveRateLimiter = None, idempotent:bool = True):
+        """
+        Calls send() until it returns a non retryable response or the retries are exhausted.
+
+        Args:
+            send (callable): Function sending the request and returning the response.
+            rate_limiter (AdaptiveRateLimiter, optional): Limiter to take a token from before each attempt.
+            idempotent (bool, optional): False if the request must not be applied twice, e.g. a POST. Defaults to True.
+
+        Returns:
+            requests.Response: The last response.
+
+        Raises:
+            requests.exceptions.ConnectionError: If the connection keeps failing after all retries."""
+
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                delay = rate_limiter.reserve()
+                if delay:
+                    time.sleep(delay)
+
+            try:
+                response = send()
+            except TRANSIENT_ERRORS as err:
+                delay = self._on_error(err, attempt, idempotent)
+            else:
+                delay = self._on_response(response, attempt, rate_limiter, idempotent)
+                if delay is None:
+                    return response
+
+            time.sleep(delay)
+            attempt = attempt + 1
+
+    async def acall(self, send, rate_limiter:AdaptiveRateLimiter = None, idempotent:bool = True):
+        """
+        Coroutine version of call(). send must be a coroutine function."""
+
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                delay = rate_limiter.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+
+            try:
+                response = await send()
+            except TRANSIENT_ERRORS as err:
+                delay = self._on_error(err, attempt, idempotent)
+            else:
+                delay = self._on_response(response, attempt, rate_limiter, idempotent)
+                if delay is None:
+                    return response
+
+            await asyncio.sleep(delay)
+            attempt = attempt + 1
+
+    def _on_error(self, err:Exception, attempt:int, idempotent:bool) -> float:
+        self.stats.add('requests')
+        self.stats.add('connection_errors')
+        if not self.retry_connection_errors or attempt >= self.max_retries:
+            self.stats.add('gave_up')
+            raise err
+        if not idempotent and not is_connect_error(err):
+            self.stats.add('not_retried')
+            raise err
+
+        self.stats.add('retries')
+        return self.backoff(attempt)
+
+    def _on_response(self, response, attempt:int, rate_limiter:AdaptiveRateLimiter, idempotent:bool) -> float:
+        # Returns the delay before the next attempt, or None when the response is final.
+        self.stats.add('requests')
+        status_code = response.status_code
+
+        if status_code not in self.retry_statuses:
+            if rate_limiter is not None:
+                rate_limiter.on_success()
+            return None
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            retry_after = min(retry_after, self.max_retry_after)
+
+        if status_code in THROTTLING_STATUS_CODES:
+            self.stats.add('throttled')
+            if rate_limiter is not None:
+                rate_limiter.on_throttle(retry_after)
+        else:
+            self.stats.add('server_errors')
+
+        if attempt >= self.max_retries:
+            self.stats.add('gave_up')
+            return None
+        if not idempotent and status_code != 429:
+            self.stats.add('not_retried')
+            return None
+
+        self.stats.add('retries')
+        return retry_after if retry_after is not None else self.backoff(attempt)
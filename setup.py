@@ -13,6 +13,10 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/Ivanodib/azure-graph-toolkit",
     packages=find_packages(),   
+    extras_require={
+        "async": ["httpx"],
+        "http2": ["h2"],
+    },
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
@@ -1,13 +1,46 @@
 import pytest
 from unittest.mock import patch, Mock
 import requests
-from azure_graph_toolkit.utils import decorators
+import urllib3
+import asyncio
+import threading
+import sys
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor
+from azure_graph_toolkit import config, graph_auth, models
+from azure_graph_toolkit.graph_client import GraphClient
+from azure_graph_toolkit.batch import GraphBatch
+from azure_graph_toolkit.cache import ResolutionCache, TTLCache
+from azure_graph_toolkit.mirror import DirectoryMirror
+from azure_graph_toolkit.nesting import NestedGroups
+from azure_graph_toolkit.membership import MembershipChecker
+from azure_graph_toolkit.bulk import add_users_to_group, remove_users_from_group
+from azure_graph_toolkit.emulator import GraphEmulator
+from azure_graph_toolkit.index import MembershipIndex
+from azure_graph_toolkit.group_directory import GroupDirectory
+from azure_graph_toolkit.incident import generate_password, lockdown_users
+from azure_graph_toolkit.benchmark import run_transport_benchmark
+from azure_graph_toolkit.transport import HTTP2Transport
+from azure_graph_toolkit.snapshot import TenantSnapshot, export_snapshot
+from azure_graph_toolkit.recording import RecordingTransport, ReplayTransport, generate_load, read_records
+from azure_graph_toolkit.reconcile import plan_group_membership, reconcile_group_membership
+from azure_graph_toolkit.pipeline import Journal, run_account_actions
+from azure_graph_toolkit.utils import circuit_breaker, coalescing, decorators, hedging, metrics, scheduling, throttling
 from azure_graph_toolkit.graph_utils import (
+    get_http_header,
+    get_group_by_name,
+    iter_groups,
+    iter_group_members,
+    iter_user_membership_groups,
+    is_user_member_of,
+    check_member_groups,
     get_user_from_upn,
     get_user_membership_groups,
     get_user_group_by_name,
     add_user_to_group,
     remove_user_from_group,
+    user_reset_password,
     user_revoke_sessions,
     user_set_account_status
 )
@@ -34,7 +67,7 @@ def run_generic_http_test(func_to_test, func_args, expected_info: dict, http_met
 
     mock_response = Mock()
     mock_response.json.return_value = mock_response_json
-    patch_target = f'requests.{http_method.lower()}'
+    patch_target = 'requests.Session.request'
 
     # test http exception
     if should_raise:
@@ -50,9 +83,11 @@ def run_generic_http_test(func_to_test, func_args, expected_info: dict, http_met
     else:
         mock_response.status_code = 200
 
-        with patch(patch_target, return_value=mock_response):
+        with patch(patch_target, return_value=mock_response) as mock_request:
             result = func_to_test(*func_args)
 
+        assert mock_request.call_args[0][0] == http_method.upper()
+
     assert result == expected_info
 
 def test_error_get_user_from_upn():
@@ -288,3 +323,1488 @@ def test_success_user_set_account_status():
     }
 
     run_generic_http_test(user_set_account_status, func_args, expected_info,'patch', mock_json_response, should_raise=False)
+
+
+def mock_token_response(access_token: str = 'cached-token', expires_in: int = 3599):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {'token_type': 'Bearer', 'expires_in': expires_in, 'access_token': access_token}
+    return mock_response
+
+def test_token_provider_caches_token():
+    graph_auth.clear_token_cache()
+    provider = graph_auth.TokenProvider('tenant-id', 'client-id', 'secret')
+
+    with patch('requests.post', return_value=mock_token_response()) as mock_post:
+        assert provider.get_token() == 'cached-token'
+        assert graph_auth.get_access_token('tenant-id', 'client-id', 'secret') == 'cached-token'
+
+    assert mock_post.call_count == 1
+
+def test_token_cache_is_keyed_by_client_secret():
+    graph_auth.clear_token_cache()
+    rejected = Mock(status_code=401)
+    rejected.raise_for_status.side_effect = requests.exceptions.HTTPError('401 Client Error: Unauthorized', response=rejected)
+
+    with patch('requests.post', side_effect=[mock_token_response(), rejected, mock_token_response('rotated-token')]) as mock_post:
+        assert graph_auth.TokenProvider('tenant-id', 'client-id', 'secret').get_token() == 'cached-token'
+        with pytest.raises(requests.exceptions.HTTPError):
+            graph_auth.TokenProvider('tenant-id', 'client-id', 'wrong-secret').get_token()
+        assert graph_auth.TokenProvider('tenant-id', 'client-id', 'rotated-secret').get_token() == 'rotated-token'
+        assert graph_auth.TokenProvider('tenant-id', 'client-id', 'secret').get_token() == 'cached-token'
+
+    assert mock_post.call_count == 3
+
+def test_token_provider_refetches_expired_token():
+    graph_auth.clear_token_cache()
+    provider = graph_auth.TokenProvider('tenant-id', 'client-id', 'secret', refresh_margin=0)
+
+    with patch('requests.post', return_value=mock_token_response(expires_in=0)) as mock_post:
+        provider.get_token()
+        provider.get_token()
+
+    assert mock_post.call_count == 2
+
+def test_token_provider_single_flight():
+    graph_auth.clear_token_cache()
+    provider = graph_auth.TokenProvider('tenant-id', 'client-id', 'secret')
+
+    def slow_post(*args, **kwargs):
+        time.sleep(0.05)
+        return mock_token_response()
+
+    results = []
+    with patch('requests.post', side_effect=slow_post) as mock_post:
+        threads = [threading.Thread(target=lambda: results.append(provider.get_token())) for _ in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert mock_post.call_count == 1
+    assert results == ['cached-token'] * 32
+
+def test_graph_utils_accepts_token_provider():
+    graph_auth.clear_token_cache()
+    provider = graph_auth.TokenProvider('tenant-id', 'client-id', 'secret')
+
+    with patch('requests.post', return_value=mock_token_response()):
+        header = get_http_header(provider)
+
+    assert header['Authorization'] == 'Bearer cached-token'
+
+def test_graph_client_reuses_session_and_headers():
+    with GraphClient('fake_access_token') as client:
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'id': 'user-id', 'userPrincipalName': 'user@example.com', 'jobTitle': None}
+
+        with patch.object(client.session, 'request', return_value=mock_response) as mock_request:
+            first = client.get_user_from_upn('user@example.com')
+            second = get_user_from_upn('user@example.com', client)
+
+    assert first == second == {'status_code': 200, 'id': 'user-id', 'upn': 'user@example.com', 'job_title': None}
+    assert mock_request.call_count == 2
+    headers = mock_request.call_args[1]['headers']
+    assert headers['Authorization'] == 'Bearer fake_access_token'
+    assert headers['ConsistencyLevel'] == 'eventual'
+
+def test_graph_client_refreshes_rejected_provider_token():
+    graph_auth.clear_token_cache()
+    provider = graph_auth.TokenProvider('tenant-id', 'client-id', 'secret')
+    client = GraphClient(provider)
+
+    unauthorized = Mock(status_code=401)
+    success = Mock(status_code=204)
+
+    with patch('requests.post', side_effect=[mock_token_response('old-token'), mock_token_response('new-token')]), \
+         patch.object(client.session, 'request', side_effect=[unauthorized, success]) as mock_request:
+        result = client.user_revoke_sessions('user@example.com')
+
+    assert result['status_code'] == 204
+    assert mock_request.call_args[1]['headers']['Authorization'] == 'Bearer new-token'
+
+def mock_page(groups, next_link=None, count=None):
+    page = {'value': [{'displayName': name, 'id': f'{name}-id'} for name in groups]}
+    if next_link:
+        page['@odata.nextLink'] = next_link
+    if count is not None:
+        page['@odata.count'] = count
+    mock_response = Mock(status_code=200)
+    mock_response.json.return_value = page
+    return mock_response
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_iter_user_membership_groups_follows_next_link(prefetch):
+    client = GraphClient('fake_access_token')
+    pages = [mock_page(['Group-A', 'Group-B'], next_link='https://next/1'), mock_page(['Group-C'])]
+
+    with patch.object(client.session, 'request', side_effect=pages) as mock_request:
+        groups = list(iter_user_membership_groups('user@example.com', client, page_size=2, prefetch=prefetch))
+
+    assert [group['displayName'] for group in groups] == ['Group-A', 'Group-B', 'Group-C']
+    assert mock_request.call_args_list[0][1]['params']['$top'] == 2
+    assert mock_request.call_args_list[1][0][1] == 'https://next/1'
+
+def test_iter_groups_rejects_invalid_page_size():
+    with pytest.raises(ValueError):
+        next(iter_groups('fake_access_token', page_size=1000))
+
+def test_get_group_by_name_counts_matches_across_pages():
+    client = GraphClient('fake_access_token')
+    pages = [mock_page(['Group-A1'], next_link='https://next/1', count=2), mock_page(['Group-A2'])]
+
+    with patch.object(client.session, 'request', side_effect=pages):
+        result = get_group_by_name('Group-A', client)
+
+    assert result == {'status_code': 200, 'message': 'Too much AAD group that contains Group-A found. Try another name.'}
+
+def test_is_user_member_of_stops_at_first_match():
+    client = GraphClient('fake_access_token')
+    pages = [mock_page(['Group-A'], next_link='https://next/1'), mock_page(['Group-B'])]
+
+    with patch.object(client.session, 'request', side_effect=pages) as mock_request:
+        assert is_user_member_of('user@example.com', 'Group-A', client) is True
+
+    assert mock_request.call_count == 1
+
+def mock_batch_response(responses):
+    mock_response = Mock(status_code=200)
+    mock_response.json.return_value = {'responses': responses}
+    return mock_response
+
+def test_graph_batch_splits_payloads_of_20():
+    client = GraphClient('fake_access_token')
+    batch = GraphBatch(client)
+    for index in range(25):
+        batch.user_revoke_sessions(f'user{index}@example.com')
+
+    def batch_post(method, url, json=None, **kwargs):
+        return mock_batch_response([{'id': request['id'], 'status': 200, 'body': {'value': True}} for request in json['requests']])
+
+    with patch.object(client.session, 'request', side_effect=batch_post) as mock_request:
+        results = batch.execute()
+
+    assert mock_request.call_count == 2
+    assert [len(call[1]['json']['requests']) for call in mock_request.call_args_list] == [20, 5]
+    assert results['1'] == {'status_code': 200, 'message': 'User user0@example.com sessions have been revoked successfully.'}
+
+def test_graph_batch_retries_throttled_and_idempotent_failed_requests_only():
+    client = GraphClient('fake_access_token')
+    batch = GraphBatch(client, max_retry_after=5)
+    disable_id = batch.user_set_account_status('user@example.com', False)
+    revoke_id = batch.user_revoke_sessions('user@example.com', depends_on=[disable_id])
+    missing_id = batch.user_revoke_sessions('missing@example.com')
+    failed_post_id = batch.user_revoke_sessions('other@example.com')
+    read_id = batch.add('GET', '/users/other@example.com')
+
+    first_round = mock_batch_response([
+        {'id': disable_id, 'status': 429, 'headers': {'retry-after': '2'}, 'body': {'error': {'message': 'Too many requests'}}},
+        {'id': revoke_id, 'status': 424, 'body': {'error': {'message': 'Failed dependency'}}},
+        {'id': missing_id, 'status': 404, 'body': {'error': {'message': 'User not found'}}},
+        {'id': failed_post_id, 'status': 503, 'headers': {'Retry-After': '30'}, 'body': {'error': {'message': 'Service unavailable'}}},
+        {'id': read_id, 'status': 503, 'headers': {'Retry-After': 'Wed, 21 Oct 2099 07:28:00 GMT'}, 'body': {'error': {'message': 'Service unavailable'}}}])
+    second_round = mock_batch_response([
+        {'id': disable_id, 'status': 204},
+        {'id': revoke_id, 'status': 200, 'body': {'value': True}},
+        {'id': read_id, 'status': 200, 'body': {'id': 'other-id'}}])
+
+    with patch.object(client.session, 'request', side_effect=[first_round, second_round]) as mock_request, \
+         patch('azure_graph_toolkit.batch.time.sleep') as mock_sleep:
+        results = batch.execute()
+
+    mock_sleep.assert_called_once_with(5)       # the HTTP-date Retry-After, capped by max_retry_after
+    retried = mock_request.call_args_list[1][1]['json']['requests']
+    assert [request['id'] for request in retried] == [disable_id, revoke_id, read_id]
+    assert retried[1]['dependsOn'] == [disable_id]
+    assert results[disable_id] == {'status_code': 204, 'message': 'User account user@example.com has been disabled successfully.'}
+    assert results[missing_id] == {'status_code': 404, 'message': 'User not found'}
+    assert results[failed_post_id] == {'status_code': 503, 'message': 'Service unavailable'}
+
+def test_aio_add_user_to_group_resolves_concurrently():
+    httpx = pytest.importorskip('httpx')
+    from azure_graph_toolkit import aio
+
+    in_flight = []
+    max_in_flight = []
+
+    async def handler(request):
+        in_flight.append(request)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(request)
+
+        if request.method == 'POST':
+            return httpx.Response(204)
+        if '/groups' in request.url.path:
+            return httpx.Response(200, json={'@odata.count': 1, 'value': [{'displayName': 'Group-A', 'id': 'group-id'}]})
+        return httpx.Response(200, json={'id': 'user-id', 'userPrincipalName': 'user@example.com', 'jobTitle': None})
+
+    async def run():
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with aio.AsyncGraphClient('fake_access_token', http_client=http_client) as client:
+            return await client.add_user_to_group('user@example.com', 'Group-A')
+
+    result = asyncio.run(run())
+
+    assert result == {'status_code': 204, 'message': 'User user@example.com added to AAD group Group-A successfully.'}
+    assert max(max_in_flight) == 2
+
+def test_aio_bounded_concurrency_and_error_contract():
+    httpx = pytest.importorskip('httpx')
+    from azure_graph_toolkit import aio
+
+    in_flight = []
+    max_in_flight = []
+
+    async def handler(request):
+        in_flight.append(request)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(request)
+        return httpx.Response(404, json={'error': {'code': 'Request_ResourceNotFound', 'message': 'User not found'}})
+
+    async def run():
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = aio.AsyncGraphClient('fake_access_token', max_concurrency=3, http_client=http_client)
+        return await asyncio.gather(*(aio.user_revoke_sessions(f'user{index}@example.com', client) for index in range(10)))
+
+    results = asyncio.run(run())
+
+    assert results == [{'status_code': 404, 'message': 'User not found'}] * 10
+    assert max(max_in_flight) == 3
+
+def test_graph_client_retries_throttled_request_after_retry_after():
+    limiter = throttling.AdaptiveRateLimiter()
+    policy = throttling.RetryPolicy()
+    client = GraphClient('fake_access_token', retry_policy=policy, rate_limiter=limiter)
+
+    throttled = Mock(status_code=429, headers={'Retry-After': '3'})
+    success = Mock(status_code=204)
+
+    with patch.object(client.session, 'request', side_effect=[throttled, success]) as mock_request, \
+         patch('azure_graph_toolkit.utils.throttling.time.sleep') as mock_sleep:
+        result = client.user_set_account_status('user@example.com', False)
+
+    assert result['status_code'] == 204
+    assert mock_request.call_count == 2
+    assert 3.0 in [call[0][0] for call in mock_sleep.call_args_list]
+    assert policy.stats.snapshot()['throttled'] == 1
+    assert limiter.stats.snapshot()['throttle_events'] == 1
+    assert limiter.rate is not None
+
+def test_retry_on_throttling_gives_up_after_budget():
+    policy = throttling.RetryPolicy(max_retries=2)
+    calls = []
+
+    @decorators.retry_on_throttling(policy)
+    def send():
+        calls.append(1)
+        raise requests.exceptions.ConnectionError('connection reset')
+
+    with patch('azure_graph_toolkit.utils.throttling.time.sleep'), pytest.raises(requests.exceptions.ConnectionError):
+        send()
+
+    assert len(calls) == 3
+    assert policy.stats.snapshot()['gave_up'] == 1
+
+def test_retry_policy_retries_non_idempotent_requests_only_when_not_processed():
+    policy = throttling.RetryPolicy(max_retries=3)
+    client = GraphClient('fake_access_token', retry_policy=policy, rate_limiter=throttling.AdaptiveRateLimiter())
+    url = f'{config.GRAPH_BASE_URL_GROUP}/group-id/members/$ref'
+    timeout = requests.exceptions.ReadTimeout('read timed out')
+    refused = requests.exceptions.ConnectionError(urllib3.exceptions.MaxRetryError(None, url, urllib3.exceptions.NewConnectionError(None, 'refused')))
+
+    with patch.object(client.session, 'request', side_effect=[timeout]) as post_timeout, \
+         patch('azure_graph_toolkit.utils.throttling.time.sleep'), pytest.raises(requests.exceptions.ReadTimeout):
+        client.post(url)
+    with patch.object(client.session, 'request', side_effect=[Mock(status_code=504, headers={}), Mock(status_code=204)]):
+        server_error = client.post(url)
+    with patch.object(client.session, 'request', side_effect=[refused, Mock(status_code=429, headers={'Retry-After': '0'}), Mock(status_code=204)]) as post_retried, \
+         patch('azure_graph_toolkit.utils.throttling.time.sleep'):
+        retried = client.post(url)
+    with patch.object(client.session, 'request', side_effect=[timeout, Mock(status_code=504, headers={}), Mock(status_code=200)]) as get_retried, \
+         patch('azure_graph_toolkit.utils.throttling.time.sleep'):
+        read = client.get(f'{config.GRAPH_BASE_URL_USER}/user-id')
+
+    assert post_timeout.call_count == 1
+    assert server_error.status_code == 504
+    assert (retried.status_code, post_retried.call_count) == (204, 3)
+    assert (read.status_code, get_retried.call_count) == (200, 3)
+    assert policy.stats.snapshot()['not_retried'] == 2
+
+def test_adaptive_rate_limiter_delays_after_throttle():
+    limiter = throttling.AdaptiveRateLimiter(min_rate=10)
+    assert limiter.reserve() == 0
+
+    limiter.on_throttle(retry_after=1)
+    assert limiter.reserve() > 0.9
+
+def test_resolution_cache_reuses_group_lookup_for_composite_operations():
+    cache = ResolutionCache()
+    client = GraphClient('fake_access_token', resolution_cache=cache)
+
+    with patch('azure_graph_toolkit.graph_utils.get_user_from_upn') as mock_get_user_from_upn, \
+         patch('azure_graph_toolkit.graph_utils.get_group_by_name') as mock_get_group_by_name, \
+         patch.object(client.session, 'request', return_value=Mock(status_code=204)):
+
+        mock_get_user_from_upn.side_effect = lambda upn, token: {'status_code': 200, 'id': f'{upn}-id'}
+        mock_get_group_by_name.return_value = {'status_code': 200, 'group_id': 'group-id', 'group_name': 'Group-A'}
+
+        for index in range(5):
+            assert client.add_user_to_group(f'user{index}@example.com', 'Group-A')['status_code'] == 204
+
+    assert mock_get_group_by_name.call_count == 1
+    assert mock_get_user_from_upn.call_count == 5
+    assert cache.stats()['hits'] == 4
+
+def test_resolution_cache_negative_entries_and_errors():
+    cache = ResolutionCache(negative_ttl=60)
+    not_found = Mock(return_value={'status_code': 404, 'message': 'not found'})
+    throttled = Mock(return_value={'status_code': 429, 'message': 'throttled'})
+
+    cache.resolve('user', 'missing@example.com', not_found)
+    cache.resolve('user', 'missing@example.com', not_found)
+    cache.resolve('user', 'busy@example.com', throttled)
+    cache.resolve('user', 'busy@example.com', throttled)
+
+    assert not_found.call_count == 1
+    assert throttled.call_count == 2
+    assert cache.stats()['negative_hits'] == 1
+
+    cache.invalidate_user('missing@example.com')
+    cache.resolve('user', 'missing@example.com', not_found)
+    assert not_found.call_count == 2
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats.snapshot()['evictions'] == 1
+
+def mock_delta_page(items, delta_link=None, next_link=None):
+    page = {'value': items}
+    if delta_link:
+        page['@odata.deltaLink'] = delta_link
+    if next_link:
+        page['@odata.nextLink'] = next_link
+    mock_response = Mock(status_code=200)
+    mock_response.json.return_value = page
+    return mock_response
+
+def test_directory_mirror_bootstrap_and_incremental_sync():
+    client = GraphClient('fake_access_token')
+    mirror = DirectoryMirror(client)
+
+    bootstrap = [
+        mock_delta_page([{'id': 'u1', 'userPrincipalName': 'User@example.com'}], next_link='https://users/next'),
+        mock_delta_page([{'id': 'u2', 'userPrincipalName': 'other@example.com'}], delta_link='https://users/delta-1'),
+        mock_delta_page([{'id': 'g1', 'displayName': 'Group-A', 'members@delta': [{'id': 'u1'}]},
+                         {'id': 'g2', 'displayName': 'Group-B', 'members@delta': [{'id': 'u1'}, {'id': 'u2'}]}],
+                        delta_link='https://groups/delta-1')]
+    incremental = [
+        mock_delta_page([], delta_link='https://users/delta-2'),
+        mock_delta_page([{'id': 'g2', 'members@delta': [{'id': 'u1', '@removed': {'reason': 'deleted'}}]}],
+                        delta_link='https://groups/delta-2')]
+
+    with patch.object(client.session, 'request', side_effect=bootstrap + incremental) as mock_request:
+        assert mirror.sync() == {'users': 2, 'groups': 2}
+        assert mirror.is_user_member_of('user@example.com', 'Group-B') is True
+
+        assert mirror.sync() == {'users': 0, 'groups': 1}
+
+    assert mock_request.call_args_list[3][0][1] == 'https://users/delta-1'
+    assert mirror.is_user_member_of('user@example.com', 'Group-B') is False
+    assert mirror.get_user_membership_groups('user@example.com') == {'status_code': 200, 'groups': [{'displayName': 'Group-A', 'id': 'g1'}]}
+    assert mirror.delta_links == {'users': 'https://users/delta-2', 'groups': 'https://groups/delta-2'}
+
+def test_directory_mirror_falls_back_when_stale():
+    mirror = DirectoryMirror('fake_access_token', max_staleness=0)
+
+    with patch('azure_graph_toolkit.graph_utils.is_user_member_of', return_value=True) as mock_live:
+        assert mirror.is_user_member_of('user@example.com', 'Group-A') is True
+
+    mock_live.assert_called_once_with('user@example.com', 'Group-A', 'fake_access_token')
+
+    mirror.fallback = False
+    with pytest.raises(RuntimeError):
+        mirror.is_user_member_of('user@example.com', 'Group-A')
+
+def test_check_member_groups_chunks_group_ids():
+    client = GraphClient('fake_access_token')
+    group_ids = [f'group-{index}' for index in range(25)]
+
+    def check(method, url, json=None, **kwargs):
+        mock_response = Mock(status_code=200)
+        mock_response.json.return_value = {'value': [group_id for group_id in json['groupIds'] if group_id in ('group-0', 'group-24')]}
+        return mock_response
+
+    with patch.object(client.session, 'request', side_effect=check) as mock_request:
+        result = check_member_groups('user@example.com', group_ids, client)
+
+    assert mock_request.call_count == 2
+    assert mock_request.call_args[0][1].endswith('/users/user@example.com/checkMemberGroups')
+    assert [group_id for group_id, member in result['groups'].items() if member] == ['group-0', 'group-24']
+
+def test_membership_checker_resolves_names_once_and_batches_users():
+    client = GraphClient('fake_access_token')
+
+    with patch('azure_graph_toolkit.graph_utils.get_group_by_name') as mock_get_group_by_name:
+        mock_get_group_by_name.side_effect = lambda name, token: {'status_code': 200, 'group_id': f'{name}-id', 'group_name': name}
+        checker = MembershipChecker(client, group_names=['Group-A', 'Group-B'])
+
+        def batch_post(method, url, json=None, **kwargs):
+            responses = [{'id': request['id'], 'status': 200, 'body': {'value': ['Group-A-id'] if request['url'].startswith('/users/user0') else []}}
+                         for request in json['requests']]
+            return mock_batch_response(responses)
+
+        with patch.object(client.session, 'request', side_effect=batch_post) as mock_request:
+            results = checker.check_users([f'user{index}@example.com' for index in range(30)])
+
+    assert mock_get_group_by_name.call_count == 2
+    assert mock_request.call_count == 2
+    assert results['user0@example.com'] == {'status_code': 200, 'groups': {'Group-A': True, 'Group-B': False}}
+    assert results['user29@example.com'] == {'status_code': 200, 'groups': {'Group-A': False, 'Group-B': False}}
+
+def test_membership_checker_is_member_reports_throttled_checks_as_errors():
+    client = GraphClient('fake_access_token', retry_policy=throttling.RetryPolicy(max_retries=0))
+    checker = MembershipChecker(client, group_ids={'admins': 'group-id'})
+
+    def answer(status, body):
+        response = requests.Response()
+        response.status_code = status
+        response.headers['Retry-After'] = '0'
+        response._content = json.dumps(body).encode()
+        return response
+
+    throttled = answer(429, {'error': {'code': 'TooManyRequests', 'message': 'Too many requests'}})
+    with patch.object(client.session, 'request', side_effect=[throttled, answer(200, {'value': ['group-id']})]):
+        failed = checker.is_member('user@example.com', 'admins')
+        member = checker.is_member('user@example.com', 'admins')
+
+    assert failed is not False and failed['status_code'] == 429
+    assert member is True
+
+def bulk_graph_handler(member_ids, patch_status=204):
+    """Returns a fake Graph API for the bulk membership tests, resolving userN@example.com to id-N."""
+
+    def handler(method, url, json=None, **kwargs):
+        if method == 'PATCH':
+            return Mock(status_code=patch_status, headers={})
+
+        responses = []
+        for request in json['requests']:
+            if request['url'].startswith('/users/missing'):
+                responses.append({'id': request['id'], 'status': 404, 'body': {'error': {'message': 'User not found'}}})
+            elif request['url'].startswith('/users/'):
+                upn = request['url'].split('/')[2].split('?')[0]
+                responses.append({'id': request['id'], 'status': 200, 'body': {'id': 'id-' + upn[4:upn.index('@')]}})
+            elif request['method'] == 'GET':
+                value = [{'id': member_id} for member_id in member_ids if f"'{member_id}'" in request['url']]
+                responses.append({'id': request['id'], 'status': 200, 'body': {'value': value}})
+            else:
+                responses.append({'id': request['id'], 'status': 204})
+        return mock_batch_response(responses)
+
+    return handler
+
+def test_add_users_to_group_skips_members_and_chunks_writes():
+    client = GraphClient('fake_access_token')
+    users = [f'user{index}@example.com' for index in range(45)] + ['missing@example.com']
+
+    with patch.object(client.session, 'request', side_effect=bulk_graph_handler({'id-0', 'id-1'})) as mock_request:
+        result = add_users_to_group(users, 'Group-A', client, group_id='group-id')
+
+    patches = [call for call in mock_request.call_args_list if call[0][0] == 'PATCH']
+    assert [len(call[1]['json']['members@odata.bind']) for call in patches] == [20, 20, 3]
+    assert result['results']['user0@example.com']['message'] == 'User user0@example.com is already a member of AAD group Group-A.'
+    assert result['results']['user2@example.com'] == {'status_code': 204, 'message': 'User user2@example.com added to AAD group Group-A successfully.'}
+    assert result['results']['missing@example.com'] == {'status_code': 404, 'message': 'User not found'}
+
+def test_add_users_to_group_falls_back_to_single_adds_on_failed_patch():
+    client = GraphClient('fake_access_token')
+
+    with patch.object(client.session, 'request', side_effect=bulk_graph_handler(set(), patch_status=400)):
+        result = add_users_to_group(['user1@example.com', 'user2@example.com'], 'Group-A', client, group_id='group-id')
+
+    assert result['results']['user1@example.com'] == {'status_code': 204, 'message': 'User user1@example.com added to AAD group Group-A successfully.'}
+
+def test_remove_users_from_group_skips_non_members():
+    client = GraphClient('fake_access_token')
+
+    with patch.object(client.session, 'request', side_effect=bulk_graph_handler({'id-1'})) as mock_request:
+        result = remove_users_from_group(['user1@example.com', 'user2@example.com'], 'Group-A', client, group_id='group-id')
+
+    removals = [request for call in mock_request.call_args_list for request in call[1]['json']['requests'] if request['method'] == 'DELETE']
+    assert [request['url'] for request in removals] == ['/groups/group-id/members/id-1/$ref']
+    assert result['results']['user1@example.com'] == {'status_code': 204, 'message': 'User user1@example.com removed from AAD group Group-A successfully.'}
+    assert result['results']['user2@example.com'] == {'status_code': 200, 'message': 'User user2@example.com is not a member of AAD group Group-A.'}
+
+def test_emulator_serves_lookups_and_restores_base_urls():
+    graph_base_url = config.GRAPH_BASE_URL
+
+    with GraphEmulator(users=100, groups=10, memberships_per_user=3, page_size=2) as emulator:
+        assert config.GRAPH_BASE_URL_USER == f'{emulator.graph_base_url}/users'
+        client = GraphClient(graph_auth.get_access_token('tenant', 'client', 'secret'))
+
+        user = get_user_from_upn('user7@contoso.test', client)
+        groups = get_user_membership_groups('user7@contoso.test', client)
+        missing = get_user_from_upn('user100@contoso.test', client)
+        client.close()
+
+    assert user == {'status_code': 200, 'id': '00000000-0000-4000-8000-000000000007', 'upn': 'user7@contoso.test', 'job_title': 'Engineer'}
+    assert [group['displayName'] for group in groups['groups']] == ['Group-0000007', 'Group-0000008', 'Group-0000009']
+    assert missing['status_code'] == 404
+    assert emulator.stats.snapshot()['connections'] == 2
+    assert config.GRAPH_BASE_URL == graph_base_url
+
+def test_emulator_throttling_is_retried():
+    retry_policy = throttling.RetryPolicy(max_retries=10, backoff_base=0.001)
+
+    with GraphEmulator(users=10, groups=5, throttle_rate=0.5, retry_after=0.01) as emulator:
+        client = GraphClient('fake_access_token', retry_policy=retry_policy, rate_limiter=throttling.AdaptiveRateLimiter())
+        results = [get_user_from_upn(f'user{index}@contoso.test', client)['status_code'] for index in range(10)]
+        client.close()
+
+    assert results == [200] * 10
+    assert emulator.stats.snapshot()['throttled'] > 0
+
+def test_emulator_membership_writes_show_up_in_delta():
+    with GraphEmulator(users=50, groups=10, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        mirror = DirectoryMirror(client)
+        mirror.sync()
+
+        added = add_user_to_group('user1@contoso.test', 'Group-0000005', client)
+        duplicate = add_user_to_group('user1@contoso.test', 'Group-0000005', client)
+        changes = mirror.sync()
+        client.close()
+
+    assert added['status_code'] == 204
+    assert duplicate['status_code'] == 400
+    assert changes == {'users': 0, 'groups': 1}
+    assert mirror.is_user_member_of('user1@contoso.test', 'Group-0000005')
+
+def test_metrics_disabled_records_nothing():
+    recorder = metrics.enable()
+    metrics.disable()
+
+    with GraphEmulator(users=10, groups=5):
+        client = GraphClient('fake_access_token')
+        get_user_from_upn('user1@contoso.test', client)
+        client.close()
+
+    assert metrics.get_recorder() is None
+    assert recorder.snapshot() == {'operations': [], 'requests': [], 'coalesced': []}
+
+def test_metrics_record_sub_calls_retries_and_statuses():
+    events = []
+    recorder = metrics.enable(metrics.MetricsRecorder(callback=events.append))
+    retry_policy = throttling.RetryPolicy(max_retries=10, backoff_base=0.001)
+
+    try:
+        with GraphEmulator(users=10, groups=10, memberships_per_user=1, throttle_rate=0.3, retry_after=0.01) as emulator:
+            client = GraphClient('fake_access_token', retry_policy=retry_policy, rate_limiter=throttling.AdaptiveRateLimiter())
+            for index in range(5):
+                add_user_to_group(f'user{index}@contoso.test', 'Group-0000009', client)
+            client.close()
+    finally:
+        metrics.disable()
+
+    snapshot = recorder.snapshot()
+    operations = {(entry['operation'], entry['parent']): entry for entry in snapshot['operations']}
+    assert operations[('add_user_to_group', '')]['statuses'] == {'204': 5}
+    assert operations[('get_user_from_upn', 'add_user_to_group')]['count'] == 5
+    assert operations[('get_group_by_name', 'add_user_to_group')]['count'] == 5
+
+    requests_ = {(entry['operation'], entry['endpoint'], entry['method']): entry for entry in snapshot['requests']}
+    writes = requests_[('add_user_to_group', '/groups/{id}/members/$ref', 'POST')]
+    assert writes['statuses'].get('204') == 5
+    assert writes['bytes_sent'] > 0
+    throttled = sum(entry['statuses'].get('429', 0) for entry in snapshot['requests'])
+    assert throttled == emulator.stats.snapshot()['throttled'] > 0
+    assert sum(entry['retries'] for entry in snapshot['requests']) == throttled
+    assert len([event for event in events if event['type'] == 'operation']) == 15
+
+def test_metrics_record_prefetched_pages_under_the_calling_operation():
+    @decorators.handle_http_exceptions
+    def list_groups(client):
+        return {'status_code': 200, 'groups': list(iter_groups(client, page_size=5, prefetch=True))}
+
+    recorder = metrics.enable()
+    try:
+        with GraphEmulator(users=10, groups=25):
+            client = GraphClient('fake_access_token')
+            result = list_groups(client)
+            client.close()
+    finally:
+        metrics.disable()
+
+    requests_ = {(entry['operation'], entry['endpoint']): entry for entry in recorder.snapshot()['requests']}
+    assert len(result['groups']) == 25
+    assert list(requests_) == [('list_groups', '/groups')]
+    assert requests_[('list_groups', '/groups')]['count'] == 5
+
+def test_metrics_prometheus_export():
+    recorder = metrics.MetricsRecorder(buckets=(0.1, 1.0))
+    recorder.record_operation('get_user_from_upn', '', 0.05, '200')
+    recorder.record_request('get_user_from_upn', 'GET', 'https://graph.microsoft.com/v1.0/users/mario.rossi@domain.com', 0.5, '200', 0, 120)
+
+    text = recorder.to_prometheus()
+
+    assert 'graph_operation_duration_seconds_bucket{operation="get_user_from_upn",parent="",le="0.1"} 1' in text
+    assert 'graph_request_duration_seconds_bucket{operation="get_user_from_upn",endpoint="/users/{id}",method="GET",le="0.1"} 0' in text
+    assert 'graph_request_duration_seconds_count{operation="get_user_from_upn",endpoint="/users/{id}",method="GET"} 1' in text
+    assert 'graph_response_bytes_received_total{operation="get_user_from_upn",endpoint="/users/{id}",method="GET"} 120' in text
+
+def test_pipeline_runs_actions_from_csv_and_journals_results(tmp_path):
+    source = tmp_path / 'leavers.csv'
+    source.write_text('upn,password\nuser1@contoso.test,N3w-Passw0rd\nuser2@contoso.test,\nuser99@contoso.test,N3w-Passw0rd\n')
+    journal_path = tmp_path / 'journal.jsonl'
+
+    with GraphEmulator(users=10, groups=5) as emulator:
+        with GraphClient('fake_access_token') as client:
+            summary = run_account_actions(str(source), ['disable', 'reset_password'], client, str(journal_path), max_workers=2)
+        disabled = emulator.directory.user(1)['accountEnabled']
+
+    entries = {entry['upn']: entry for entry in map(json.loads, journal_path.read_text().splitlines())}
+    assert summary == {'processed': 3, 'skipped': 0, 'succeeded': 1, 'failed': 2}
+    assert disabled is False
+    assert entries['user1@contoso.test']['ok'] is True
+    assert entries['user2@contoso.test']['results']['reset_password'] == {'status_code': 400, 'message': 'No password given for user user2@contoso.test.'}
+    assert entries['user99@contoso.test']['results']['disable']['status_code'] == 404
+    assert 'N3w-Passw0rd' not in journal_path.read_text()
+
+def test_pipeline_resumes_from_journal_after_crash(tmp_path):
+    upns = [f'user{index}@contoso.test' for index in range(8)]
+    journal_path = str(tmp_path / 'journal.jsonl')
+
+    def crashing_source():
+        yield from upns[:5]
+        raise RuntimeError('worker killed')
+
+    with GraphEmulator(users=10, groups=5) as emulator:
+        with GraphClient('fake_access_token') as client:
+            with pytest.raises(RuntimeError):
+                run_account_actions(crashing_source(), ['revoke_sessions'], client, journal_path, max_workers=2)
+            summary = run_account_actions(upns, ['revoke_sessions'], client, journal_path, max_workers=2)
+        revoke_calls = emulator.stats.snapshot()['requests']
+
+    assert summary == {'processed': 3, 'skipped': 5, 'succeeded': 3, 'failed': 0}
+    assert revoke_calls == 8
+
+def test_journal_keeps_watermark_and_gaps(tmp_path):
+    journal_path = tmp_path / 'journal.jsonl'
+    journal_path.write_text('\n'.join(json.dumps({'seq': seq}) for seq in (1, 0, 2, 5, 4)) + '\n{"seq": 7')
+
+    journal = Journal(str(journal_path))
+    journal.close()
+
+    assert journal.watermark == 3
+    assert [seq for seq in range(8) if journal.is_done(seq)] == [0, 1, 2, 4, 5]
+
+def build_membership_index():
+    index = MembershipIndex()
+    index.add_user_groups('u1', [{'displayName': 'Group-A', 'id': 'g1'}, {'displayName': 'Group-B', 'id': 'g2'}], upn='Mario.Rossi@domain.com')
+    index.add_user_groups('u2', [{'displayName': 'Group-A', 'id': 'g1'}])
+    for user in range(3, 20):
+        index.add(f'u{user}', 'g2', display_name='Group-B')
+    return index
+
+def test_membership_index_lookups():
+    index = build_membership_index()
+    index.remove('u2', 'g1')
+
+    assert index.is_member('u1', 'g1') is True
+    assert index.is_member('mario.rossi@domain.com', 'g2') is True
+    assert index.is_member('u2', 'g1') is False
+    assert index.is_member('unknown', 'g1') is False
+    assert index.has_key(index.user_key('u1'), index.group_key('g2')) is True
+    assert index.groups_of('u1') == ['g1', 'g2']
+    assert index.members_of('g1') == ['u1']
+    assert index.member_count('g2') == 18
+    assert index.get_user_membership_groups('u1') == {'status_code': 200, 'groups': [{'displayName': 'Group-A', 'id': 'g1'}, {'displayName': 'Group-B', 'id': 'g2'}]}
+    assert index.get_user_membership_groups('u2')['status_code'] == 404
+
+def test_membership_index_set_operations():
+    index = build_membership_index()
+
+    assert index.intersection('g1', 'g2') == ['u1']
+    assert index.difference('g1', 'g2') == ['u2']
+    assert index.difference('g2', 'g1') == [f'u{user}' for user in range(3, 20)]
+    assert sorted(index.union('g1', 'g2')) == sorted(['u1', 'u2'] + [f'u{user}' for user in range(3, 20)])
+
+def test_membership_index_save_and_load(tmp_path):
+    index = build_membership_index()
+    path = str(tmp_path / 'memberships.idx')
+    index.save(path)
+
+    loaded = MembershipIndex.load(path)
+
+    assert len(loaded) == len(index) == 20
+    assert loaded.groups_of('mario.rossi@domain.com') == ['g1', 'g2']
+    assert loaded.members_of('g2') == index.members_of('g2')
+    assert loaded.get_user_membership_groups('u2') == index.get_user_membership_groups('u2')
+    with pytest.raises(ValueError):
+        (tmp_path / 'other.bin').write_bytes(b'not an index')
+        MembershipIndex.load(str(tmp_path / 'other.bin'))
+
+def test_concurrent_identical_reads_share_one_request():
+    coalescer = coalescing.RequestCoalescer()
+
+    with GraphEmulator(users=10, groups=5, latency=0.2) as emulator:
+        client = GraphClient('fake_access_token', coalescer=coalescer)
+        barrier = threading.Barrier(8)
+
+        def lookup(results):
+            barrier.wait()
+            results.append(get_user_from_upn('user3@contoso.test', client))
+
+        results = []
+        threads = [threading.Thread(target=lookup, args=(results,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other_token = get_user_from_upn('user3@contoso.test', GraphClient('other_access_token', coalescer=coalescer))
+        client.close()
+
+    assert len(results) == 8 and all(result == results[0] for result in results)
+    assert results[0]['upn'] == 'user3@contoso.test'
+    assert other_token == results[0]
+    assert emulator.stats.snapshot()['requests'] == 2
+    assert coalescer.stats.snapshot() == {'executed': 2, 'coalesced': 7}
+
+def test_coalescer_shares_errors_and_skips_writes():
+    coalescer = coalescing.RequestCoalescer()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def failing_send():
+        calls.append(1)
+        started.set()
+        release.wait()
+        raise requests.exceptions.ConnectionError('connection reset')
+
+    key = coalescing.request_key('GET', 'https://graph.microsoft.com/v1.0/users/x', 'token')
+    errors = []
+
+    def follower():
+        started.wait()
+        try:
+            coalescer.call(key, failing_send)
+        except requests.exceptions.ConnectionError as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        threading.Timer(0.1, release.set).start()
+        coalescer.call(key, failing_send)
+    thread.join()
+
+    assert len(calls) == 1 and len(errors) == 1
+    assert coalescing.request_key('PATCH', 'https://graph.microsoft.com/v1.0/users/x', 'token') is None
+    assert coalescing.request_key('GET', 'https://graph.microsoft.com/v1.0/users/x', 'a') != key
+
+def test_async_concurrent_identical_reads_share_one_request():
+    pytest.importorskip('httpx')
+    from azure_graph_toolkit import aio
+
+    async def run(emulator):
+        async with aio.AsyncGraphClient('fake_access_token') as client:
+            results = await asyncio.gather(*[client.get_user_membership_groups('user2@contoso.test') for _ in range(5)])
+            return results, client.coalescer.stats.snapshot()
+
+    with GraphEmulator(users=10, groups=5, latency=0.1) as emulator:
+        results, stats = asyncio.run(run(emulator))
+
+    assert all(result == results[0] for result in results)
+    assert results[0]['status_code'] == 200
+    assert stats == {'executed': 1, 'coalesced': 4}
+    assert emulator.stats.snapshot()['requests'] == 1
+
+def test_async_operations_accept_access_tokens_and_providers():
+    pytest.importorskip('httpx')
+    from azure_graph_toolkit import aio
+    provider = Mock(get_token=Mock(return_value='fake_access_token'))
+
+    async def run():
+        user = await aio.get_user_from_upn('user2@contoso.test', 'fake_access_token')
+        groups = [group async for group in aio.iter_user_membership_groups('user2@contoso.test', provider)]
+        member = await aio.is_user_member_of('user2@contoso.test', groups[0]['displayName'], client=provider)
+        return user, groups, member
+
+    with GraphEmulator(users=10, groups=5, memberships_per_user=2):
+        user, groups, member = asyncio.run(run())
+
+    assert user['upn'] == 'user2@contoso.test'
+    assert len(groups) == 2 and member is True
+    assert provider.get_token.call_count == 2
+
+def test_async_operations_return_operation_results():
+    pytest.importorskip('httpx')
+    from azure_graph_toolkit import aio
+
+    async def run():
+        group = await aio.get_group_by_name('Group-0000003', 'fake_access_token')
+        membership = await aio.get_user_membership_groups('user2@contoso.test', 'fake_access_token')
+        added = await aio.add_user_to_group('user2@contoso.test', 'Group-0000007', 'fake_access_token')
+        return group, membership, added
+
+    with GraphEmulator(users=10, groups=10, memberships_per_user=2):
+        group, membership, added = asyncio.run(run())
+
+    assert isinstance(group, models.OperationResult) and group.group_name == 'Group-0000003'
+    assert isinstance(membership, models.OperationResult) and len(membership.groups) == 2
+    assert isinstance(added, models.OperationResult) and added.status_code == 204
+
+def test_reconcile_dry_run_plans_minimal_changes():
+    desired = ['user3@contoso.test', 'USER13@contoso.test', 'user5@contoso.test', 'user99@contoso.test']
+
+    with GraphEmulator(users=20, groups=10, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        plan = reconcile_group_membership('Group-0000003', desired, client, dry_run=True)
+        members = emulator.directory.group_members(3)
+        client.close()
+
+    assert plan['group_id'] == '00000000-0000-4000-9000-000000000003'
+    assert plan['to_add'] == {'user5@contoso.test': '00000000-0000-4000-8000-000000000005'}
+    assert sorted(plan['to_remove']) == ['user12@contoso.test', 'user2@contoso.test']
+    assert plan['unchanged'] == 2
+    assert plan['unresolved']['user99@contoso.test']['status_code'] == 404
+    assert 'results' not in plan
+    assert members == [2, 3, 12, 13]
+
+def test_reconcile_applies_plan_and_is_idempotent():
+    group_id = '00000000-0000-4000-9000-000000000003'
+    desired = ['user3@contoso.test', '00000000-0000-4000-8000-000000000013', 'user5@contoso.test', 'user6@contoso.test']
+
+    with GraphEmulator(users=20, groups=10, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        result = reconcile_group_membership(None, desired, client, group_id=group_id)
+        members = emulator.directory.group_members(3)
+
+        requests_before = emulator.stats.snapshot()['requests']
+        second_plan = plan_group_membership(None, desired, client, group_id=group_id)
+        second_run_requests = emulator.stats.snapshot()['requests'] - requests_before
+        client.close()
+
+    assert members == [3, 5, 6, 13]
+    assert result['results']['user5@contoso.test'] == {'status_code': 204, 'message': 'User user5@contoso.test added to AAD group 00000000-0000-4000-9000-000000000003 successfully.'}
+    assert result['results']['user2@contoso.test']['status_code'] == 204
+    assert second_plan['to_add'] == {} and second_plan['to_remove'] == {}
+    assert second_plan['unchanged'] == 4
+    assert second_run_requests == 1
+
+def test_reconcile_keeps_extra_members_when_asked():
+    with GraphEmulator(users=20, groups=10, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        result = reconcile_group_membership('Group-0000003', ['user4@contoso.test'], client, remove_extra_members=False)
+        members = emulator.directory.group_members(3)
+        client.close()
+
+    assert result['to_remove'] == {}
+    assert members == [2, 3, 4, 12, 13]
+
+def test_group_directory_resolves_names_locally():
+    with GraphEmulator(users=10, groups=120) as emulator:
+        client = GraphClient('fake_access_token')
+        directory = GroupDirectory(client)
+        directory.refresh()
+        requests_after_load = emulator.stats.snapshot()['requests']
+
+        unique = directory.get_group_by_name('Group-0000119')
+        ambiguous = directory.get_group_by_name('000011')
+        missing = directory.get_group_by_name('Grp')
+        prefix = directory.find('Group-000010', match='prefix')
+        exact = directory.find('Group-0000010', match='exact')
+        short = directory.find('-', match='substring')
+
+        requests_after_lookups = emulator.stats.snapshot()['requests']
+        client.close()
+
+    assert len(directory) == 120
+    assert unique == {'status_code': 200, 'group_id': '00000000-0000-4000-9000-000000000119', 'group_name': 'Group-0000119'}
+    assert ambiguous == {'status_code': 200, 'message': 'Too much AAD group that contains 000011 found. Try another name.'}
+    assert missing == {'status_code': 404, 'message': 'No AAD group that contains Grp found. Try another name.'}
+    assert [group['displayName'] for group in prefix] == [f'Group-000010{index}' for index in range(10)]
+    assert exact == [{'displayName': 'Group-0000010', 'id': '00000000-0000-4000-9000-000000000010'}]
+    assert len(short) == 120
+    assert requests_after_lookups == requests_after_load
+
+def test_group_directory_applies_renames_incrementally():
+    with GraphEmulator(users=10, groups=20) as emulator:
+        client = GraphClient('fake_access_token')
+        directory = GroupDirectory(client, refresh_interval=0)
+        directory.refresh()
+
+        client.patch(f'{emulator.graph_base_url}/groups/00000000-0000-4000-9000-000000000004', json={'displayName': 'block-usb-group'})
+        renamed = directory.get_group_by_name('block-usb')
+        old_name = directory.get_group_by_name('Group-0000004')
+        client.close()
+
+    assert renamed['group_id'] == '00000000-0000-4000-9000-000000000004'
+    assert old_name['status_code'] == 404
+    assert len(directory) == 20
+
+def test_graph_utils_use_client_group_directory():
+    with GraphEmulator(users=10, groups=20, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        client.group_directory = GroupDirectory(client)
+
+        added = add_user_to_group('user1@contoso.test', 'Group-0000009', client)
+        user_group = get_user_group_by_name('00000000-0000-4000-8000-000000000001', 'Group-0000009', client)
+        client.close()
+
+    assert added['status_code'] == 204
+    assert user_group == {'status_code': 200, 'group_id': '00000000-0000-4000-9000-000000000009', 'group_name': 'Group-0000009'}
+
+def test_models_behave_like_result_dicts():
+    user = models.User(status_code=200, id='user-id', upn='user@example.com')
+    result = models.OperationResult(status_code=200, groups=[models.Group(display_name='Group-A', id='group-a')])
+
+    assert user == {'status_code': 200, 'id': 'user-id', 'upn': 'user@example.com'}
+    assert user.get('job_title') is None and 'job_title' not in user
+    assert user.upn == 'user@example.com'
+    with pytest.raises(KeyError):
+        user['job_title']
+    assert not hasattr(user, '__dict__')
+    assert json.loads(json.dumps(result)) == {'status_code': 200, 'groups': [{'displayName': 'Group-A', 'id': 'group-a'}]}
+
+def test_get_user_from_upn_selects_only_requested_properties():
+    with GraphEmulator(users=10, groups=5) as emulator:
+        client = GraphClient('fake_access_token')
+        default = get_user_from_upn('user3@contoso.test', client)
+        selected = get_user_from_upn('user3@contoso.test', client, select=['upn', 'accountEnabled', 'displayName'])
+        client.close()
+
+    assert default == {'status_code': 200, 'id': '00000000-0000-4000-8000-000000000003', 'upn': 'user3@contoso.test', 'job_title': 'Engineer'}
+    assert selected == {'status_code': 200, 'id': '00000000-0000-4000-8000-000000000003', 'upn': 'user3@contoso.test',
+                        'display_name': 'User 3', 'account_enabled': True}
+
+def test_iterators_project_selected_properties():
+    with GraphEmulator(users=10, groups=5, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        members = list(iter_group_members('00000000-0000-4000-9000-000000000001', client, select=['jobTitle']))
+        groups = list(iter_groups(client, select='id'))
+        client.close()
+
+    assert members and all(set(member) == {'job_title', 'id'} for member in members)
+    assert groups[0] == {'id': '00000000-0000-4000-9000-000000000000'}
+
+def test_scheduler_admits_urgent_requests_first():
+    scheduler = scheduling.PriorityScheduler(max_concurrency=1)
+    release = threading.Event()
+    order = []
+
+    def send(name):
+        def run():
+            if name == 'running':
+                release.wait()
+            order.append(name)
+        return run
+
+    running = threading.Thread(target=scheduler.run, args=(scheduling.BULK, send('running')))
+    running.start()
+    time.sleep(0.05)
+    queued = [threading.Thread(target=scheduler.run, args=(level, send(level))) for level in (scheduling.BULK, scheduling.NORMAL, scheduling.CRITICAL)]
+    for thread in queued:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in [running] + queued:
+        thread.join()
+
+    assert order == ['running', 'critical', 'normal', 'bulk']
+    assert scheduler.snapshot()['overtook'] == {'critical': 1, 'normal': 1, 'bulk': 0}
+
+def test_scheduler_reservations_and_latency_budget():
+    scheduler = scheduling.PriorityScheduler(max_concurrency=3, reservations={scheduling.CRITICAL: 1}, latency_budgets={scheduling.CRITICAL: 0.05})
+    scheduler.acquire(scheduling.BULK)
+    scheduler.acquire(scheduling.BULK)
+    blocked = threading.Thread(target=scheduler.acquire, args=(scheduling.BULK,))
+    blocked.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    scheduler.acquire(scheduling.CRITICAL)
+    reserved_wait = time.monotonic() - started
+    started = time.monotonic()
+    scheduler.acquire(scheduling.CRITICAL)
+    budget_wait = time.monotonic() - started
+    snapshot = scheduler.snapshot()
+
+    assert blocked.is_alive() and snapshot['waiting']['bulk'] == 1
+    assert reserved_wait < 0.04 and 0.04 <= budget_wait < 1
+    assert snapshot['over_limit']['critical'] == 1 and snapshot['in_flight'] == {'critical': 2, 'normal': 0, 'bulk': 2}
+    for level in (scheduling.CRITICAL, scheduling.CRITICAL, scheduling.BULK):
+        scheduler.release(level)
+    blocked.join(1)
+    assert not blocked.is_alive()
+
+    limiter = throttling.AdaptiveRateLimiter(max_rate=1)
+    limiter.reserve()
+    assert limiter.reserve() > 0.5
+    assert scheduler.pace(scheduling.CRITICAL, limiter).reserve() == 0
+    assert scheduler.pace(scheduling.BULK, limiter) is limiter
+
+def test_operations_run_at_their_default_priority():
+    with GraphEmulator(users=10, groups=5) as emulator:
+        scheduler = scheduling.PriorityScheduler(max_concurrency=4)
+        client = GraphClient('fake_access_token', scheduler=scheduler)
+        user_revoke_sessions('user1@contoso.test', client)
+        user_set_account_status('user1@contoso.test', False, client)
+        user_set_account_status('user1@contoso.test', True, client)
+        add_users_to_group(['user2@contoso.test'], 'Group-0000001', client)
+        with scheduling.priority(scheduling.BULK):
+            user_revoke_sessions('user3@contoso.test', client)
+        client.close()
+
+    admitted = scheduler.snapshot()['admitted']
+    assert admitted['critical'] == 2 and admitted['normal'] == 1
+    assert admitted['bulk'] >= 3
+
+def test_prefetched_pages_keep_the_caller_priority():
+    with GraphEmulator(users=10, groups=25):
+        scheduler = scheduling.PriorityScheduler(max_concurrency=4)
+        client = GraphClient('fake_access_token', scheduler=scheduler)
+        with scheduling.priority(scheduling.BULK):
+            groups = list(iter_groups(client, page_size=5, prefetch=True))
+        client.close()
+
+    admitted = scheduler.snapshot()['admitted']
+    assert len(groups) == 25
+    assert admitted['bulk'] == 5 and admitted['normal'] == 0
+
+def test_lockdown_users_batches_steps_concurrently():
+    upns = [f'user{index}@contoso.test' for index in range(300)]
+    with GraphEmulator(users=300, groups=5, latency=0.05) as emulator:
+        client = GraphClient('fake_access_token')
+        report = lockdown_users(upns, client, passwords={'user0@contoso.test': 'Given-Passw0rd!'})
+        disabled = [emulator.directory.user(index)['accountEnabled'] for index in (0, 150, 299)]
+        stats = emulator.stats.snapshot()
+        client.close()
+
+    assert report['succeeded'] == 300 and report['failed'] == 0
+    assert stats['requests'] == 50 and stats['batch_requests'] == 900
+    assert report['elapsed_seconds'] < 2
+    assert disabled == [False, False, False]
+    assert set(report['users']['user5@contoso.test']['steps']) == {'disable', 'revoke_sessions', 'reset_password'}
+    assert report['users']['user5@contoso.test']['steps']['revoke_sessions']['status_code'] == 200
+    assert 'password' not in report['users']['user0@contoso.test'] and len(report['users']['user5@contoso.test']['password']) == 24
+
+def test_lockdown_users_reports_failed_steps_per_user():
+    with GraphEmulator(users=10, groups=5) as emulator:
+        client = GraphClient('fake_access_token')
+        report = client.lockdown_users(['user1@contoso.test', 'ghost@contoso.test'], steps=('disable', 'revoke_sessions'))
+        client.close()
+
+    assert report['succeeded'] == 1 and report['failed'] == 1
+    assert report['users']['ghost@contoso.test']['ok'] is False
+    assert report['users']['ghost@contoso.test']['steps']['disable']['status_code'] == 404
+    assert 'password' not in report['users']['user1@contoso.test']
+    with pytest.raises(ValueError):
+        lockdown_users(['user1@contoso.test'], client, steps=('delete',))
+
+def test_generate_password_contains_every_character_class():
+    password = generate_password()
+    assert len(password) == 24
+    assert any(c.islower() for c in password) and any(c.isupper() for c in password)
+    assert any(c.isdigit() for c in password) and any(not c.isalnum() for c in password)
+
+def test_http2_transport_multiplexes_requests_over_one_connection():
+    pytest.importorskip('h2')
+    with GraphEmulator(users=100, groups=5, latency=0.05, http2=True) as emulator:
+        transport = HTTP2Transport(prior_knowledge=True)
+        client = GraphClient('fake_access_token', transport=transport)
+        response = client.request('GET', f'{config.GRAPH_BASE_URL_USER}/user1@contoso.test')
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            results = list(executor.map(lambda index: get_user_from_upn(f'user{index}@contoso.test', client), range(100)))
+        stats = emulator.stats.snapshot()
+        client.close()
+        transport.close()
+
+    assert response.http_version == 'HTTP/2' and response.json()['userPrincipalName'] == 'user1@contoso.test'
+    assert [result['upn'] for result in results] == [f'user{index}@contoso.test' for index in range(100)]
+    assert stats['connections'] == 1 and transport.stats.snapshot()['requests'] == 101
+
+def test_http2_transport_falls_back_to_http1_without_prior_knowledge():
+    pytest.importorskip('h2')
+    with GraphEmulator(users=10, groups=5) as emulator:
+        transport = HTTP2Transport()
+        client = GraphClient('fake_access_token', transport=transport)
+        result = get_user_from_upn('user1@contoso.test', client)
+        client.close()
+
+    assert result['status_code'] == 200
+    assert transport.stats.snapshot() == {'connections': 0, 'requests': 0, 'http1_requests': 1}
+
+def test_transport_benchmark_reports_throughput_and_sockets():
+    pytest.importorskip('h2')
+    results = run_transport_benchmark(requests=40, concurrency=(20,), latency=0.01, users=100)
+
+    assert [(result['transport'], result['concurrency']) for result in results] == [('http1', 20), ('http2', 20)]
+    assert all(result['errors'] == 0 and result['requests_per_second'] > 0 for result in results)
+    assert results[1]['connections'] == 1 < results[0]['connections']
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('graph-http2')]
+
+class ScriptedTransport:
+    """Answers user lookups after the delay and with the status returned by script(call number, url)."""
+
+    def __init__(self, script):
+        self.script = script
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers=None, **kwargs):
+        with self.lock:
+            self.calls = self.calls + 1
+            call = self.calls
+        delay, status = self.script(call, url)
+        time.sleep(delay)
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        upn = url.rsplit('/', 1)[-1]
+        body = {'id': f'id-{upn}', 'userPrincipalName': upn} if status < 400 else {'error': {'message': 'Service failure.'}}
+        response._content = json.dumps(body).encode()
+        return response
+
+    def close(self):
+        pass
+
+def test_hedging_answers_slow_reads_with_the_backup_request():
+    transport = ScriptedTransport(lambda call, url: (1.0 if call == 1 else 0.0, 200))
+    policy = hedging.HedgingPolicy(delay=0.05, budget=1)
+    client = GraphClient('fake_access_token', transport=transport, hedging=policy, coalescer=coalescing.RequestCoalescer(False))
+
+    started = time.monotonic()
+    result = get_user_from_upn('slow.user@domain.com', client)
+    elapsed = time.monotonic() - started
+    client.patch('https://graph.microsoft.com/v1.0/users/slow.user@domain.com', json={})
+
+    assert result['upn'] == 'slow.user@domain.com' and elapsed < 0.5
+    assert policy.snapshot()['hedged'] == 1 and policy.snapshot()['hedge_wins'] == 1
+    assert policy.snapshot()['requests'] == 1 and transport.calls == 3
+    policy.close()
+
+def test_hedging_delay_follows_endpoint_latency_and_budget():
+    transport = ScriptedTransport(lambda call, url: (0.01, 200))
+    policy = hedging.HedgingPolicy(percentile=90, initial_delay=5, min_samples=10, budget=0)
+    client = GraphClient('fake_access_token', transport=transport, hedging=policy)
+    endpoint = metrics.endpoint_template('https://graph.microsoft.com/v1.0/users/user@domain.com')
+
+    assert policy.delay(endpoint) == 5
+    for index in range(10):
+        get_user_from_upn(f'user{index}@domain.com', client)
+    time.sleep(0.05)
+    assert 0.01 <= policy.delay(endpoint) < 0.5
+
+    transport.script = lambda call, url: (0.6, 200)
+    assert get_user_from_upn('late.user@domain.com', client)['status_code'] == 200
+    assert policy.snapshot()['over_budget'] == 1 and policy.snapshot()['hedged'] == 0
+    policy.close()
+
+def test_hedging_does_not_cap_concurrent_reads_at_its_pool_size():
+    transport = ScriptedTransport(lambda call, url: (0.2, 200))
+    policy = hedging.HedgingPolicy(delay=5, max_workers=2)
+    client = GraphClient('fake_access_token', transport=transport, hedging=policy, coalescer=coalescing.RequestCoalescer(False))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=40) as executor:
+        results = list(executor.map(lambda index: get_user_from_upn(f'user{index}@domain.com', client), range(40)))
+    elapsed = time.monotonic() - started
+    endpoint = metrics.endpoint_template('https://graph.microsoft.com/v1.0/users/user@domain.com')
+
+    assert all(result['status_code'] == 200 for result in results) and elapsed < 1.0
+    assert 0.2 <= max(policy._latencies[endpoint]) < 0.4
+    policy.close()
+
+def test_circuit_breaker_fails_fast_serves_cache_and_recovers():
+    failing = set()
+    transport = ScriptedTransport(lambda call, url: (0.0, 500 if url.rsplit('/', 1)[-1] in failing else 200))
+    breaker = circuit_breaker.CircuitBreaker(min_requests=4, open_seconds=0.2, fallback_cache=TTLCache())
+    client = GraphClient('fake_access_token', transport=transport, circuit_breaker=breaker,
+                         retry_policy=throttling.RetryPolicy(max_retries=0))
+
+    assert get_user_from_upn('cached.user@domain.com', client)['status_code'] == 200
+    failing.update({'cached.user@domain.com', 'other.user@domain.com'})
+    for _ in range(3):
+        assert get_user_from_upn('other.user@domain.com', client)['status_code'] == 500
+    endpoint = metrics.endpoint_template('https://graph.microsoft.com/v1.0/users/other.user@domain.com')
+    assert breaker.state(endpoint) == circuit_breaker.OPEN
+
+    calls = transport.calls
+    rejected = get_user_from_upn('other.user@domain.com', client)
+    cached = get_user_from_upn('cached.user@domain.com', client)
+    assert transport.calls == calls
+    assert rejected['status_code'] == 503 and 'suspended' in rejected['message']
+    assert cached['upn'] == 'cached.user@domain.com'
+
+    failing.clear()
+    time.sleep(0.25)
+    assert get_user_from_upn('other.user@domain.com', client)['status_code'] == 200
+    assert breaker.state(endpoint) == circuit_breaker.CLOSED
+    snapshot = breaker.snapshot()
+    assert snapshot['opened'] == 1 and snapshot['closed'] == 1 and snapshot['probes'] == 1
+    assert snapshot['rejected'] == 2 and snapshot['served_from_cache'] == 1 and snapshot['open_circuits'] == {}
+
+def record_run(path):
+    metrics.enable()
+    try:
+        with GraphEmulator(users=20, groups=5, memberships_per_user=2, latency=0.02):
+            recorder = RecordingTransport(str(path))
+            client = GraphClient('secret-access-token', transport=recorder)
+            add_user_to_group('user1@contoso.test', 'Group-0000003', client)
+            groups = get_user_membership_groups('user2@contoso.test', client)
+            user_reset_password('user3@contoso.test', 'Very-Secret-Passw0rd!', client)
+            recorder.close()
+    finally:
+        metrics.disable()
+    return groups
+
+def test_recording_appends_redacted_request_response_pairs(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    record_run(path)
+    first = read_records(str(path))
+    record_run(path)
+    text = path.read_text()
+    records = read_records(str(path))
+
+    assert len(records) == 2 * len(first) and len({record['s'] for record in records}) == 2
+    assert 'Very-Secret-Passw0rd!' not in text and 'secret-access-token' not in text
+    reset = next(record for record in first if record['m'] == 'PATCH')
+    assert reset['b']['passwordProfile']['password'] == '***' and reset['op'] == 'user_reset_password'
+    assert {'add_user_to_group', 'get_user_membership_groups'} <= {record['op'] for record in first}
+    assert all(record['d'] >= 0.02 for record in first)
+
+def test_replay_serves_recorded_responses_at_scaled_speed(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    recorded_groups = record_run(path)
+    records = read_records(str(path))
+    lookup = next(record for record in records if record['op'] == 'get_user_membership_groups')
+
+    client = GraphClient('another-token', transport=ReplayTransport(str(path), speed=None))
+    assert get_user_membership_groups('user2@contoso.test', client) == recorded_groups
+    assert add_user_to_group('user1@contoso.test', 'Group-0000003', client)['status_code'] == 204
+    assert get_user_from_upn('unknown@contoso.test', client)['status_code'] == 404
+
+    transport = ReplayTransport(records, speed=2)
+    started = time.monotonic()
+    transport.request(lookup['m'], lookup['u'].replace('127.0.0.1', 'localhost'))
+    assert lookup['d'] / 2 <= time.monotonic() - started < lookup['d']
+    assert transport.stats.snapshot() == {'served': 1, 'unmatched': 0}
+
+def test_replay_matches_requests_with_a_body_on_their_body(tmp_path):
+    path = str(tmp_path / 'run.jsonl')
+    with GraphEmulator(users=20, groups=5, memberships_per_user=1) as emulator:
+        group_ids = [emulator.directory.group(j)['id'] for j in range(5)]
+        recorder = RecordingTransport(path)
+        client = GraphClient('fake_access_token', transport=recorder)
+        recorded = [check_member_groups('user1@contoso.test', group_ids[:3], client),
+                    check_member_groups('user1@contoso.test', group_ids[1:], client)]
+        user_reset_password('user3@contoso.test', 'Recorded-Passw0rd!', client)
+        recorder.close()
+
+    client = GraphClient('fake_access_token', transport=ReplayTransport(path, speed=None))
+    replayed = [check_member_groups('user1@contoso.test', group_ids[1:], client),
+                check_member_groups('user1@contoso.test', group_ids[:3], client)]
+    reset = user_reset_password('user3@contoso.test', 'Another-Passw0rd!', client)
+
+    assert replayed == recorded[::-1]
+    assert recorded[0]['groups'] != recorded[1]['groups']
+    assert reset['status_code'] == 204      # bodies are matched after redaction
+
+def test_generate_load_replays_the_call_mix_at_higher_concurrency(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    record_run(path)
+    records = read_records(str(path))
+
+    report = generate_load(str(path), multipliers=(1, 4), speed=4)
+
+    assert [run['concurrency'] for run in report['runs']] == [1, 4]
+    assert [run['requests'] for run in report['runs']] == [len(records), 4 * len(records)]
+    assert all(run['errors'] == 0 for run in report['runs'])
+    assert report['runs'][1]['requests_per_second'] > report['runs'][0]['requests_per_second']
+    assert report['ceiling'] is report['runs'][1]
+    assert report['mix']['add_user_to_group'] == 1 and report['mix']['get_user_from_upn'] == 1
+
+def test_nested_groups_resolve_effective_memberships_with_cycles():
+    nested = NestedGroups()
+    nested.add_nested_group('all-staff', 'it')
+    nested.add_nested_group('it', 'helpdesk')
+    nested.add_nested_group('helpdesk', 'it')       # cycle
+    nested.add_nested_group('vpn-users', 'helpdesk')
+    nested.add_user('helpdesk', 'user-1', 'mario.rossi@domain.com')
+    nested.add_user('all-staff', 'user-2')
+
+    assert sorted(nested.effective_groups('mario.rossi@domain.com')) == ['all-staff', 'helpdesk', 'it', 'vpn-users']
+    assert sorted(nested.effective_members('all-staff')) == ['user-1', 'user-2']
+    assert sorted(nested.ancestors('it')) == ['all-staff', 'helpdesk', 'vpn-users']
+    assert sorted(nested.descendants('all-staff')) == ['helpdesk', 'it']
+    assert nested.is_effective_member('user-1', 'vpn-users') and not nested.is_effective_member('user-2', 'it')
+
+    nested.add_nested_group('security', 'all-staff')
+    assert 'security' in nested.effective_groups('user-1')
+    assert nested.snapshot()['closures_extended'] > 0
+
+    nested.remove_nested_group('vpn-users', 'helpdesk')
+    nested.remove_nested_group('helpdesk', 'it')
+    assert sorted(nested.effective_groups('user-1')) == ['all-staff', 'helpdesk', 'it', 'security']
+    assert nested.effective_members('vpn-users') == []
+    nested.remove_group('it')
+    assert nested.effective_groups('user-1') == ['helpdesk'] and nested.effective_members('all-staff') == ['user-2']
+
+def test_nested_groups_scale_to_tens_of_thousands_of_groups():
+    nested = NestedGroups()
+    for index in range(1, 30000):
+        nested.add_nested_group(f'group-{(index - 1) // 8}', f'group-{index}')
+    nested.add_nested_group('group-29999', 'group-0')  # cycle through the whole tree
+    for index in range(0, 30000, 3):
+        nested.add_user(f'group-{index}', f'user-{index}')
+
+    started = time.monotonic()
+    groups = nested.effective_groups('user-29997')
+    members = nested.effective_members('group-29999')
+    elapsed = time.monotonic() - started
+
+    assert {'group-0', 'group-29997', 'group-29999', 'group-3749'} <= set(groups) and len(groups) == 7
+    assert len(members) == 10000 and len(nested.effective_members('group-1')) == 1560
+    assert elapsed < 2
+    started = time.monotonic()
+    nested.remove_nested_group('group-29999', 'group-0')
+    assert sorted(nested.effective_groups('user-3')) == ['group-0', 'group-3']
+    assert time.monotonic() - started < 2
+
+def test_nested_groups_reads_survive_concurrent_group_removal():
+    nested = NestedGroups()
+    nested.add_user('g0', 'u1', 'user1@domain.com')
+    stop = threading.Event()
+    errors = []
+
+    def churn():
+        while not stop.is_set():
+            for index in range(1, 50):
+                nested.add_group(f'g{index}', f'Group {index}')
+                nested.add_nested_group(f'g{index}', f'g{index - 1}')
+            for index in range(1, 50):
+                nested.remove_group(f'g{index}')
+
+    def read():
+        try:
+            while not stop.is_set():
+                assert nested.get_user_membership_groups('user1@domain.com')['status_code'] == 200
+                nested.is_user_member_of('user1@domain.com', 'Group 49')
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=churn)] + [threading.Thread(target=read) for _ in range(2)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)     # switch threads often, so reads interleave with removals
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+
+def test_client_nested_groups_answer_membership_locally():
+    with GraphEmulator(users=30, groups=6, memberships_per_user=1) as emulator:
+        nested = NestedGroups(GraphClient('fake_access_token'))
+        assert nested.sync()['groups'] == 6
+        direct = get_user_membership_groups('user1@contoso.test', GraphClient('fake_access_token'))
+        direct_ids = [group['id'] for group in direct['groups']]
+        parent = next(group_id for group_id in nested.ancestors(direct_ids[0]) + [emulator.directory.group(5)['id']]
+                      if group_id not in direct_ids)
+        nested.apply_group_delta({'id': parent, 'members@delta': [{'@odata.type': '#microsoft.graph.group', 'id': direct_ids[0]}]})
+
+        client = GraphClient('fake_access_token', nested_groups=nested)
+        requests_before = emulator.stats.snapshot()['requests']
+        result = get_user_membership_groups('user1@contoso.test', client)
+        member = is_user_member_of('user1@contoso.test', emulator.directory.group(5)['displayName'], client)
+        assert emulator.stats.snapshot()['requests'] == requests_before + 1   # the UPN is resolved once
+
+    assert sorted(group['id'] for group in result['groups']) == sorted(direct_ids + [parent])
+    assert member is True
+    assert emulator.directory.user_id(1) in nested.effective_members(parent)
+
+
+def test_snapshot_round_trips_users_groups_and_memberships(tmp_path):
+    path = str(tmp_path / 'tenant.snap')
+    with GraphEmulator(users=500, groups=20, memberships_per_user=3, page_size=100) as emulator:
+        user_set_account_status('user7@contoso.test', False, GraphClient('fake_access_token'))
+        result = export_snapshot(path, GraphClient('fake_access_token'))
+        directory = emulator.directory
+
+    assert (result['users'], result['groups'], result['memberships']) == (500, 20, 1500)
+    with TenantSnapshot.load(path) as snapshot:
+        key = snapshot.user_key('USER7@contoso.test')
+        assert snapshot.user_key(directory.user_id(7)) == key
+        user = snapshot.user(key)
+        group = snapshot.group(snapshot.group_key(directory.group(4)['id']))
+        members = {snapshot.user(member).id for member in snapshot.members_of(snapshot.group_key(directory.group(4)['id']))}
+        groups = [snapshot.group(group_key).display_name for group_key in snapshot.groups_of(key)]
+        assert snapshot.user_key('nobody@contoso.test') is None
+
+    assert (user.upn, user.display_name, user.account_enabled) == ('user7@contoso.test', directory.user(7)['displayName'], False)
+    assert (group.display_name, group.security_enabled) == (directory.group(4)['displayName'], directory.group(4)['securityEnabled'])
+    assert members == {directory.user_id(i) for i in range(500) if directory.is_member(i, 4)}
+    assert sorted(groups) == sorted(directory.group(j)['displayName'] for j in (7, 8, 9))
+
+
+def test_snapshot_loads_in_milliseconds_and_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'tenant.snap')
+    with GraphEmulator(users=20000, groups=200, memberships_per_user=5, page_size=999):
+        export_snapshot(path, GraphClient('fake_access_token'))
+
+    started = time.perf_counter()
+    snapshot = TenantSnapshot.load(path)
+    elapsed = time.perf_counter() - started
+    stats = snapshot.stats()
+    member = snapshot.is_member(snapshot.user_key('user19999@contoso.test'), snapshot.groups_of(19999)[0])
+    snapshot.close()
+
+    assert elapsed < 0.05
+    assert (stats['users'], stats['memberships']) == (20000, 100000)
+    assert member is True
+    (tmp_path / 'other.bin').write_bytes(b'not a snapshot')
+    with pytest.raises(ValueError):
+        TenantSnapshot.load(str(tmp_path / 'other.bin'))
+
+
+def test_snapshot_finds_disabled_users_in_privileged_groups(tmp_path):
+    path = str(tmp_path / 'tenant.snap')
+    with GraphEmulator(users=100, groups=10, memberships_per_user=2) as emulator:
+        client = GraphClient('fake_access_token')
+        for i in (3, 12, 45):
+            user_set_account_status(f'user{i}@contoso.test', False, client)
+        export_snapshot(path, client)
+        admins = emulator.directory.group(3)['displayName']
+
+    with TenantSnapshot.load(path) as snapshot:
+        privileged = snapshot.find_groups(admins.lower())
+        disabled = [user.upn for user in snapshot.disabled_privileged_members(privileged)]
+        views = len(snapshot._views)
+        mask = snapshot.disabled_mask()
+        assert snapshot.disabled_mask() == mask and len(snapshot._views) == views
+        assert snapshot.find_groups('') == list(range(snapshot.group_count))
+        everyone_privileged = snapshot.disabled_privileged_members(list(range(snapshot.group_count)))
+        default = snapshot.disabled_privileged_members()
+
+    assert len(privileged) == 1
+    assert disabled == ['user3@contoso.test', 'user12@contoso.test']   # group 3 holds users 2, 3, 12, 13, ...
+    assert bin(mask).count('1') == 3
+    assert len(everyone_privileged) == 3
+    assert default == []                        # no role-assignable groups in the emulator
+